@@ -1,21 +1,89 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
 
 from .models import CustomUser
 
+# Query string parameter holding the last email of the previous page
+CURSOR_VAR = "after"
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts a whole large table.
+
+    Unfiltered Postgres tables report the planner's row estimate, anything
+    else is counted up to `max_count` rows.
+    """
+
+    max_count = 10000
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where and connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > self.max_count:
+                self.estimated = True
+                return row[0]
+        return queryset.order_by()[: self.max_count].count()
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Pages through the default email ordering with an `after` cursor instead
+    of OFFSET, so deep pages cost the same as the first one. Sorting by
+    another column falls back to numbered pages.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.keyset = ORDER_VAR not in self.params and not self.show_all
+        self.next_page_url = None
+        if not self.keyset:
+            return
+        self.cursor = self.params.get(CURSOR_VAR)
+        queryset = self.queryset
+        if self.cursor:
+            queryset = queryset.filter(email__gt=self.cursor)
+        self.result_list = list(queryset[: self.list_per_page])
+        self.first_page_url = self.get_query_string(remove=[CURSOR_VAR, PAGE_VAR])
+        if len(self.result_list) == self.list_per_page:
+            self.next_page_url = self.get_query_string(
+                {CURSOR_VAR: self.result_list[-1].email}, [PAGE_VAR]
+            )
+
 
 class UserModelAdmin(BaseUserAdmin):
     # The fields to be used in displaying the User model.
     # These override the definitions on the base UserModelAdmin
     # that reference specific fields on auth.User.
     list_display = ("email", "is_admin", "last_login", "created_at", "updated_at")
+    # Boolean filters and the date hierarchy are served from indexes, unlike
+    # per-value filters which list every distinct value in the table
     list_filter = (
-        "email",
         "is_admin",
-        "last_login",
-        "created_at",
-        "updated_at",
+        "is_active",
+        "is_student",
+        "is_parent",
     )
+    date_hierarchy = "created_at"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         ("User Credentials", {"fields": ("email", "password", "user_hash")}),
         (
@@ -43,6 +111,8 @@ class UserModelAdmin(BaseUserAdmin):
                     "is_staff",
                     "is_student",
                     "is_parent",
+                    "groups",
+                    "user_permissions",
                 )
             },
         ),
@@ -66,8 +136,19 @@ class UserModelAdmin(BaseUserAdmin):
         ),
     )
     search_fields = ("email",)
-    ordering = ("email", "is_admin", "last_login", "created_at", "updated_at")
-    filter_horizontal = ()
+    # Emails are unique, so they alone give a stable order for the cursor
+    ordering = ("email",)
+    filter_horizontal = ("groups", "user_permissions")
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # Prefix match on the stored lowercase email, served by the unique
+        # email's pattern index instead of a full icontains scan
+        if not search_term:
+            return queryset, False
+        return queryset.filter(email__startswith=search_term.strip().lower()), False
 
 
 # Now register the new UserModelAdmin...
@@ -0,0 +1,94 @@
+"""
+Audit log of logins and account events.
+
+record() stamps an event and queues it for an AuditWriter, which appends
+events in batches on a daemon thread, so recording costs a request no
+query. AUDIT_SINK selects where events go: the append-only AuditEvent
+table, or one JSONL file per UTC day in AUDIT_LOG_DIR, each batch written
+with a single append. Events still queued when the process exits are
+written by an atexit hook; events beyond AUDIT_QUEUE_SIZE are dropped and
+counted in the audit_events_dropped metric.
+"""
+
+import atexit
+import datetime
+import json
+import os
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .metrics import Counter
+from .models import AuditEvent, make_user_hash
+from .workers import BatchWorker
+
+DROPPED = Counter("audit_events_dropped", "Audit events dropped on a full queue.")
+
+LOG_FILE_FORMAT = "audit-%Y-%m-%d.jsonl"
+
+
+def record(event, request=None, user=None, email=None, **detail):
+    """
+    Records `event` for `user`, or for the account `email` names when there
+    is no user. Extra keyword arguments are kept as the event's detail.
+    """
+    if not settings.AUDIT_SINK:
+        return
+    user_id = getattr(user, "pk", None)
+    if user_id is not None:
+        user_hash = user.user_hash
+    else:
+        user_hash = make_user_hash(str(email)) if email else ""
+    row = {
+        "created_at": timezone.now(),
+        "event": event,
+        "user_id": user_id,
+        "user_hash": user_hash,
+        "ip_address": request.META.get("REMOTE_ADDR") if request else None,
+        "detail": detail,
+    }
+    if not writer.put(row):
+        DROPPED.inc()
+
+
+def write_table(rows):
+    AuditEvent.objects.bulk_create(AuditEvent(**row) for row in rows)
+
+
+def log_path(day):
+    return os.path.join(settings.AUDIT_LOG_DIR, day.strftime(LOG_FILE_FORMAT))
+
+
+def write_log(rows):
+    days = {}
+    for row in rows:
+        day = row["created_at"].astimezone(datetime.timezone.utc).date()
+        days.setdefault(day, []).append(json.dumps(row, cls=DjangoJSONEncoder))
+    os.makedirs(settings.AUDIT_LOG_DIR, exist_ok=True)
+    for day, lines in days.items():
+        # One write per batch, so batches from several processes don't mix
+        with open(log_path(day), "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+SINKS = {"db": write_table, "jsonl": write_log}
+
+
+class AuditWriter(BatchWorker):
+    name = "audit-writer"
+
+    @property
+    def batch_size(self):
+        return settings.AUDIT_BATCH_SIZE
+
+    @property
+    def linger(self):
+        return settings.AUDIT_FLUSH_SECONDS
+
+    def write(self, batch):
+        SINKS[settings.AUDIT_SINK](batch)
+
+
+writer = AuditWriter(settings.AUDIT_QUEUE_SIZE)
+atexit.register(writer.flush)
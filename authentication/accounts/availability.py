@@ -0,0 +1,253 @@
+"""
+Whether emails and phone numbers are still free to register.
+
+find_taken() answers for any number of candidates with one query over the
+unique email and phone_number indexes. Emails are compared normalized, the
+way every write path stores them.
+
+check() first asks a Bloom filter of every registered email and phone
+number held by this process, and only queries for the candidates it can't
+rule out, so the common "free" answer of a typeahead costs no query. The
+filter is built on a background thread after first use, with check()
+querying for everything meanwhile, and caught up at most every
+AVAILABILITY_BLOOM_REFRESH seconds from the users created since, through
+the created_at index. Users saved in this process are added right away, so
+a registration in another process can go unseen for up to one refresh, and
+an email or phone number changed there until the filter is rebuilt, at
+least every AVAILABILITY_BLOOM_REBUILD seconds. That only ever affects the
+advice: the unique indexes still decide when the user registers. An
+AVAILABILITY_BLOOM_ERROR_RATE of 0 always queries.
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .metrics import Counter
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+CHECKED = Counter(
+    "availability_checks",
+    "Availability candidates checked, by what answered for them.",
+    ("source",),
+)
+
+# Users created this long before the last catch-up are read again, for
+# transactions that committed after it
+CATCH_UP_OVERLAP = timedelta(seconds=60)
+MIN_CAPACITY = 10000
+
+
+class BloomFilter:
+    """
+    Set of strings with no false negatives, and false positives for about
+    `error_rate` of the strings not in it while it holds at most `capacity`.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        # Counts re-added strings too, which only brings a rebuild forward
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        # Double hashing, all positions derived from two 64-bit hashes
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(
+            self.bits[position >> 3] & 1 << (position & 7)
+            for position in self._positions(item)
+        )
+
+
+def email_key(email):
+    return "email:" + email
+
+
+def phone_key(phone_number):
+    return "phone:" + phone_number
+
+
+class RegisteredFilter:
+    """
+    The process's Bloom filter of registered emails and phone numbers.
+    Refreshes run on a background thread unless `background` is False, and
+    never hold up add().
+    """
+
+    def __init__(self, background=True):
+        self.background = background
+        self._bloom = None
+        self._refreshed_at = 0
+        self._built_at = 0
+        self._seen_until = None
+        # Users added while a new filter is being built, None otherwise
+        self._pending = None
+        # Guards the filter's bits and _pending, only ever held briefly
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._thread = None
+
+    def get(self):
+        """
+        Returns the filter, or None when it is disabled or not built yet.
+        """
+        if not settings.AVAILABILITY_BLOOM_ERROR_RATE:
+            return None
+        age = time.monotonic() - self._refreshed_at
+        due = age >= settings.AVAILABILITY_BLOOM_REFRESH
+        # Callers keep using the filter as it was meanwhile
+        if (self._bloom is None or due) and self._refreshing.acquire(blocking=False):
+            if self.background:
+                self._thread = threading.Thread(
+                    target=self._refresh_in_background,
+                    name="availability-filter",
+                    daemon=True,
+                )
+                self._thread.start()
+            else:
+                try:
+                    self.refresh()
+                finally:
+                    self._refreshing.release()
+        return self._bloom
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Refreshing the availability filter failed")
+        finally:
+            # Retried after AVAILABILITY_BLOOM_REFRESH, not on every request
+            self._refreshed_at = time.monotonic()
+            self._refreshing.release()
+            connection.close()
+
+    def refresh(self):
+        """
+        Catches the filter up with the users created since the last refresh,
+        or builds a new one when there is none yet, it is full or it is older
+        than AVAILABILITY_BLOOM_REBUILD.
+        """
+        bloom = self._bloom
+        age = time.monotonic() - self._built_at
+        if (
+            bloom is None
+            or bloom.count > bloom.capacity
+            or age >= settings.AVAILABILITY_BLOOM_REBUILD
+        ):
+            self._rebuild()
+        else:
+            started = timezone.now()
+            rows = list(
+                CustomUser.objects.filter(
+                    created_at__gte=self._seen_until - CATCH_UP_OVERLAP
+                ).values_list("email", "phone_number")
+            )
+            with self._lock:
+                for email, phone_number in rows:
+                    bloom.add(email_key(email))
+                    bloom.add(phone_key(phone_number))
+            self._seen_until = started
+        self._refreshed_at = time.monotonic()
+
+    def _rebuild(self):
+        with self._lock:
+            self._pending = []
+        try:
+            built_at = time.monotonic()
+            started = timezone.now()
+            users = CustomUser.objects.all()
+            # Room for the users to double before the next rebuild
+            bloom = BloomFilter(
+                max(MIN_CAPACITY, 4 * users.count()),
+                settings.AVAILABILITY_BLOOM_ERROR_RATE,
+            )
+            rows = users.values_list("email", "phone_number")
+            for email, phone_number in rows.iterator(chunk_size=10000):
+                bloom.add(email_key(email))
+                bloom.add(phone_key(phone_number))
+            with self._lock:
+                for email, phone_number in self._pending:
+                    bloom.add(email_key(email))
+                    bloom.add(phone_key(phone_number))
+                self._bloom = bloom
+            self._built_at = built_at
+            self._seen_until = started
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def add(self, email, phone_number):
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(email_key(email))
+                self._bloom.add(phone_key(phone_number))
+            if self._pending is not None:
+                self._pending.append((email, phone_number))
+
+
+registered = RegisteredFilter()
+
+
+def find_taken(emails=(), phone_numbers=()):
+    """
+    Returns the sets of the normalized `emails` and of the `phone_numbers`
+    that are registered already, in one query.
+    """
+    emails, phone_numbers = set(emails), set(phone_numbers)
+    condition = Q()
+    if emails:
+        condition |= Q(email__in=emails)
+    if phone_numbers:
+        condition |= Q(phone_number__in=phone_numbers)
+    if not condition:
+        return set(), set()
+    rows = list(
+        CustomUser.objects.filter(condition).values_list("email", "phone_number")
+    )
+    return (
+        {email for email, _ in rows if email in emails},
+        {phone_number for _, phone_number in rows if phone_number in phone_numbers},
+    )
+
+
+def check(emails=(), phone_numbers=()):
+    """
+    Like find_taken(), only querying for the candidates the Bloom filter
+    doesn't rule out.
+    """
+    emails, phone_numbers = set(emails), set(phone_numbers)
+    bloom = registered.get()
+    if bloom is not None:
+        candidates = len(emails) + len(phone_numbers)
+        emails = {email for email in emails if email_key(email) in bloom}
+        phone_numbers = {
+            phone_number
+            for phone_number in phone_numbers
+            if phone_key(phone_number) in bloom
+        }
+        CHECKED.inc("bloom", amount=candidates - len(emails) - len(phone_numbers))
+    CHECKED.inc("database", amount=len(emails) + len(phone_numbers))
+    return find_taken(emails, phone_numbers)
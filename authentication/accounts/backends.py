@@ -0,0 +1,39 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Permission
+from django.db.models import Q
+
+from .cache import get_user
+from .constant import ROLE_GROUPS
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that loads the user for each authenticated request from
+    accounts.cache instead of the database.
+
+    Users also get the permissions of the groups named in ROLE_GROUPS for
+    their role flags. The permission set is computed once when the user is
+    cached and travels with it, so permission checks are set lookups.
+    """
+
+    def get_user(self, user_id):
+        user = get_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+    def _get_group_permissions(self, user_obj):
+        roles = [group for flag, group in ROLE_GROUPS.items() if getattr(user_obj, flag)]
+        return Permission.objects.filter(
+            Q(group__user=user_obj) | Q(group__name__in=roles)
+        ).distinct()
+
+    def get_all_permissions(self, user_obj, obj=None):
+        perms = super().get_all_permissions(user_obj, obj)
+        if obj is None and not hasattr(user_obj, "_perm_app_label_cache"):
+            user_obj._perm_app_label_cache = {perm.split(".", 1)[0] for perm in perms}
+        return perms
+
+    def has_module_perms(self, user_obj, app_label):
+        if not user_obj.is_active:
+            return False
+        self.get_all_permissions(user_obj)
+        return app_label in user_obj._perm_app_label_cache
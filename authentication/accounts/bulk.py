@@ -0,0 +1,329 @@
+"""
+Bulk import and export of users as CSV or JSON lines.
+
+Imports are processed in batches: passwords are hashed in parallel on a
+process pool, each batch is checked for existing emails and phone numbers in
+two queries, and users and their parent links are written with bulk_create,
+each batch in one transaction. A bad row, including a parent link that would
+make a cycle, is reported with its line number and skipped, it never aborts
+the import.
+
+Uploads through the API are saved to IMPORT_DIR, queued as UserImport rows
+and imported by `manage.py process_imports`, away from the request.
+"""
+
+import csv
+import io
+import json
+import logging
+from collections import defaultdict
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import family
+from .hashers import get_hash_process_pool
+from .models import CustomUser, UserImport, make_user_hash, normalize_email
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+
+IMPORT_FIELDS = (
+    "email",
+    "first_name",
+    "last_name",
+    "phone_number",
+    "gender",
+    "date_of_birth",
+    "blood_group",
+    "is_student",
+    "is_parent",
+    "city",
+    "state",
+    "country",
+)
+
+EXPORT_FIELDS = ("user_hash", *IMPORT_FIELDS, "is_active", "created_at")
+
+# Column holding the parents' emails, separated by ";"
+PARENTS_FIELD = "parent_emails"
+
+BOOLEAN_VALUES = {
+    "true": True,
+    "yes": True,
+    "1": True,
+    "false": False,
+    "no": False,
+    "0": False,
+}
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.linked = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append({"line": line, "error": message})
+
+    def as_dict(self):
+        return {"created": self.created, "linked": self.linked, "errors": self.errors}
+
+
+def read_rows(stream, fmt):
+    """
+    Yields `(line, row)` pairs from a text stream of CSV or JSON lines.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line, text in enumerate(stream, start=1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    yield line, None
+
+
+def _build_user(row):
+    data = {
+        field: row[field] for field in IMPORT_FIELDS if row.get(field) not in (None, "")
+    }
+    for flag in ("is_student", "is_parent"):
+        if isinstance(data.get(flag), str):
+            value = data[flag].strip().lower()
+            if value not in BOOLEAN_VALUES:
+                raise ValidationError({flag: ["Enter true or false."]})
+            data[flag] = BOOLEAN_VALUES[value]
+    if not data.get("email"):
+        raise ValidationError({"email": ["This field is required."]})
+    data["email"] = normalize_email(data["email"])
+    user = CustomUser(**data)
+    user.user_hash = make_user_hash(user.email)
+    user.full_clean(exclude=["password", "user_hash"], validate_unique=False)
+    return user
+
+
+def _parent_emails(row):
+    value = row.get(PARENTS_FIELD) or ""
+    if isinstance(value, str):
+        value = value.split(";")
+    return [normalize_email(email) for email in value if email.strip()]
+
+
+def _import_batch(batch, pool, report):
+    users = []
+    for line, row in batch:
+        if not isinstance(row, dict):
+            report.error(line, "Row is not a JSON object")
+            continue
+        try:
+            user = _build_user(row)
+        except (ValidationError, TypeError, ValueError) as e:
+            messages = e.message_dict if isinstance(e, ValidationError) else str(e)
+            report.error(line, messages)
+            continue
+        users.append((line, row, user))
+
+    # One query per unique column for the whole batch
+    emails = [user.email for _, _, user in users]
+    phones = [user.phone_number for _, _, user in users]
+    taken_emails = set(
+        CustomUser.objects.filter(email__in=emails).values_list("email", flat=True)
+    )
+    taken_phones = set(
+        CustomUser.objects.filter(phone_number__in=phones).values_list(
+            "phone_number", flat=True
+        )
+    )
+    accepted = []
+    for line, row, user in users:
+        if user.email in taken_emails:
+            report.error(line, "A user with this email already exists")
+        elif user.phone_number in taken_phones:
+            report.error(line, "A user with this phone number already exists")
+        else:
+            taken_emails.add(user.email)
+            taken_phones.add(user.phone_number)
+            accepted.append((line, row, user))
+
+    passwords = [row.get("password") or None for _, row, _ in accepted]
+    for (_, _, user), encoded in zip(
+        accepted, pool.map(make_password, passwords, chunksize=16)
+    ):
+        user.password = encoded
+
+    # Users and their parent links are committed together or not at all
+    with transaction.atomic():
+        accepted = _create_users(accepted, report)
+        _link_parents(accepted, report)
+
+
+def _create_users(accepted, report):
+    try:
+        with transaction.atomic():
+            CustomUser.objects.bulk_create([user for _, _, user in accepted])
+    except IntegrityError:
+        # Lost a race with another writer, fall back to row by row
+        created = []
+        for line, row, user in accepted:
+            try:
+                with transaction.atomic():
+                    user.save()
+                created.append((line, row, user))
+            except IntegrityError as e:
+                report.error(line, str(e))
+        accepted = created
+    report.created += len(accepted)
+    return accepted
+
+
+def _makes_cycle(children, parent_id, child_id):
+    """
+    Whether `parent_id` is `child_id` or among its descendants in `children`.
+    """
+    stack, seen = [child_id], set()
+    while stack:
+        user_id = stack.pop()
+        if user_id == parent_id:
+            return True
+        if user_id not in seen:
+            seen.add(user_id)
+            stack.extend(children[user_id])
+    return False
+
+
+def _link_parents(accepted, report):
+    wanted = {line: _parent_emails(row) for line, row, _ in accepted}
+    emails = {email for parent_emails in wanted.values() for email in parent_emails}
+    if not emails:
+        return
+    parent_ids = dict(
+        CustomUser.objects.filter(email__in=emails).values_list("email", "id")
+    )
+    Through = CustomUser.parents.through
+    # (parent, child) pairs, all new since the children were just created.
+    # The children have no other descendants yet, so a cycle can only run
+    # through this batch's links and is caught before touching the closure.
+    edges = {}
+    children = defaultdict(list)
+    for line, _, user in accepted:
+        for email in wanted[line]:
+            if email not in parent_ids:
+                report.error(
+                    line, "Parent %s not found, user created without it" % email
+                )
+            elif _makes_cycle(children, parent_ids[email], user.pk):
+                report.error(
+                    line,
+                    "Parent %s is a descendant of this user, user created "
+                    "without it" % email,
+                )
+            else:
+                edges[(parent_ids[email], user.pk)] = None
+                children[parent_ids[email]].append(user.pk)
+    Through.objects.bulk_create(
+        Through(from_customuser_id=child_id, to_customuser_id=parent_id)
+        for parent_id, child_id in edges
+    )
+    # bulk_create sends no m2m_changed, do what its receivers would
+    CustomUser.objects.filter(
+        pk__in={parent_id for parent_id, _ in edges}
+    ).update(updated_at=timezone.now())
+    family.add_edges(edges)
+    report.linked += len(edges)
+
+
+def import_users(stream, fmt="csv", batch_size=1000, processes=None):
+    """
+    Imports users from a text stream and returns an `ImportReport`.
+
+    Parents must appear earlier in the stream than their children, or
+    already exist.
+    """
+    report = ImportReport()
+    rows = read_rows(stream, fmt)
+    with get_hash_process_pool(processes) as pool:
+        while batch := list(islice(rows, batch_size)):
+            _import_batch(batch, pool, report)
+    return report
+
+
+def claim_import():
+    """
+    Returns the oldest pending UserImport, marked running so that other
+    workers skip it, or None.
+    """
+    with transaction.atomic():
+        job = (
+            UserImport.objects.select_for_update(skip_locked=True)
+            .filter(status=UserImport.PENDING)
+            .order_by("pk")
+            .first()
+        )
+        if job is not None:
+            job.status = UserImport.RUNNING
+            job.started_at = timezone.now()
+            job.save(update_fields=["status", "started_at"])
+    return job
+
+
+def process_imports(batch_size=1000, processes=None):
+    """
+    Runs queued imports until none is pending. Returns the number it ran.
+    """
+    count = 0
+    while job := claim_import():
+        try:
+            with job.file.open("rb") as upload:
+                stream = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+                report = import_users(stream, job.format, batch_size, processes)
+        except Exception as e:
+            # The batches before the failure stay imported
+            logger.exception("Import %s failed", job.pk)
+            job.status = UserImport.FAILED
+            job.report = {"detail": "%s: %s" % (type(e).__name__, e)}
+        else:
+            job.status = UserImport.DONE
+            job.report = report.as_dict()
+        job.file.delete(save=False)
+        job.finished_at = timezone.now()
+        job.save(update_fields=["status", "report", "file", "finished_at"])
+        count += 1
+    return count
+
+
+def export_users(fmt="csv", queryset=None, chunk_size=2000):
+    """
+    Yields the users in `queryset` as CSV or JSON lines, one chunk of text at
+    a time, without loading the table into memory.
+    """
+    if queryset is None:
+        queryset = CustomUser.objects.all()
+    queryset = queryset.order_by("pk").prefetch_related("parents")
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=[*EXPORT_FIELDS, PARENTS_FIELD])
+    if fmt == "csv":
+        writer.writeheader()
+    for count, user in enumerate(queryset.iterator(chunk_size=chunk_size), start=1):
+        row = {field: getattr(user, field) for field in EXPORT_FIELDS}
+        parents = [parent.email for parent in user.parents.all()]
+        if fmt == "csv":
+            row[PARENTS_FIELD] = ";".join(parents)
+            writer.writerow(row)
+        else:
+            row[PARENTS_FIELD] = parents
+            buffer.write(json.dumps(row, cls=DjangoJSONEncoder) + "\n")
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,145 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import CustomUser
+
+USER_KEY = "accounts:user:%s"
+USER_VERSION_KEY = "accounts:user:%s:version"
+PERMISSIONS_VERSION_KEY = "accounts:permissions:version"
+
+
+class LocalLRUCache:
+    """
+    Bounded in-process LRU with a per-entry TTL. Values are stored pickled
+    so every hit hands out a fresh copy.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        entry = (time.monotonic() + self.ttl, pickle.dumps(value))
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_users = LocalLRUCache(settings.USER_CACHE_LOCAL_SIZE, settings.USER_CACHE_LOCAL_TTL)
+
+
+def _new_version():
+    # Unique even if the version key was evicted, so old entries never match
+    return time.time_ns()
+
+
+def _get_version(entries, key):
+    version = entries.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), None)
+
+
+def get_user(user_id):
+    """
+    Returns the CustomUser with the given id, with its permission set
+    precomputed, or None.
+
+    Users come from the in-process LRU, which other processes' changes reach
+    within USER_CACHE_LOCAL_TTL seconds, then from the shared cache, where
+    entries are tagged with the user's version and the global permissions
+    version so writes made by any process invalidate them at once, and only
+    then from the database.
+    """
+    user = local_users.get(user_id)
+    if user is not None:
+        return user
+
+    version_key = USER_VERSION_KEY % user_id
+    entries = cache.get_many([version_key, PERMISSIONS_VERSION_KEY, USER_KEY % user_id])
+    version = (
+        _get_version(entries, version_key),
+        _get_version(entries, PERMISSIONS_VERSION_KEY),
+    )
+    entry = entries.get(USER_KEY % user_id)
+    if entry is not None and entry[0] == version:
+        user = entry[1]
+    else:
+        try:
+            # Never from a replica, a lagging copy would outlive the version bump
+            user = CustomUser._default_manager.using(DEFAULT_DB_ALIAS).get(pk=user_id)
+        except CustomUser.DoesNotExist:
+            return None
+        # Cached on the instance by the auth backends, and cached with it
+        user.get_all_permissions()
+        cache.set(USER_KEY % user_id, (version, user), settings.USER_CACHE_TIMEOUT)
+    local_users.set(user_id, user)
+    return user
+
+
+def invalidate_user(user_id):
+    """
+    Drops every cached copy of the user, called whenever the row or its
+    permissions change. Inside a transaction this waits for the commit, as a
+    concurrent get_user() could otherwise cache the old row under the new
+    version.
+    """
+    transaction.on_commit(lambda: _invalidate_user(user_id))
+
+
+def _invalidate_user(user_id):
+    local_users.delete(user_id)
+    _bump_version(USER_VERSION_KEY % user_id)
+    cache.delete(USER_KEY % user_id)
+
+
+def invalidate_permissions():
+    """
+    Drops every cached user, called when group permissions change. Waits for
+    the commit like invalidate_user().
+    """
+    transaction.on_commit(_invalidate_permissions)
+
+
+def _invalidate_permissions():
+    local_users.clear()
+    _bump_version(PERMISSIONS_VERSION_KEY)
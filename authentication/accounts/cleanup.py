@@ -0,0 +1,146 @@
+"""
+Incremental deletion of expired sessions and JWTs, and of delivered or
+failed outbox emails past OUTBOX_RETENTION_DAYS.
+
+Django's clearsessions and simplejwt's flushexpiredtokens delete every
+expired row in one statement, locking a large part of the table for as long
+as that takes. Collectors here delete at most a batch of rows per statement,
+found through an index, each batch in its own short transaction. Between
+batches they sleep long enough to keep to GC_DUTY_CYCLE of the wall time,
+and batches that run past GC_MAX_BATCH_SECONDS halve the batch size, so a
+collector can run continuously next to live traffic.
+"""
+
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from .metrics import Counter, Histogram
+from .models import OutboxEmail
+
+DELETED = Counter(
+    "gc_deleted_rows", "Expired rows deleted by accounts.cleanup.", ("table",)
+)
+BATCH_SECONDS = Histogram(
+    "gc_batch_seconds", "Time taken by one batch of deletes.", ("table",)
+)
+
+
+class SessionCollector:
+    """
+    Expired database sessions, oldest first through the expire_date index.
+    """
+
+    name = "sessions"
+
+    def __init__(self):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        # None for engines that keep sessions out of the database
+        get_model_class = getattr(store, "get_model_class", None)
+        self.model = get_model_class() if get_model_class else None
+
+    def collect_batch(self, now, size):
+        if self.model is None:
+            return 0
+        expired = self.model.objects.filter(expire_date__lt=now)
+        keys = list(
+            expired.order_by("expire_date").values_list("pk", flat=True)[:size]
+        )
+        if not keys:
+            return 0
+        # Checked again, a session may have been renewed since
+        deleted, _ = expired.filter(pk__in=keys).delete()
+        return deleted
+
+
+class TokenCollector:
+    """
+    Expired outstanding refresh tokens, with their blacklist entries. The
+    table has no expiry index, but ids grow with issue time and refresh
+    tokens share a lifetime, so it is walked in primary key order until a
+    batch turns up nothing expired.
+    """
+
+    name = "tokens"
+
+    def __init__(self):
+        self.last_pk = 0
+
+    def collect_batch(self, now, size):
+        rows = list(
+            OutstandingToken.objects.filter(pk__gt=self.last_pk)
+            .order_by("pk")
+            .values_list("pk", "expires_at")[:size]
+        )
+        expired = [pk for pk, expires_at in rows if expires_at <= now]
+        if not expired:
+            self.last_pk = 0
+            return 0
+        self.last_pk = rows[-1][0]
+        _, by_model = OutstandingToken.objects.filter(pk__in=expired).delete()
+        return by_model.get(OutstandingToken._meta.label, 0)
+
+
+class OutboxCollector:
+    """
+    Sent and failed outbox emails older than OUTBOX_RETENTION_DAYS. Ids grow
+    with created_at, so walking the primary key finds the oldest first.
+    """
+
+    name = "outbox"
+
+    def collect_batch(self, now, size):
+        done = OutboxEmail.objects.filter(
+            status__in=[OutboxEmail.SENT, OutboxEmail.FAILED],
+            created_at__lt=now - timedelta(days=settings.OUTBOX_RETENTION_DAYS),
+        )
+        pks = list(done.order_by("pk").values_list("pk", flat=True)[:size])
+        if not pks:
+            return 0
+        deleted, _ = OutboxEmail.objects.filter(pk__in=pks).delete()
+        return deleted
+
+
+COLLECTORS = {
+    "sessions": SessionCollector,
+    "tokens": TokenCollector,
+    "outbox": OutboxCollector,
+}
+
+
+def collect(names=COLLECTORS, batch_size=None, duty_cycle=None, progress=None):
+    """
+    Runs the named collectors until none of them finds expired rows, and
+    returns the number of rows each deleted. `progress` is called with a
+    collector's name, its total so far and its current batch size after
+    every batch.
+    """
+    batch_size = batch_size or settings.GC_BATCH_SIZE
+    duty_cycle = duty_cycle or settings.GC_DUTY_CYCLE
+    totals = {}
+    for name in names:
+        collector = COLLECTORS[name]()
+        size = batch_size
+        total = 0
+        while True:
+            start = time.perf_counter()
+            deleted = collector.collect_batch(timezone.now(), size)
+            elapsed = time.perf_counter() - start
+            BATCH_SECONDS.observe(elapsed, name)
+            if not deleted:
+                break
+            DELETED.inc(name, amount=deleted)
+            total += deleted
+            if elapsed > settings.GC_MAX_BATCH_SECONDS:
+                size = max(1, size // 2)
+            elif size < batch_size:
+                size = min(batch_size, size * 2)
+            if progress:
+                progress(name, total, size)
+            time.sleep(elapsed * (1 / duty_cycle - 1))
+        totals[name] = total
+    return totals
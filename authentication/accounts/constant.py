@@ -24,3 +24,10 @@ USER_TYPE_CHOICES = [
     ("1", "Parent"),
     ("2", "Other"),
 ]
+
+# Users get the permissions of the group named after each role flag they have
+ROLE_GROUPS = {
+    "is_student": "Student",
+    "is_parent": "Parent",
+    "is_staff": "Staff",
+}
@@ -0,0 +1,171 @@
+"""
+Transitive parent/child relationships.
+
+FamilyLink is the closure of the `parents` graph: one row for every pair of
+users where one is a parent, grandparent and so on of the other, with the
+number of distinct parent chains between them. Family lookups are then a
+single indexed join, whatever the number of hops.
+
+The closure is maintained incrementally from the m2m_changed and pre_delete
+signals, see accounts/signals.py. Adding the edge parent -> child adds
+paths(a, parent) * paths(child, d) chains to every pair (a, d) of an
+ancestor of the parent and a descendant of the child, both inclusive.
+Removing it subtracts them again, and pairs left without chains are
+deleted. Counting chains is what makes removal exact when a user is linked
+through several parents.
+
+Updates read the closure before writing it, and two edges added at once can
+each need the other's links, so updates are serialized with a transaction
+level advisory lock on Postgres. SQLite only ever runs one writer.
+"""
+
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import CustomUser, FamilyLink
+
+# pg_advisory_xact_lock() key shared by all closure updates, "family" in ASCII
+CLOSURE_LOCK_ID = 0x66616D696C79
+
+
+def descendants(user, **filters):
+    """
+    Children, grandchildren and so on of `user`, e.g. `descendants(parent,
+    is_student=True)` for all students under a parent.
+    """
+    return CustomUser.objects.filter(ancestor_links__ancestor=user, **filters)
+
+
+def ancestors(user, **filters):
+    """
+    Parents, grandparents and so on of `user`.
+    """
+    return CustomUser.objects.filter(descendant_links__descendant=user, **filters)
+
+
+def _lock_closure():
+    """
+    Holds off other closure updates until the current transaction ends.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CLOSURE_LOCK_ID])
+
+
+def _update_closure(parent_id, child_id, sign):
+    """
+    Adds (sign=1) or removes (sign=-1) the chains going through the edge
+    parent_id -> child_id. Raises ValueError when adding it makes a cycle.
+    """
+    above = {parent_id: 1}
+    below = {child_id: 1}
+    for ancestor_id, descendant_id, paths in FamilyLink.objects.filter(
+        Q(descendant_id=parent_id) | Q(ancestor_id=child_id)
+    ).values_list("ancestor_id", "descendant_id", "paths"):
+        if descendant_id == parent_id:
+            above[ancestor_id] = paths
+        if ancestor_id == child_id:
+            below[descendant_id] = paths
+    if sign > 0 and parent_id in below:
+        raise ValueError(
+            "User %s is already a descendant of %s" % (parent_id, child_id)
+        )
+
+    delta = {
+        (ancestor_id, descendant_id): above_paths * below_paths
+        for ancestor_id, above_paths in above.items()
+        for descendant_id, below_paths in below.items()
+    }
+    existing = FamilyLink.objects.filter(
+        ancestor_id__in=above, descendant_id__in=below
+    ).only("pk", "ancestor_id", "descendant_id", "paths")
+    changed, emptied = [], []
+    for link in existing:
+        link.paths += sign * delta.pop((link.ancestor_id, link.descendant_id))
+        if link.paths > 0:
+            changed.append(link)
+        else:
+            emptied.append(link.pk)
+    if changed:
+        FamilyLink.objects.bulk_update(changed, ["paths"])
+    if emptied:
+        FamilyLink.objects.filter(pk__in=emptied).delete()
+    if sign > 0 and delta:
+        FamilyLink.objects.bulk_create(
+            FamilyLink(ancestor_id=a_id, descendant_id=d_id, paths=paths)
+            for (a_id, d_id), paths in delta.items()
+        )
+
+
+def add_edges(edges):
+    """
+    Records `(parent_id, child_id)` edges that were just added to `parents`.
+    """
+    # A failure must undo the m2m change that triggered it, not just this
+    with transaction.atomic(savepoint=False):
+        _lock_closure()
+        for parent_id, child_id in edges:
+            _update_closure(parent_id, child_id, 1)
+
+
+def remove_edges(edges):
+    """
+    Records `(parent_id, child_id)` edges that were just removed from
+    `parents`.
+    """
+    with transaction.atomic(savepoint=False):
+        _lock_closure()
+        for parent_id, child_id in edges:
+            _update_closure(parent_id, child_id, -1)
+
+
+def rebuild(batch_size=5000, through=None, link_model=FamilyLink):
+    """
+    Recomputes the whole closure from `parents`, for backfilling. Returns
+    the number of links written. A migration passes its historical
+    `parents` through model and FamilyLink.
+    """
+    Through = through or CustomUser.parents.through
+    children = defaultdict(list)
+    for child_id, parent_id in Through.objects.values_list(
+        "from_customuser_id", "to_customuser_id"
+    ).iterator(chunk_size=batch_size):
+        children[parent_id].append(child_id)
+
+    # Path counts from each user to all of its descendants, memoized
+    closure = {}
+
+    def visit(user_id, stack=()):
+        if user_id in closure:
+            return closure[user_id]
+        if user_id in stack:
+            raise ValueError("The parents graph has a cycle through %s" % user_id)
+        counts = defaultdict(int)
+        for child_id in children.get(user_id, ()):
+            counts[child_id] += 1
+            for descendant_id, paths in visit(child_id, (*stack, user_id)).items():
+                counts[descendant_id] += paths
+        closure[user_id] = counts
+        return counts
+
+    total = 0
+    with transaction.atomic():
+        _lock_closure()
+        link_model.objects.all().delete()
+        batch = []
+        for parent_id in list(children):
+            for descendant_id, paths in visit(parent_id).items():
+                batch.append(
+                    link_model(
+                        ancestor_id=parent_id, descendant_id=descendant_id, paths=paths
+                    )
+                )
+            if len(batch) >= batch_size:
+                link_model.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        link_model.objects.bulk_create(batch)
+        total += len(batch)
+    return total
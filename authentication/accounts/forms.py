@@ -1,7 +1,35 @@
 from django import forms
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
 
+from .availability import find_taken
 from .constant import USER_TYPE_CHOICES
-from .models import CustomUser
+from .models import CustomUser, normalize_email
+
+REGISTRATION_STATE_SALT = "accounts.registration"
+
+
+def sign_user_type(user_type):
+    """
+    Returns a signed, timestamped token carrying `user_type` from the user
+    type page to the registration page, in place of a session.
+    """
+    return signing.TimestampSigner(salt=REGISTRATION_STATE_SALT).sign(user_type)
+
+
+def read_user_type(state):
+    """
+    Returns the user type signed into `state`, or None when it was tampered
+    with or is older than REGISTRATION_STATE_MAX_AGE.
+    """
+    try:
+        user_type = signing.TimestampSigner(salt=REGISTRATION_STATE_SALT).unsign(
+            state, max_age=settings.REGISTRATION_STATE_MAX_AGE
+        )
+    except signing.BadSignature:
+        return None
+    return user_type if user_type in dict(USER_TYPE_CHOICES) else None
 
 
 class SelectUserTypeForm(forms.Form):
@@ -38,8 +66,31 @@ class CustomUserCreationForm(forms.ModelForm):
             "password2": forms.PasswordInput(),
         }
 
+    def require_parent(self):
+        """
+        Adds a required `parent_user` field, for registering students.
+        """
+        # Parents are looked up through ParentSearchView as the user types
+        self.fields["parent_user"] = forms.IntegerField(
+            label="Select Parent",
+            required=True,
+            widget=forms.TextInput(
+                attrs={
+                    "list": "parent-options",
+                    "data-search-url": reverse("parent_search"),
+                    "autocomplete": "off",
+                }
+            ),
+        )
+
     def clean_email(self):
-        return self.cleaned_data["email"].lower()
+        return normalize_email(self.cleaned_data["email"])
+
+    def clean_parent_user(self):
+        parent_user_id = self.cleaned_data["parent_user"]
+        if not CustomUser.objects.filter(pk=parent_user_id, is_parent=True).exists():
+            raise forms.ValidationError("Select a valid parent")
+        return parent_user_id
 
     def clean_password2(self):
         password1 = self.cleaned_data.get("password1")
@@ -48,14 +99,34 @@ class CustomUserCreationForm(forms.ModelForm):
             raise forms.ValidationError("Passwords do not match")
         return password2
 
-    def save(self, commit=True):
+    def validate_unique(self):
+        # Email and phone number, the form's unique fields, in one query
+        # rather than one each
+        email = self.cleaned_data.get("email")
+        phone_number = self.cleaned_data.get("phone_number")
+        emails, phone_numbers = find_taken(
+            [email] if email else [], [phone_number] if phone_number else []
+        )
+        for field, taken in (("email", emails), ("phone_number", phone_numbers)):
+            if taken:
+                self.add_error(
+                    field, self.instance.unique_error_message(CustomUser, [field])
+                )
+
+    def save(self, commit=True, password_hash=None):
+        """
+        `password_hash` is password1 already hashed by the caller, as the
+        async registration view does on the password hashing pool.
+        """
         user = super().save(commit=False)
-        user.email = self.cleaned_data["email"].lower()
-        user.set_password(self.cleaned_data["password1"])
+        if password_hash is None:
+            user.set_password(self.cleaned_data["password1"])
+        else:
+            user.password = password_hash
         if commit:
             user.save()
             parent_user_id = self.cleaned_data.get("parent_user")
             if parent_user_id:
-                parent_user = CustomUser.objects.get(pk=parent_user_id)
-                user.parents.add(parent_user)
+                # Already checked by clean_parent_user
+                user.parents.add(parent_user_id)
         return user
@@ -0,0 +1,236 @@
+"""
+Geolocation of users' IP addresses from a local database.
+
+The database is a file of sorted, non-overlapping IP ranges, memory-mapped
+so that all worker processes share one copy of it through the page cache.
+Addresses are 128-bit big-endian integers, IPv4 mapped into IPv6, stored at
+a fixed width so comparing their bytes compares the integers, and a lookup
+is a binary search over the range starts. Recently seen IPs are answered
+from an LRU.
+
+Logins and registrations hand the user's IP to a GeoEnricher, which
+resolves it and writes ip_address, city, state and country on a background
+thread in batches, so requests never wait on it. Build the database from a
+CSV with `manage.py build_geoip`.
+"""
+
+import ipaddress
+import mmap
+import os
+import socket
+import struct
+from bisect import bisect_right
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import invalidate_user
+from .metrics import Counter
+from .models import CustomUser
+from .workers import BatchWorker
+
+MAGIC = b"GEO1"
+# Magic, range count, location count
+HEADER = struct.Struct(">4sII")
+# Range start, range end, location index
+RANGE = struct.Struct(">16s16sI")
+OFFSET = struct.Struct(">I")
+IPV4_MAPPED = b"\0" * 10 + b"\xff\xff"
+# Every INDEX_STRIDE-th range start is kept in memory, so that most of a
+# binary search runs in C and only the last steps read the mapped file
+INDEX_STRIDE = 64
+SEPARATOR = "\x1f"
+# Length of CustomUser.city, state and country
+FIELD_LENGTH = 30
+
+Location = namedtuple("Location", ["city", "state", "country"])
+
+ENRICHMENTS = Counter(
+    "geoip_enrichments",
+    "Users' IPs handed to the geolocation enricher, by outcome.",
+    ("result",),
+)
+
+
+def pack_ip(ip):
+    """
+    Returns `ip` as 16 big-endian bytes, IPv4 addresses mapped into IPv6.
+    Raises ValueError when it is not an IP address.
+    """
+    try:
+        return IPV4_MAPPED + socket.inet_pton(socket.AF_INET, ip)
+    except OSError:
+        pass
+    try:
+        return socket.inet_pton(socket.AF_INET6, ip)
+    except OSError:
+        raise ValueError("%r is not an IP address" % ip)
+
+
+class _Starts:
+    """
+    The range starts of a mapped database as a sequence, for bisect.
+    """
+
+    def __init__(self, buffer, count):
+        self.buffer = buffer
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        offset = HEADER.size + index * RANGE.size
+        return self.buffer[offset : offset + 16]
+
+
+class GeoDatabase:
+    def __init__(self, path, cache_size=None):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.range_count, self.location_count = HEADER.unpack_from(
+            self.buffer
+        )
+        if magic != MAGIC:
+            raise ValueError("%s is not a geolocation database" % path)
+        self.starts = _Starts(self.buffer, self.range_count)
+        self.index = [
+            self.starts[i] for i in range(0, self.range_count, INDEX_STRIDE)
+        ]
+        self.offsets_at = HEADER.size + self.range_count * RANGE.size
+        self.blob_at = self.offsets_at + (self.location_count + 1) * OFFSET.size
+        if cache_size is None:
+            cache_size = settings.GEOIP_CACHE_SIZE
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, ip):
+        """
+        Returns the Location of `ip`, or None when no range contains it or
+        it is not an IP address.
+        """
+        try:
+            key = pack_ip(ip)
+        except ValueError:
+            return None
+        block = bisect_right(self.index, key) - 1
+        if block < 0:
+            return None
+        low = block * INDEX_STRIDE
+        high = min(low + INDEX_STRIDE, self.range_count)
+        index = bisect_right(self.starts, key, low, high) - 1
+        _, end, location = RANGE.unpack_from(
+            self.buffer, HEADER.size + index * RANGE.size
+        )
+        if key > end:
+            return None
+        return self.location(location)
+
+    def location(self, index):
+        start, end = struct.unpack_from(
+            ">II", self.buffer, self.offsets_at + index * OFFSET.size
+        )
+        text = self.buffer[self.blob_at + start : self.blob_at + end].decode()
+        return Location(*(value or None for value in text.split(SEPARATOR)))
+
+    def close(self):
+        self.buffer.close()
+
+
+def write_database(path, ranges):
+    """
+    Writes a database of `(first_ip, last_ip, city, state, country)` ranges
+    to `path` and returns the number of ranges. The file is replaced
+    atomically, processes that have the old one mapped keep reading it.
+    """
+    locations = {}
+    records = []
+    for first, last, *names in ranges:
+        location = SEPARATOR.join((name or "")[:FIELD_LENGTH] for name in names)
+        index = locations.setdefault(location, len(locations))
+        records.append((pack_ip(first), pack_ip(last), index))
+    records.sort()
+    for (_, previous_end, _), (start, end, _) in zip(records, records[1:]):
+        if start <= previous_end:
+            raise ValueError("Overlapping ranges at %s" % ipaddress.ip_address(start))
+
+    blobs = [location.encode() for location in locations]
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records), len(blobs)))
+        for record in records:
+            f.write(RANGE.pack(*record))
+        offset = 0
+        for blob in blobs:
+            f.write(OFFSET.pack(offset))
+            offset += len(blob)
+        f.write(OFFSET.pack(offset))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+@lru_cache(maxsize=None)
+def get_database():
+    """
+    Returns this process's GeoDatabase, or None when GEOIP_DATABASE is not
+    set.
+    """
+    if not settings.GEOIP_DATABASE:
+        return None
+    return GeoDatabase(settings.GEOIP_DATABASE)
+
+
+class GeoEnricher(BatchWorker):
+    """
+    Resolves users' IPs and saves their location on a daemon thread.
+    Enrichment is best effort: IPs still queued when the process exits, or
+    beyond GEOIP_QUEUE_SIZE, are dropped, and picked up again on the user's
+    next login.
+    """
+
+    name = "geoip-enricher"
+
+    @property
+    def batch_size(self):
+        return settings.GEOIP_BATCH_SIZE
+
+    def submit(self, user, ip):
+        """
+        Queues `user` to be located at `ip`, unless that is where they
+        already are.
+        """
+        if not ip or ip == user.ip_address or get_database() is None:
+            return
+        if not self.put((user.pk, ip)):
+            ENRICHMENTS.inc("dropped")
+
+    def write(self, batch):
+        """
+        Resolves and saves a batch of `(user_id, ip)` pairs in one query.
+        """
+        database = get_database()
+        now = timezone.now()
+        # The latest IP wins when a user is queued more than once
+        users = {}
+        for user_id, ip in batch:
+            location = database.lookup(ip)
+            ENRICHMENTS.inc("resolved" if location else "unknown")
+            users[user_id] = CustomUser(
+                pk=user_id,
+                ip_address=ip,
+                city=location and location.city,
+                state=location and location.state,
+                country=location and location.country,
+                updated_at=now,
+            )
+        CustomUser.objects.bulk_update(
+            users.values(), ["ip_address", "city", "state", "country", "updated_at"]
+        )
+        for user_id in users:
+            invalidate_user(user_id)
+
+
+enricher = GeoEnricher(settings.GEOIP_QUEUE_SIZE)
@@ -0,0 +1,139 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import ContextVar
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate, hashers
+from django.contrib.auth.hashers import make_password
+from django.db import close_old_connections
+
+from .metrics import observe_password_hash
+
+_hash_pool = None
+_timing = ContextVar("password_hash_timing", default=False)
+
+
+class TimedHasherMixin:
+    """
+    Reports the time spent in encode() and verify() to accounts.metrics.
+    verify() calls encode() itself, only the outermost call is timed.
+    """
+
+    def _timed(self, operation, method, *args, **kwargs):
+        if _timing.get():
+            return method(*args, **kwargs)
+        token = _timing.set(True)
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            observe_password_hash(
+                self.algorithm, operation, time.perf_counter() - start
+            )
+            _timing.reset(token)
+
+    def encode(self, *args, **kwargs):
+        return self._timed("encode", super().encode, *args, **kwargs)
+
+    def verify(self, password, encoded):
+        return self._timed("verify", super().verify, password, encoded)
+
+
+class PBKDF2PasswordHasher(TimedHasherMixin, hashers.PBKDF2PasswordHasher):
+    """
+    PBKDF2 with the iteration count set by PBKDF2_ITERATIONS.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PBKDF2_ITERATIONS
+
+
+class ScryptPasswordHasher(TimedHasherMixin, hashers.ScryptPasswordHasher):
+    """
+    scrypt with the CPU/memory cost set by SCRYPT_WORK_FACTOR.
+    """
+
+    @property
+    def work_factor(self):
+        return settings.SCRYPT_WORK_FACTOR
+
+
+class Argon2PasswordHasher(TimedHasherMixin, hashers.Argon2PasswordHasher):
+    """
+    Argon2id with the cost set by ARGON2_TIME_COST and ARGON2_MEMORY_COST.
+    Needs the optional argon2-cffi package.
+    """
+
+    @property
+    def time_cost(self):
+        return settings.ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.ARGON2_MEMORY_COST
+
+
+def get_hash_pool():
+    """
+    Returns the bounded thread pool password hashing runs on in async views.
+
+    hashlib's pbkdf2_hmac and scrypt and argon2-cffi release the GIL, so
+    threads hash in parallel while the event loop keeps serving requests.
+    """
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS,
+            thread_name_prefix="password-hash",
+        )
+    return _hash_pool
+
+
+def _pooled_authenticate(request, credentials):
+    # Django only closes stale connections around requests, which never run
+    # on the pool's threads, so this call does what a request would
+    close_old_connections()
+    try:
+        return authenticate(request, **credentials)
+    finally:
+        close_old_connections()
+
+
+async def aauthenticate(request=None, **credentials):
+    """
+    Runs authenticate() on the password hashing pool.
+
+    Outdated hashes are upgraded to the preferred hasher by check_password()
+    as part of the same call. The user query and that save run on the pool
+    thread's own connection, which is closed or health-checked before and
+    after each call as CONN_MAX_AGE and CONN_HEALTH_CHECKS say.
+    """
+    return await sync_to_async(
+        _pooled_authenticate, thread_sensitive=False, executor=get_hash_pool()
+    )(request, credentials)
+
+
+async def amake_password(password):
+    """
+    Runs make_password() on the password hashing pool.
+    """
+    return await sync_to_async(
+        make_password, thread_sensitive=False, executor=get_hash_pool()
+    )(password)
+
+
+def get_hash_process_pool(processes=None):
+    """
+    Returns a process pool for hashing many passwords at once, as in bulk
+    imports. Workers are spawned rather than forked so they never share the
+    parent's database connections.
+    """
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=django.setup,
+    )
@@ -0,0 +1,268 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+import urllib.request
+from functools import lru_cache
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from jwt import InvalidAlgorithmError, InvalidTokenError
+from jwt.algorithms import get_default_algorithms
+from rest_framework_simplejwt.backends import ALLOWED_ALGORITHMS, TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+
+# Members that identify a public key in its RFC 7638 thumbprint
+THUMBPRINT_MEMBERS = {
+    "RSA": ("e", "kty", "n"),
+    "EC": ("crv", "kty", "x", "y"),
+    "OKP": ("crv", "kty", "x"),
+}
+
+
+def algorithm_for_key(public_key):
+    """
+    Returns the JWS algorithm used with the given public key.
+    """
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return "RS256"
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return "EdDSA"
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return "ES256"
+    raise ValueError("Unsupported key type %s" % type(public_key).__name__)
+
+
+class SigningKey:
+    """
+    An asymmetric key pair (or just the public half of a retired one),
+    identified by the RFC 7638 thumbprint of its public key.
+    """
+
+    def __init__(self, public_key, private_key=None):
+        self.public_key = public_key
+        self.private_key = private_key
+        self.algorithm = algorithm_for_key(public_key)
+        jwk = get_default_algorithms()[self.algorithm].to_jwk(public_key, as_dict=True)
+        members = {name: jwk[name] for name in THUMBPRINT_MEMBERS[jwk["kty"]]}
+        digest = hashlib.sha256(
+            json.dumps(members, separators=(",", ":"), sort_keys=True).encode()
+        ).digest()
+        self.kid = base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+        self.jwk = {**jwk, "kid": self.kid, "alg": self.algorithm, "use": "sig"}
+
+    @classmethod
+    def from_private_pem(cls, data):
+        private_key = serialization.load_pem_private_key(data, password=None)
+        return cls(private_key.public_key(), private_key)
+
+    @classmethod
+    def from_public_pem(cls, data):
+        return cls(serialization.load_pem_public_key(data))
+
+    @property
+    def public_pem(self):
+        return self.public_key.public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        ).decode()
+
+
+class KeySet:
+    """
+    The active signing key plus the retired keys whose tokens may still be
+    in circulation, looked up by `kid`.
+    """
+
+    def __init__(self, active, retired=()):
+        self.active = active
+        self.keys = {key.kid: key for key in (active, *retired)}
+
+    def get(self, kid):
+        return self.keys.get(kid)
+
+    def as_jwks(self):
+        return {"keys": [key.jwk for key in self.keys.values()]}
+
+
+@lru_cache(maxsize=None)
+def get_key_set():
+    """
+    Loads the key set configured by JWT_PRIVATE_KEY_FILE and
+    JWT_RETIRED_PUBLIC_KEY_FILES, or None when tokens are HMAC-signed.
+    """
+    if not settings.JWT_PRIVATE_KEY_FILE:
+        return None
+    with open(settings.JWT_PRIVATE_KEY_FILE, "rb") as f:
+        active = SigningKey.from_private_pem(f.read())
+    retired = []
+    for path in settings.JWT_RETIRED_PUBLIC_KEY_FILES:
+        with open(path, "rb") as f:
+            retired.append(SigningKey.from_public_pem(f.read()))
+    return KeySet(active, retired)
+
+
+class JWKSCache:
+    """
+    Verifier-side cache of the keys published at a JWKS URL.
+
+    Parsed keys are kept for `ttl` seconds, so verifying a token is a dict
+    lookup plus a signature check. The JWKS is refetched when a key expires
+    or an unknown `kid` shows up, at most once every `min_refresh_interval`
+    seconds so that forged `kid` values cannot hammer the issuer.
+    """
+
+    def __init__(self, url, ttl=300, min_refresh_interval=30, timeout=5):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._last_fetch = None
+        self._lock = threading.Lock()
+
+    def get_key(self, kid):
+        """
+        Returns the `(key, algorithm)` pair published under `kid`, or None.
+        """
+        entry = self._keys.get(kid)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            entry = self._keys.get(kid)
+            now = time.monotonic()
+            if entry is not None and entry[1] > now:
+                return entry[0]
+            # Expired keys included, so an unreachable issuer costs one
+            # blocking fetch per interval rather than one per token
+            if (
+                self._last_fetch is None
+                or now - self._last_fetch >= self.min_refresh_interval
+            ):
+                try:
+                    self._refresh(now)
+                except (OSError, ValueError, jwt.PyJWTError):
+                    # Keep serving cached keys while the issuer is unreachable
+                    pass
+            entry = self._keys.get(kid)
+        return entry[0] if entry is not None else None
+
+    def _refresh(self, now):
+        self._last_fetch = now
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            jwks = json.load(response)
+        expires_at = now + self.ttl
+        keys = {}
+        for data in jwks.get("keys", []):
+            # Only keys that pin their algorithm can be trusted for verification
+            if data.get("use", "sig") == "sig" and data.get("kid") and data.get("alg"):
+                keys[data["kid"]] = ((jwt.PyJWK(data).key, data["alg"]), expires_at)
+        self._keys = keys
+
+    def decode(self, token, **kwargs):
+        """
+        Verifies the token against the cached key named by its `kid` header
+        and returns the payload. Raises `jwt.InvalidTokenError` on failure.
+        """
+        kid = jwt.get_unverified_header(token).get("kid")
+        entry = self.get_key(kid) if kid else None
+        if entry is None:
+            raise InvalidTokenError("Unknown signing key")
+        key, algorithm = entry
+        return jwt.decode(token, key, algorithms=[algorithm], **kwargs)
+
+
+class KeyRotatingTokenBackend(TokenBackend):
+    """
+    Token backend that signs with the active key of a `KeySet`, stamping
+    its `kid` in the header, and verifies against whichever local or
+    JWKS-published key the token names.
+    """
+
+    def __init__(self, key_set=None, jwks_cache=None):
+        self.key_set = key_set
+        self.jwks_cache = jwks_cache
+        super().__init__(
+            key_set.active.algorithm if key_set else api_settings.ALGORITHM,
+            audience=api_settings.AUDIENCE,
+            issuer=api_settings.ISSUER,
+            leeway=api_settings.LEEWAY,
+            json_encoder=api_settings.JSON_ENCODER,
+        )
+
+    def _validate_algorithm(self, algorithm):
+        if algorithm != "EdDSA" and algorithm not in ALLOWED_ALGORITHMS:
+            raise TokenBackendError(_("Unrecognized algorithm type '%s'") % algorithm)
+
+    def encode(self, payload):
+        if self.key_set is None:
+            raise TokenBackendError(_("No signing key is configured"))
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload["aud"] = self.audience
+        if self.issuer is not None:
+            jwt_payload["iss"] = self.issuer
+        key = self.key_set.active
+        return jwt.encode(
+            jwt_payload,
+            key.private_key,
+            algorithm=key.algorithm,
+            headers={"kid": key.kid},
+            json_encoder=self.json_encoder,
+        )
+
+    def decode(self, token, verify=True):
+        options = {
+            "verify_aud": self.audience is not None,
+            "verify_signature": verify,
+        }
+        try:
+            if not verify:
+                return jwt.decode(token, options=options)
+            kid = jwt.get_unverified_header(token).get("kid")
+            key = self.key_set.get(kid) if self.key_set else None
+            if key is not None:
+                verifying_key, algorithm = key.public_key, key.algorithm
+            elif self.jwks_cache is not None and kid:
+                entry = self.jwks_cache.get_key(kid)
+                if entry is None:
+                    raise TokenBackendError(_("Token is invalid or expired"))
+                verifying_key, algorithm = entry
+            else:
+                raise TokenBackendError(_("Token is invalid or expired"))
+            return jwt.decode(
+                token,
+                verifying_key,
+                algorithms=[algorithm],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.get_leeway(),
+                options=options,
+            )
+        except InvalidAlgorithmError as ex:
+            raise TokenBackendError(_("Invalid algorithm specified")) from ex
+        except InvalidTokenError as ex:
+            raise TokenBackendError(_("Token is invalid or expired")) from ex
+
+
+def install_token_backend():
+    """
+    Swaps simplejwt's module-level token backend for a key-rotating one when
+    asymmetric keys or a JWKS URL are configured.
+    """
+    key_set = get_key_set()
+    jwks_cache = None
+    if api_settings.JWK_URL:
+        jwks_cache = JWKSCache(api_settings.JWK_URL, ttl=settings.JWKS_CACHE_TTL)
+    if key_set is None and jwks_cache is None:
+        return
+
+    from rest_framework_simplejwt import state
+
+    state.token_backend = KeyRotatingTokenBackend(key_set, jwks_cache)
@@ -0,0 +1,179 @@
+"""
+Outbox for outgoing email.
+
+OutboxEmailBackend is the EMAIL_BACKEND requests see: sending an email only
+inserts an OutboxEmail row, so a slow SMTP server never holds up a request.
+`manage.py send_outbox` runs an OutboxWorker, which claims due emails in
+batches and delivers them through EMAIL_DELIVERY_BACKEND over one connection
+kept open while there is mail to send. Failed emails are retried with
+exponential backoff, up to OUTBOX_MAX_ATTEMPTS. Sent emails only keep their
+envelope, and `manage.py collect_expired` deletes sent and failed emails
+after OUTBOX_RETENTION_DAYS.
+"""
+
+import random
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """
+    Queues messages in the outbox instead of sending them. Attachments are
+    not supported.
+    """
+
+    def send_messages(self, email_messages):
+        now = timezone.now()
+        rows = []
+        for message in email_messages:
+            if message.attachments:
+                if self.fail_silently:
+                    continue
+                raise ValueError("Emails with attachments cannot be queued")
+            rows.append(
+                OutboxEmail(
+                    subject=message.subject,
+                    body=message.body,
+                    from_email=message.from_email,
+                    to=list(message.to),
+                    cc=list(message.cc),
+                    bcc=list(message.bcc),
+                    reply_to=list(message.reply_to),
+                    headers=message.extra_headers,
+                    alternatives=[
+                        list(alternative)
+                        for alternative in getattr(message, "alternatives", ())
+                    ],
+                    next_attempt_at=now,
+                )
+            )
+        OutboxEmail.objects.bulk_create(rows)
+        return len(rows)
+
+
+def as_message(email):
+    message = EmailMultiAlternatives(
+        email.subject,
+        email.body,
+        email.from_email,
+        email.to,
+        email.bcc,
+        cc=email.cc,
+        reply_to=email.reply_to,
+        headers=email.headers,
+    )
+    for content, mimetype in email.alternatives:
+        message.attach_alternative(content, mimetype)
+    return message
+
+
+def is_permanent(error):
+    """
+    True for SMTP errors that retrying will not fix, such as an unknown
+    recipient.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def retry_delay(attempts):
+    delay = min(
+        settings.OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1),
+        settings.OUTBOX_RETRY_MAX_SECONDS,
+    )
+    # Jitter, so emails that failed together don't retry together
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+class OutboxWorker:
+    def __init__(self, batch_size=None, connection=None):
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.connection = connection or get_connection(
+            settings.EMAIL_DELIVERY_BACKEND
+        )
+
+    def claim(self):
+        """
+        Returns the next batch of due emails, leased to this worker for
+        OUTBOX_LEASE_SECONDS so that other workers skip them and a crashed
+        worker's batch is picked up again later.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            emails = list(
+                OutboxEmail.objects.select_for_update(skip_locked=True)
+                .filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+                .order_by("next_attempt_at")[: self.batch_size]
+            )
+            OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+                next_attempt_at=now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+            )
+        return emails
+
+    def deliver(self, message):
+        # open() is a no-op while the connection is up
+        self.connection.open()
+        try:
+            self.connection.send_messages([message])
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped an idle connection, reconnect once
+            self.connection.close()
+            self.connection.open()
+            self.connection.send_messages([message])
+
+    def send_batch(self):
+        """
+        Delivers one batch and returns the number of emails it handled.
+        """
+        emails = self.claim()
+        sent = []
+        for email in emails:
+            try:
+                self.deliver(as_message(email))
+            except Exception as e:
+                self.failed(email, e)
+            else:
+                sent.append(email.pk)
+        # Bodies carry live password reset links, keep only the envelope
+        OutboxEmail.objects.filter(pk__in=sent).update(
+            status=OutboxEmail.SENT,
+            body="",
+            alternatives=[],
+            sent_at=timezone.now(),
+            attempts=F("attempts") + 1,
+            last_error="",
+        )
+        return len(emails)
+
+    def failed(self, email, error):
+        attempts = email.attempts + 1
+        give_up = is_permanent(error) or attempts >= settings.OUTBOX_MAX_ATTEMPTS
+        OutboxEmail.objects.filter(pk=email.pk).update(
+            status=OutboxEmail.FAILED if give_up else OutboxEmail.PENDING,
+            attempts=attempts,
+            next_attempt_at=timezone.now() + retry_delay(attempts),
+            last_error="%s: %s" % (type(error).__name__, error),
+        )
+
+    def drain(self):
+        """
+        Sends batches until nothing is due, then closes the connection.
+        Returns the number of emails handled.
+        """
+        total = 0
+        try:
+            while count := self.send_batch():
+                total += count
+        finally:
+            self.connection.close()
+        return total
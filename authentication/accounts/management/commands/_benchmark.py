@@ -0,0 +1,27 @@
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.db import connection
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Runs the block against a freshly migrated test database, destroyed
+    afterwards.
+    """
+    if connection.vendor == "sqlite" and not connection.settings_dict["TEST"]["NAME"]:
+        # The in-memory test database fails concurrent writes with "table
+        # is locked" instead of waiting, a file behaves like production
+        name = Path(connection.settings_dict["NAME"])
+        connection.settings_dict["TEST"]["NAME"] = name.with_name("bench_" + name.name)
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
@@ -0,0 +1,315 @@
+import asyncio
+import importlib
+import itertools
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import clear_url_caches, reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts import audit, geo
+from accounts.models import CustomUser, make_user_hash
+
+from ._benchmark import percentile, throwaway_database
+
+APPS = ("wsgi", "asgi")
+SCENARIOS = ("login", "registration", "session", "token_verify", "throttled")
+PASSWORD = "bench-password-1"
+
+# All simulated clients share one IP, so only the throttled scenario limits,
+# and it rejects every attempt
+NO_THROTTLE = {"LOGIN_RATE_IP": "", "LOGIN_RATE_EMAIL": "", "LOGIN_RATE_GLOBAL": ""}
+THROTTLE = {**NO_THROTTLE, "LOGIN_RATE_IP": "0/3600"}
+
+# Any other status counts as an error
+EXPECTED_STATUS = {
+    "login": 302,
+    "registration": 302,
+    "session": 302,
+    "token_verify": 200,
+    "throttled": 429,
+}
+
+
+class QueryCounter:
+    """
+    Counts queries on every database connection, including the ones opened
+    by request threads after it is installed.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def use_async_views(enabled):
+    """
+    Reloads the URLconf so login/ routes to the view server/asgi.py or
+    server/wsgi.py would serve.
+    """
+    settings.ASYNC_VIEWS = enabled
+    clear_url_caches()
+    importlib.reload(importlib.import_module("accounts.urls"))
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests login, registration, session refresh and token verification "
+        "through the WSGI and ASGI request handlers on a throwaway database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Users to seed")
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Requests per scenario"
+        )
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--app", choices=(*APPS, "both"), default="both")
+        parser.add_argument(
+            "--scenario", choices=SCENARIOS, action="append", dest="scenarios"
+        )
+        parser.add_argument("--baseline", help="Baseline JSON to compare against")
+        parser.add_argument("--save-baseline", help="Write the results as a baseline")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Allowed relative slowdown before a result counts as a regression",
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        apps = APPS if options["app"] == "both" else (options["app"],)
+        scenarios = options["scenarios"] or SCENARIOS
+        self.emails = itertools.count()
+
+        counter = QueryCounter()
+        # The test clients send requests for host "testserver"
+        setup_test_environment()
+        with throwaway_database():
+            counter.install()
+            connection_created.connect(counter.install)
+            try:
+                self.seed(options["users"])
+                results = {}
+                for app in apps:
+                    use_async_views(app == "asgi")
+                    results[app] = {}
+                    for scenario in scenarios:
+                        results[app][scenario] = self.run_scenario(
+                            app, scenario, counter
+                        )
+            finally:
+                # Background writes belong to the throwaway database too
+                audit.writer.flush()
+                geo.enricher.flush()
+                connection_created.disconnect(counter.install)
+                use_async_views(False)
+                teardown_test_environment()
+
+        self.report(results)
+        failed = [
+            "%s %s: %d errors" % (app, scenario, result["errors"])
+            for app, scenarios in results.items()
+            for scenario, result in scenarios.items()
+            if result["errors"]
+        ]
+        if failed:
+            raise CommandError(
+                "Requests failed, the timings are not comparable:\n"
+                + "\n".join(failed)
+            )
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w") as f:
+                json.dump(results, f, indent=2)
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                regressions = self.compare(results, json.load(f))
+            if regressions:
+                raise CommandError("Regressions:\n" + "\n".join(regressions))
+
+    def seed(self, count):
+        password = make_password(PASSWORD)
+        CustomUser.objects.bulk_create(
+            [
+                CustomUser(
+                    email="seed%d@example.com" % i,
+                    user_hash=make_user_hash("seed%d@example.com" % i),
+                    phone_number="%010d" % i,
+                    first_name="Seed",
+                    last_name="User",
+                    password=password,
+                )
+                for i in range(count)
+            ],
+            batch_size=1000,
+        )
+        self.seed_ids = list(CustomUser.objects.values_list("id", flat=True))
+
+    def seed_email(self, i):
+        return "seed%d@example.com" % (self.seed_ids[i % len(self.seed_ids)] - 1)
+
+    def build_requests(self, scenario):
+        """
+        Returns the per-client setup and a function building the `(method,
+        path, data)` of the i-th request. Setup is neither timed nor counted.
+        """
+        if scenario == "login":
+            return None, lambda i: (
+                "post",
+                reverse("login"),
+                {"email": self.seed_email(i), "password": PASSWORD},
+            )
+        if scenario == "registration":
+
+            def request(i):
+                n = next(self.emails)
+                return (
+                    "post",
+                    reverse("registration"),
+                    {
+                        "email": "new%d@example.com" % n,
+                        "first_name": "New",
+                        "last_name": "User",
+                        "phone_number": "9%09d" % n,
+                        "password1": PASSWORD,
+                        "password2": PASSWORD,
+                    },
+                )
+
+            return None, request
+        if scenario == "throttled":
+            # Credential stuffing from one IP, rejected before hashing
+            return None, lambda i: (
+                "post",
+                reverse("login"),
+                {"email": self.seed_email(i), "password": "wrong-password"},
+            )
+        if scenario == "session":
+            # A logged-in user revisiting the login page is redirected, which
+            # exercises session load and renewal only
+            return "login", lambda i: ("get", reverse("login"), None)
+        user = CustomUser.objects.get(pk=self.seed_ids[0])
+        token = str(AccessToken.for_user(user))
+        return None, lambda i: ("post", reverse("token_verify"), {"token": token})
+
+    def run_scenario(self, app, scenario, counter):
+        setup, build = self.build_requests(scenario)
+        total = self.options["requests"]
+        concurrency = self.options["concurrency"]
+        clients = [
+            self.make_client(app, setup, offset) for offset in range(concurrency)
+        ]
+        # Each client gets an even share of the request indexes
+        shares = [range(offset, total, concurrency) for offset in range(concurrency)]
+        self.expected_status = EXPECTED_STATUS[scenario]
+        queries_before = counter.count
+        start = time.perf_counter()
+        with override_settings(**(THROTTLE if scenario == "throttled" else NO_THROTTLE)):
+            if app == "wsgi":
+                latencies, errors = self.run_wsgi(clients, shares, build)
+            else:
+                latencies, errors = asyncio.run(self.run_asgi(clients, shares, build))
+        elapsed = time.perf_counter() - start
+        return {
+            "requests": total,
+            "errors": errors,
+            "p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "rps": round(total / elapsed, 1),
+            "queries_per_request": round((counter.count - queries_before) / total, 2),
+        }
+
+    def make_client(self, app, setup, offset):
+        client = Client() if app == "wsgi" else AsyncClient()
+        if setup == "login":
+            client.login(email=self.seed_email(offset), password=PASSWORD)
+        return client
+
+    def run_wsgi(self, clients, shares, build):
+        latencies, errors = [], []
+
+        def worker(client, share):
+            for i in share:
+                method, path, data = build(i)
+                begin = time.perf_counter()
+                response = getattr(client, method)(path, data)
+                latencies.append(time.perf_counter() - begin)
+                if response.status_code != self.expected_status:
+                    errors.append(response.status_code)
+
+        with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+            list(pool.map(worker, clients, shares))
+        return latencies, len(errors)
+
+    async def run_asgi(self, clients, shares, build):
+        latencies, errors = [], []
+
+        async def worker(client, share):
+            for i in share:
+                method, path, data = build(i)
+                begin = time.perf_counter()
+                response = await getattr(client, method)(path, data)
+                latencies.append(time.perf_counter() - begin)
+                if response.status_code != self.expected_status:
+                    errors.append(response.status_code)
+
+        await asyncio.gather(*map(worker, clients, shares))
+        return latencies, len(errors)
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'app':<6}{'scenario':<14}{'p50 ms':>10}{'p99 ms':>10}"
+            f"{'req/s':>10}{'queries':>10}{'errors':>8}"
+        )
+        for app, scenarios in results.items():
+            for scenario, result in scenarios.items():
+                self.stdout.write(
+                    f"{app:<6}{scenario:<14}{result['p50_ms']:>10}{result['p99_ms']:>10}"
+                    f"{result['rps']:>10}{result['queries_per_request']:>10}"
+                    f"{result['errors']:>8}"
+                )
+
+    def compare(self, results, baseline):
+        tolerance = self.options["tolerance"]
+        regressions = []
+        for app, scenarios in results.items():
+            for scenario, result in scenarios.items():
+                base = baseline.get(app, {}).get(scenario)
+                if base is None:
+                    continue
+                name = f"{app} {scenario}"
+                if result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+                    regressions.append(
+                        f"{name}: p99 {result['p99_ms']}ms, baseline {base['p99_ms']}ms"
+                    )
+                if result["rps"] < base["rps"] * (1 - tolerance):
+                    regressions.append(
+                        f"{name}: {result['rps']} req/s, baseline {base['rps']} req/s"
+                    )
+                if result["queries_per_request"] > base["queries_per_request"]:
+                    regressions.append(
+                        f"{name}: {result['queries_per_request']} queries/request, "
+                        f"baseline {base['queries_per_request']}"
+                    )
+        return regressions
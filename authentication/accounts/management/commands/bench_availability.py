@@ -0,0 +1,100 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from accounts import availability
+from accounts.models import CustomUser, make_user_hash
+
+from ._benchmark import percentile, throwaway_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks availability checks with and without the Bloom filter, "
+        "for typeahead traffic that is mostly free candidates, on a throwaway "
+        "database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100000)
+        parser.add_argument("--checks", type=int, default=20000)
+        parser.add_argument(
+            "--taken",
+            type=float,
+            default=0.05,
+            help="Share of checked candidates that are registered",
+        )
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            start = time.perf_counter()
+            CustomUser.objects.bulk_create(
+                (
+                    CustomUser(
+                        email="user%d@example.com" % i,
+                        user_hash=make_user_hash("user%d@example.com" % i),
+                        phone_number="%010d" % i,
+                        first_name="Avail",
+                        last_name="Able",
+                    )
+                    for i in range(options["users"])
+                ),
+                batch_size=options["batch_size"],
+            )
+            self.stdout.write(
+                "Seeded %d users in %.1fs"
+                % (options["users"], time.perf_counter() - start)
+            )
+            samples = [
+                (
+                    "user%d@example.com" % random.randrange(options["users"])
+                    if random.random() < options["taken"]
+                    else "free%d@example.com" % i,
+                    "%010d" % random.randrange(options["users"], 2 * options["users"]),
+                )
+                for i in range(options["checks"])
+            ]
+
+            with override_settings(AVAILABILITY_BLOOM_ERROR_RATE=0):
+                self.report("database only", samples)
+
+            registered = availability.registered = availability.RegisteredFilter(
+                background=False
+            )
+            start = time.perf_counter()
+            bloom = registered.get()
+            self.stdout.write(
+                "Built a %d-hash filter of %.1f MB in %.1fs"
+                % (bloom.hashes, len(bloom.bits) / 2**20, time.perf_counter() - start)
+            )
+            self.report("bloom filter first", samples)
+
+    def report(self, label, samples):
+        timings, queries = [], []
+
+        def count(execute, *args):
+            queries.append(1)
+            return execute(*args)
+
+        with connection.execute_wrapper(count):
+            start = time.perf_counter()
+            for email, phone_number in samples:
+                begin = time.perf_counter()
+                availability.check([email], [phone_number])
+                timings.append(time.perf_counter() - begin)
+            elapsed = time.perf_counter() - start
+        self.stdout.write(
+            "%-20s %8.0f checks/s  p50 %7.1fus  p99 %7.1fus  %.3f queries"
+            % (
+                label,
+                len(samples) / elapsed,
+                statistics.median(timings) * 1e6,
+                percentile(timings, 0.99) * 1e6,
+                len(queries) / len(samples),
+            )
+        )
@@ -0,0 +1,150 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from accounts import family
+from accounts.models import CustomUser, make_user_hash
+
+from ._benchmark import percentile, throwaway_database
+
+# Each family unit: two grandparents, two parents who are children of both,
+# and three students who are children of both parents
+GRANDPARENTS, PARENTS, STUDENTS = 2, 2, 3
+UNIT_USERS = GRANDPARENTS + PARENTS + STUDENTS
+UNIT_EDGES = GRANDPARENTS * PARENTS + PARENTS * STUDENTS
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks family lookups through the closure table against walking "
+        "the parents links hop by hop, on a throwaway database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--edges", type=int, default=1000000)
+        parser.add_argument("--samples", type=int, default=500)
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            units = max(1, options["edges"] // UNIT_EDGES)
+            start = time.perf_counter()
+            self.seed(units, options["batch_size"])
+            self.stdout.write(
+                "Seeded %d users and %d edges in %.1fs"
+                % (units * UNIT_USERS, units * UNIT_EDGES, time.perf_counter() - start)
+            )
+            start = time.perf_counter()
+            links = family.rebuild(batch_size=options["batch_size"])
+            elapsed = time.perf_counter() - start
+            self.stdout.write("Rebuilt %d closure links in %.1fs" % (links, elapsed))
+
+            # The last unit has no next family for link_and_unlink
+            samples = [
+                random.randrange(max(1, units - 1)) * UNIT_USERS + 1
+                for _ in range(options["samples"])
+            ]
+            grandparents = samples
+            students = [pk + GRANDPARENTS + PARENTS for pk in samples]
+            self.report(
+                "students under a grandparent, closure",
+                grandparents,
+                lambda pk: list(family.descendants(pk, is_student=True)),
+            )
+            self.report(
+                "students under a grandparent, per hop",
+                grandparents,
+                lambda pk: self.walk(pk, "parents__in", is_student=True),
+            )
+            self.report(
+                "guardians of a student, closure",
+                students,
+                lambda pk: list(family.ancestors(pk)),
+            )
+            self.report(
+                "guardians of a student, per hop",
+                students,
+                lambda pk: self.walk(pk, "children__in"),
+            )
+            self.report("link and unlink a student", students, self.link_and_unlink)
+
+    def seed(self, units, batch_size):
+        CustomUser.objects.bulk_create(
+            (
+                CustomUser(
+                    email="family%d@example.com" % i,
+                    user_hash=make_user_hash("family%d@example.com" % i),
+                    phone_number="%010d" % i,
+                    first_name="Family",
+                    last_name="Member",
+                    is_parent=i % UNIT_USERS < GRANDPARENTS + PARENTS,
+                    is_student=i % UNIT_USERS >= GRANDPARENTS + PARENTS,
+                )
+                for i in range(units * UNIT_USERS)
+            ),
+            batch_size=batch_size,
+        )
+        # Primary keys of a fresh table start at 1 and follow insertion order
+        Through = CustomUser.parents.through
+
+        def edges():
+            for unit in range(units):
+                first = unit * UNIT_USERS + 1
+                grandparents = range(first, first + GRANDPARENTS)
+                parents = range(first + GRANDPARENTS, first + GRANDPARENTS + PARENTS)
+                students = range(parents.stop, first + UNIT_USERS)
+                for upper, lower in ((grandparents, parents), (parents, students)):
+                    for parent_id in upper:
+                        for child_id in lower:
+                            yield Through(
+                                from_customuser_id=child_id, to_customuser_id=parent_id
+                            )
+
+        Through.objects.bulk_create(edges(), batch_size=batch_size)
+
+    def walk(self, pk, lookup, **filters):
+        """
+        Collects relatives one query per hop, as before the closure table.
+        `lookup` is "parents__in" to walk down and "children__in" to walk up.
+        """
+        found, frontier = set(), {pk}
+        while frontier:
+            frontier = (
+                set(
+                    CustomUser.objects.filter(**{lookup: frontier}).values_list(
+                        "pk", flat=True
+                    )
+                )
+                - found
+            )
+            found |= frontier
+        return list(CustomUser.objects.filter(pk__in=found, **filters))
+
+    def link_and_unlink(self, pk):
+        # A parent from the next family over, so no cycle can form
+        other_parent = CustomUser.objects.get(pk=pk + UNIT_USERS - STUDENTS - 1)
+        student = CustomUser.objects.get(pk=pk)
+        student.parents.add(other_parent)
+        student.parents.remove(other_parent)
+
+    def report(self, label, samples, lookup):
+        timings, queries = [], []
+        for pk in samples:
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                lookup(pk)
+                timings.append(time.perf_counter() - start)
+            queries.append(len(captured))
+        self.stdout.write(
+            "%-40s p50 %7.2fms  p99 %7.2fms  %5.1f queries"
+            % (
+                label,
+                statistics.median(timings) * 1000,
+                percentile(timings, 0.99) * 1000,
+                statistics.mean(queries),
+            )
+        )
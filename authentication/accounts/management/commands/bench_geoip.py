@@ -0,0 +1,108 @@
+import os
+import random
+import socket
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.geo import GeoDatabase, write_database
+
+from ._benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks geolocation lookups against a synthetic database covering "
+        "the IPv4 space, without and with the LRU of recent IPs"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ranges", type=int, default=1000000)
+        parser.add_argument("--locations", type=int, default=50000)
+        parser.add_argument("--lookups", type=int, default=200000)
+        parser.add_argument(
+            "--distinct-ips",
+            type=int,
+            default=50000,
+            help="IPs the cached run draws from, a few of them far more often",
+        )
+        parser.add_argument("--cache-size", type=int, default=settings.GEOIP_CACHE_SIZE)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bench.geoip")
+            start = time.perf_counter()
+            self.build(path, options["ranges"], options["locations"])
+            self.stdout.write(
+                "Built %d ranges (%.1f MB) in %.1fs"
+                % (
+                    options["ranges"],
+                    os.path.getsize(path) / 2**20,
+                    time.perf_counter() - start,
+                )
+            )
+
+            uniform = [random_ip() for _ in range(options["lookups"])]
+            database = GeoDatabase(path, cache_size=0)
+            self.report("uncached, uniform IPs", database, uniform)
+            database.close()
+
+            pool = [random_ip() for _ in range(options["distinct_ips"])]
+            # Pareto-distributed indexes: most logins come from a few IPs
+            skewed = [
+                pool[min(len(pool) - 1, int(random.paretovariate(1.2)) - 1)]
+                if random.random() < 0.8
+                else random.choice(pool)
+                for _ in range(options["lookups"])
+            ]
+            database = GeoDatabase(path, cache_size=options["cache_size"])
+            self.report("cached, skewed IPs", database, skewed)
+            info = database.lookup.cache_info()
+            hit_rate = info.hits / (info.hits + info.misses)
+            self.stdout.write("  cache hit rate %.1f%%" % (100 * hit_rate))
+            database.close()
+
+    def build(self, path, ranges, locations):
+        step = 2**32 // ranges
+        write_database(
+            path,
+            (
+                (
+                    format_ip(i * step),
+                    format_ip(min(2**32, (i + 1) * step) - 1),
+                    "City %d" % (i % locations),
+                    "State %d" % (i % locations // 100),
+                    "C%d" % (i % locations // 5000),
+                )
+                for i in range(ranges)
+            ),
+        )
+
+    def report(self, name, database, ips):
+        lookup = database.lookup
+        latencies = []
+        start = time.perf_counter()
+        for ip in ips:
+            begin = time.perf_counter()
+            lookup(ip)
+            latencies.append(time.perf_counter() - begin)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            "%-24s %10.0f lookups/s  p50 %.1fus  p99 %.1fus"
+            % (
+                name,
+                len(ips) / elapsed,
+                percentile(latencies, 0.5) * 1e6,
+                percentile(latencies, 0.99) * 1e6,
+            )
+        )
+
+
+def format_ip(value):
+    return socket.inet_ntoa(value.to_bytes(4, "big"))
+
+
+def random_ip():
+    return format_ip(random.getrandbits(32))
@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Measures password hashing latency and throughput per configured hasher"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rounds", type=int, default=20, help="Hashes to compute per run"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.PASSWORD_HASH_WORKERS,
+            help="Threads in the pool run",
+        )
+
+    def handle(self, *args, **options):
+        rounds = options["rounds"]
+        workers = options["workers"]
+        self.stdout.write(
+            f"{'hasher':<16}{'ms/hash':>10}{'hash/s':>10}"
+            f"{f'hash/s ({workers} threads)':>24}"
+        )
+        for hasher in get_hashers():
+            try:
+                hasher.encode("warm-up", hasher.salt())
+            except (ValueError, ImportError):
+                self.stdout.write(f"{hasher.algorithm:<16}{'not installed':>10}")
+                continue
+
+            start = time.perf_counter()
+            for _ in range(rounds):
+                hasher.encode("correct horse battery staple", hasher.salt())
+            serial = time.perf_counter() - start
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                start = time.perf_counter()
+                list(
+                    pool.map(
+                        lambda _: hasher.encode(
+                            "correct horse battery staple", hasher.salt()
+                        ),
+                        range(rounds),
+                    )
+                )
+                pooled = time.perf_counter() - start
+
+            self.stdout.write(
+                f"{hasher.algorithm:<16}{serial / rounds * 1000:>10.1f}"
+                f"{rounds / serial:>10.1f}{rounds / pooled:>24.1f}"
+            )
@@ -0,0 +1,40 @@
+import csv
+import gzip
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.geo import write_database
+
+
+def read_dbip(path):
+    """
+    Yields the ranges of a CSV in the DB-IP "IP to City Lite" layout:
+    first IP, last IP, continent, country, state, city, latitude, longitude.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            first, last, _, country, state, city = row[:6]
+            yield first, last, city, state, country
+
+
+class Command(BaseCommand):
+    help = "Builds the geolocation database accounts.geo reads from a CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv", help="DB-IP city lite CSV, optionally gzipped")
+        parser.add_argument(
+            "--output",
+            default=settings.GEOIP_DATABASE,
+            help="Database file to write, GEOIP_DATABASE by default",
+        )
+
+    def handle(self, *args, **options):
+        if not options["output"]:
+            raise CommandError("Set GEOIP_DATABASE or pass --output")
+        try:
+            count = write_database(options["output"], read_dbip(options["csv"]))
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write("Wrote %d ranges to %s" % (count, options["output"]))
@@ -0,0 +1,71 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.cleanup import COLLECTORS, collect
+from accounts.metrics import render_metrics
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired sessions, refresh tokens and old outbox emails in "
+        "small, throttled batches, safe to run next to live traffic"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--only", choices=COLLECTORS, action="append", dest="collectors"
+        )
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--duty-cycle",
+            type=float,
+            default=None,
+            help="Share of the wall time spent deleting, GC_DUTY_CYCLE by default",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep collecting instead of exiting once nothing is expired",
+        )
+        parser.add_argument(
+            "--interval", type=float, default=60, help="Seconds between rounds"
+        )
+        parser.add_argument(
+            "--metrics-file",
+            help="Write progress metrics here after every round, in the "
+            "Prometheus text format for node_exporter's textfile collector",
+        )
+
+    def handle(self, *args, **options):
+        self.last_report = 0
+        while True:
+            totals = collect(
+                options["collectors"] or COLLECTORS,
+                batch_size=options["batch_size"],
+                duty_cycle=options["duty_cycle"],
+                progress=self.progress,
+            )
+            for name, total in totals.items():
+                if total:
+                    self.stdout.write("Deleted %d expired %s" % (total, name))
+            if options["metrics_file"]:
+                self.write_metrics(options["metrics_file"])
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def progress(self, name, total, batch_size):
+        now = time.monotonic()
+        if now - self.last_report >= 10:
+            self.last_report = now
+            self.stdout.write(
+                "%s: %d deleted so far, batches of %d" % (name, total, batch_size)
+            )
+
+    def write_metrics(self, path):
+        tmp_path = "%s.tmp" % path
+        with open(tmp_path, "w") as f:
+            f.write(render_metrics())
+        os.replace(tmp_path, path)
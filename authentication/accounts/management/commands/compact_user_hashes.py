@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from accounts.models import USER_HASH_LENGTH, CustomUser, make_user_hash
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrites user hashes made by the old SHA-256 scheme in the compact "
+        "format. Run it before the migration that shortens the column."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        queryset = (
+            CustomUser.objects.annotate(hash_length=Length("user_hash"))
+            .exclude(hash_length=USER_HASH_LENGTH)
+            .order_by("pk")
+            .only("pk", "email")
+        )
+        total = 0
+        last_pk = 0
+        while users := list(
+            queryset.filter(pk__gt=last_pk)[: options["batch_size"]]
+        ):
+            now = timezone.now()
+            for user in users:
+                user.user_hash = make_user_hash(user.email)
+                user.updated_at = now
+            CustomUser.objects.bulk_update(users, ["user_hash", "updated_at"])
+            total += len(users)
+            last_pk = users[-1].pk
+        self.stdout.write("Rewrote %d user hashes" % total)
@@ -0,0 +1,26 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from accounts.bulk import FORMATS, export_users
+
+
+class Command(BaseCommand):
+    help = "Streams all users out as CSV or JSON lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument(
+            "--output", default="-", help="File to write, standard output by default"
+        )
+
+    def handle(self, *args, **options):
+        if options["output"] == "-":
+            self._write(sys.stdout, options["format"])
+        else:
+            with open(options["output"], "w", encoding="utf-8", newline="") as f:
+                self._write(f, options["format"])
+
+    def _write(self, stream, fmt):
+        for chunk in export_users(fmt):
+            stream.write(chunk)
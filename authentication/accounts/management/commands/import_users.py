@@ -0,0 +1,40 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.bulk import FORMATS, import_users
+
+
+class Command(BaseCommand):
+    help = "Imports users from a CSV or JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import")
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="File format, guessed from the extension by default",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=None,
+            help="Password hashing processes, one per CPU by default",
+        )
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or os.path.splitext(options["path"])[1].lstrip(".")
+        if fmt not in FORMATS:
+            raise CommandError("Cannot tell the file format, pass --format")
+        with open(options["path"], encoding="utf-8-sig", newline="") as stream:
+            report = import_users(
+                stream,
+                fmt,
+                batch_size=options["batch_size"],
+                processes=options["processes"],
+            )
+        for error in report.errors:
+            self.stderr.write("line %(line)s: %(error)s" % error)
+        self.stdout.write(json.dumps(report.as_dict() | {"errors": len(report.errors)}))
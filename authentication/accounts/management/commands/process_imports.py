@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.bulk import process_imports
+
+
+class Command(BaseCommand):
+    help = "Runs the user imports queued through the API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=None,
+            help="Password hashing processes, one per CPU by default",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling for imports instead of exiting once none is queued",
+        )
+        parser.add_argument(
+            "--interval", type=float, default=5, help="Seconds between polls"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = process_imports(options["batch_size"], options["processes"])
+            if count:
+                self.stdout.write("Ran %d imports" % count)
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,56 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from accounts.audit import LOG_FILE_FORMAT
+from accounts.models import AuditEvent
+
+
+class Command(BaseCommand):
+    help = "Deletes audit events older than AUDIT_RETENTION_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.AUDIT_RETENTION_DAYS)
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options["days"])
+        self.stdout.write("Deleted %d audit events" % self.prune_table(cutoff, options))
+        self.stdout.write("Deleted %d audit log files" % self.prune_logs(cutoff))
+
+    def prune_table(self, cutoff, options):
+        """
+        Deletes in primary key ranges: ids grow with time, so each batch is
+        one index range scan that the time index narrows to old rows.
+        """
+        expired = AuditEvent.objects.filter(created_at__lt=cutoff)
+        bounds = expired.aggregate(low=Min("pk"), high=Max("pk"))
+        if bounds["low"] is None:
+            return 0
+        total = 0
+        for start in range(bounds["low"], bounds["high"] + 1, options["batch_size"]):
+            deleted, _ = expired.filter(
+                pk__gte=start, pk__lt=start + options["batch_size"]
+            ).delete()
+            total += deleted
+        return total
+
+    def prune_logs(self, cutoff):
+        if not os.path.isdir(settings.AUDIT_LOG_DIR):
+            return 0
+        total = 0
+        for name in os.listdir(settings.AUDIT_LOG_DIR):
+            try:
+                day = datetime.datetime.strptime(name, LOG_FILE_FORMAT)
+            except ValueError:
+                continue
+            # A file holds one UTC day, drop it once all of it is expired
+            end = day.replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(days=1)
+            if end <= cutoff:
+                os.remove(os.path.join(settings.AUDIT_LOG_DIR, name))
+                total += 1
+        return total
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.family import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recomputes the family closure table from the parents links"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        total = rebuild(batch_size=options["batch_size"])
+        self.stdout.write("Wrote %d family links" % total)
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.mail import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = "Delivers queued emails from the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep polling the outbox instead of exiting once it is empty",
+        )
+        parser.add_argument(
+            "--interval", type=float, default=2, help="Seconds between polls"
+        )
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker(batch_size=options["batch_size"])
+        while True:
+            count = worker.drain()
+            if count:
+                self.stdout.write("Handled %d emails" % count)
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
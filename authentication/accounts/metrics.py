@@ -0,0 +1,294 @@
+"""
+In-process request metrics, exposed in the Prometheus text format.
+
+MetricsMiddleware times every request and attributes its database queries,
+password hashing and template rendering to it through a context variable,
+so the numbers follow the request into sync_to_async threads. Metrics live
+in the memory of each worker process and are scraped per process.
+"""
+
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Longest SQL kept in a slow request trace
+TRACE_SQL_LENGTH = 300
+
+_request_stats = ContextVar("request_stats", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def collect(self):
+        yield "# HELP %s %s" % (self.name, self.documentation)
+        yield "# TYPE %s %s" % (self.name, self.kind)
+        with self._lock:
+            values = [
+                (labels, self._snapshot(value)) for labels, value in self._values.items()
+            ]
+        for labels, value in sorted(values):
+            yield from self._samples(labels, value)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _snapshot(self, value):
+        return value
+
+    def _samples(self, labels, value):
+        label_text = _format_labels(self.labelnames, labels)
+        yield "%s_total%s %s" % (self.name, label_text, value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # Per-bucket counts, then the sum of observed values
+                entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def _snapshot(self, value):
+        return list(value)
+
+    def _samples(self, labels, value):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), value):
+            cumulative += count
+            yield "%s_bucket%s %d" % (
+                self.name,
+                _format_labels(self.labelnames, labels, 'le="%s"' % bound),
+                cumulative,
+            )
+        label_text = _format_labels(self.labelnames, labels)
+        yield "%s_sum%s %s" % (self.name, label_text, value[-1])
+        yield "%s_count%s %d" % (self.name, label_text, cumulative)
+
+
+REGISTRY = []
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time spent serving a request.",
+    ("view", "method", "status"),
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database queries run by a request.",
+    ("view",),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds",
+    "Time a request spent waiting on database queries.",
+    ("view",),
+)
+REQUEST_HASH_SECONDS = Histogram(
+    "http_request_password_hash_seconds",
+    "Time a request spent hashing passwords.",
+    ("view",),
+)
+REQUEST_TEMPLATE_SECONDS = Histogram(
+    "http_request_template_seconds",
+    "Time a request spent rendering templates.",
+    ("view",),
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_seconds",
+    "Time spent hashing a single password.",
+    ("algorithm", "operation"),
+)
+SLOW_REQUESTS = Counter(
+    "http_slow_requests",
+    "Requests slower than METRICS_SLOW_REQUEST_SECONDS.",
+    ("view",),
+)
+
+
+def render_metrics():
+    return "\n".join(line for metric in REGISTRY for line in metric.collect()) + "\n"
+
+
+class RequestStats:
+    """
+    What the current request has spent its time on so far. `trace` holds the
+    individual queries when the request was sampled for slow-request tracing.
+    """
+
+    def __init__(self, sampled):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.template_seconds = 0.0
+        self.trace = [] if sampled else None
+
+
+def time_query(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if stats.trace is not None:
+            stats.trace.append((elapsed, sql[:TRACE_SQL_LENGTH]))
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    connection_created receiver adding `time_query` to each new connection.
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def observe_password_hash(algorithm, operation, seconds):
+    PASSWORD_HASH_SECONDS.observe(seconds, algorithm, operation)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.hash_seconds += seconds
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats = _request_stats.get()
+            if stats is not None:
+                stats.template_seconds += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, with rendering time charged to the request.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class MetricsMiddleware:
+    """
+    Records latency, query count and time, password hashing and template
+    time per view, and logs a trace of sampled requests that turn out slow.
+    Works under both WSGI and ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats(random.random() < settings.METRICS_TRACE_SAMPLE_RATE)
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self.record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats(random.random() < settings.METRICS_TRACE_SAMPLE_RATE)
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self.record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, stats, elapsed):
+        match = getattr(request, "resolver_match", None)
+        view = (match.view_name or match._func_path) if match else "<unresolved>"
+        REQUEST_SECONDS.observe(elapsed, view, request.method, response.status_code)
+        REQUEST_QUERIES.observe(stats.queries, view)
+        REQUEST_DB_SECONDS.observe(stats.db_seconds, view)
+        if stats.hash_seconds:
+            REQUEST_HASH_SECONDS.observe(stats.hash_seconds, view)
+        if stats.template_seconds:
+            REQUEST_TEMPLATE_SECONDS.observe(stats.template_seconds, view)
+        if elapsed < settings.METRICS_SLOW_REQUEST_SECONDS:
+            return
+        SLOW_REQUESTS.inc(view)
+        if stats.trace is not None:
+            logger.warning(
+                "Slow request %s %s (%s) took %.1fms: %d queries %.1fms, "
+                "password hashing %.1fms, templates %.1fms%s",
+                request.method,
+                request.path,
+                view,
+                elapsed * 1000,
+                stats.queries,
+                stats.db_seconds * 1000,
+                stats.hash_seconds * 1000,
+                stats.template_seconds * 1000,
+                "".join(
+                    "\n  %.1fms %s" % (seconds * 1000, sql)
+                    for seconds, sql in stats.trace
+                ),
+            )
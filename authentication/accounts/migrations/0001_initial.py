@@ -0,0 +1,49 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:59
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('email', models.EmailField(max_length=255, unique=True, verbose_name='email address')),
+                ('username', models.CharField(blank=True, max_length=30, null=True)),
+                ('user_hash', models.CharField(max_length=30, unique=True)),
+                ('first_name', models.CharField(max_length=30)),
+                ('last_name', models.CharField(max_length=30)),
+                ('phone_number', models.CharField(max_length=10, unique=True, validators=[django.core.validators.RegexValidator(message='Enter a valid phone number.', regex='^\\d{7,10}$')])),
+                ('gender', models.CharField(blank=True, choices=[('', 'Select'), ('M', 'Male'), ('F', 'Female'), ('O', 'Other')], max_length=1, null=True)),
+                ('date_of_birth', models.DateField(blank=True, null=True)),
+                ('blood_group', models.CharField(blank=True, choices=[('', 'Select'), (0, 'A+'), (1, 'A-'), (2, 'B+'), (3, 'B-'), (4, 'AB+'), (5, 'AB-'), (6, 'O+'), (7, 'O-'), (8, 'Skip')], max_length=1, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_superuser', models.BooleanField(default=False)),
+                ('is_admin', models.BooleanField(default=False)),
+                ('is_staff', models.BooleanField(default=False)),
+                ('is_student', models.BooleanField(default=False)),
+                ('is_parent', models.BooleanField(default=False)),
+                ('city', models.CharField(blank=True, max_length=30, null=True)),
+                ('state', models.CharField(blank=True, max_length=30, null=True)),
+                ('country', models.CharField(blank=True, max_length=30, null=True)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('parents', models.ManyToManyField(blank=True, related_name='children', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
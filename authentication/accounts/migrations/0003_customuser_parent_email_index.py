@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_customuser_permissions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['is_parent', 'email'], name='accounts_parent_email_idx'),
+        ),
+    ]
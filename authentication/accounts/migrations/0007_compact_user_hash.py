@@ -0,0 +1,36 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:59
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+
+from accounts.models import make_user_hash
+
+
+def compact_user_hashes(apps, schema_editor):
+    # Whatever `manage.py compact_user_hashes` didn't rewrite ahead of the
+    # deploy, the column can't be shortened over longer hashes
+    CustomUser = apps.get_model("accounts", "CustomUser")
+    users = list(
+        CustomUser.objects.annotate(hash_length=Length("user_hash"))
+        .exclude(hash_length=26)
+        .only("pk", "email")
+    )
+    for user in users:
+        user.user_hash = make_user_hash(user.email)
+    CustomUser.objects.bulk_update(users, ["user_hash"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_outboxemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_user_hashes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='customuser',
+            name='user_hash',
+            field=models.CharField(max_length=26, unique=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from accounts import family
+
+
+def build_closure(apps, schema_editor):
+    family.rebuild(
+        through=apps.get_model("accounts", "CustomUser").parents.through,
+        link_model=apps.get_model("accounts", "FamilyLink"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_compact_user_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FamilyLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paths', models.PositiveIntegerField(default=1)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to=settings.AUTH_USER_MODEL)),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'ancestor'], name='accounts_family_ancestor_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='familylink',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='accounts_family_link_unique'),
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:59
+
+import accounts.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_familylink'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('event', models.CharField(choices=[('login', 'Login'), ('login_failed', 'Login failed'), ('login_throttled', 'Login throttled'), ('login_error', 'Login error'), ('logout', 'Logout'), ('token_obtained', 'Token obtained'), ('registered', 'Registered'), ('password_reset_requested', 'Password reset requested'), ('password_reset', 'Password reset'), ('password_changed', 'Password changed')], max_length=24)),
+                ('user_hash', models.CharField(blank=True, max_length=26)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('detail', models.JSONField(blank=True, default=dict)),
+                ('user', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [accounts.models.TimeIndex(fields=['created_at'], name='accounts_audit_time_idx'), models.Index(fields=['user_hash', '-created_at'], name='accounts_audit_user_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+# accounts.constant.ROLE_GROUPS as of this migration
+ROLE_GROUP_NAMES = ("Student", "Parent", "Staff")
+
+
+def create_role_groups(apps, schema_editor):
+    Group = apps.get_model("auth", "Group")
+    for name in ROLE_GROUP_NAMES:
+        Group.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("accounts", "0009_auditevent"),
+    ]
+
+    operations = [
+        # Left in place on reverse, they may have been given permissions
+        migrations.RunPython(create_role_groups, migrations.RunPython.noop),
+    ]
@@ -1,14 +1,52 @@
+import base64
 import hashlib
+import os
 from uuid import uuid4
 
-from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
+from django.contrib.auth.models import (
+    AbstractBaseUser,
+    BaseUserManager,
+    PermissionsMixin,
+)
+from django.conf import settings
 from django.core import validators
+from django.core.files.storage import FileSystemStorage
 from django.db import models
 
 from .constant import BLOOD_GROUP_CHOICES, GENDER_CHOICES
 
 
+# 128 bits in unpadded lowercase base32
+USER_HASH_LENGTH = 26
+
+
+def make_user_hash(email):
+    """
+    Returns the public user hash for an email address: a fixed-width keyed
+    BLAKE2b digest, so it can't be recomputed from a guessed email without
+    USER_HASH_KEY.
+    """
+    digest = hashlib.blake2b(
+        email.lower().encode(),
+        digest_size=16,
+        key=settings.USER_HASH_KEY.encode()[:64],
+    ).digest()
+    return base64.b32encode(digest).decode().rstrip("=").lower()
+
+
+def normalize_email(email):
+    """
+    Returns `email` as it is stored: all lowercase, so that the unique index
+    on email also answers case-insensitive lookups.
+    """
+    return str(email).strip().lower()
+
+
 class CustomUserManager(BaseUserManager):
+    @classmethod
+    def normalize_email(cls, email):
+        return normalize_email(email or "")
+
     def create_user(
         self, email, first_name, last_name, phone_number, password=None, password1=None
     ):
@@ -49,14 +87,14 @@ class CustomUserManager(BaseUserManager):
         return user
 
 
-class CustomUser(AbstractBaseUser):
+class CustomUser(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(
         verbose_name="email address",
         max_length=255,
         unique=True,
     )
     username = models.CharField(max_length=30, null=True, blank=True)
-    user_hash = models.CharField(max_length=30, unique=True)
+    user_hash = models.CharField(max_length=USER_HASH_LENGTH, unique=True)
     first_name = models.CharField(max_length=30)
     last_name = models.CharField(max_length=30)
     phone_number = models.CharField(
@@ -94,10 +132,33 @@ class CustomUser(AbstractBaseUser):
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["first_name", "last_name", "phone_number"]
 
+    class Meta:
+        indexes = [
+            # Parent typeahead and parent validation in registration
+            models.Index(fields=["is_parent", "email"], name="accounts_parent_email_idx"),
+            # Student and admin lookups only ever touch a small slice of users
+            models.Index(
+                fields=["email"],
+                condition=models.Q(is_student=True),
+                name="accounts_student_email_idx",
+            ),
+            models.Index(
+                fields=["email"],
+                condition=models.Q(is_admin=True),
+                name="accounts_admin_email_idx",
+            ),
+            # Admin date hierarchy. last_login and updated_at are left
+            # unindexed, they change on every login or save and an index on
+            # them would rule out HOT updates. Email prefix search uses the
+            # varchar_pattern_ops index Postgres creates for the unique email.
+            models.Index(fields=["-created_at"], name="accounts_created_at_idx"),
+        ]
+
     def save(self, *args, **kwargs):
+        self.email = normalize_email(self.email)
         if not self.user_hash:
             # Generate a user hash based on the email address
-            self.user_hash = hashlib.sha256(self.email.encode()).hexdigest()
+            self.user_hash = make_user_hash(self.email)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -105,15 +166,209 @@ class CustomUser(AbstractBaseUser):
 
     def has_perm(self, perm, obj=None):
         "Does the user have a specific permission?"
-        # Check if the user has the specific permission
-        # For example, "can_view_dashboard"
-        return self.is_admin or self.is_superuser or super().has_perm(perm)
+        # Admins have every permission, everyone else is checked against the
+        # permission set precomputed by accounts.backends.CachedModelBackend
+        return (self.is_active and self.is_admin) or super().has_perm(perm, obj)
 
     def has_module_perms(self, app_label):
         "Does the user have permissions to view the app `app_label`?"
-        # Check if the user has any permissions for the given app_label
-        return (
-            self.is_admin
-            or self.is_superuser
-            or self.user_permissions.filter(content_type__app_label=app_label).exists()
+        return (self.is_active and self.is_admin) or super().has_module_perms(
+            app_label
         )
+
+
+class FamilyLink(models.Model):
+    """
+    `ancestor` is a parent, grandparent and so on of `descendant`, through
+    `paths` distinct parent chains. Maintained by accounts/family.py.
+    """
+
+    ancestor = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="descendant_links"
+    )
+    descendant = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="ancestor_links"
+    )
+    paths = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            # Also the index for descendant lookups
+            models.UniqueConstraint(
+                fields=["ancestor", "descendant"], name="accounts_family_link_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["descendant", "ancestor"], name="accounts_family_ancestor_idx"
+            ),
+        ]
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be delivered by `manage.py send_outbox`, see
+    accounts/mail.py.
+    """
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (SENT, "Sent"), (FAILED, "Failed")]
+
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    # Recipient lists, extra headers and [content, mimetype] alternatives
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list)
+    bcc = models.JSONField(default=list)
+    reply_to = models.JSONField(default=list)
+    headers = models.JSONField(default=dict)
+    alternatives = models.JSONField(default=list)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Also pushed forward while a worker holds the email, as a lease
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's queue scan only ever looks at pending emails
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(status="pending"),
+                name="accounts_outbox_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return "%s to %s" % (self.subject, ", ".join(self.to))
+
+
+class ImportStorage(FileSystemStorage):
+    """
+    Stores uploaded imports in IMPORT_DIR, away from the served MEDIA_ROOT.
+    """
+
+    @property
+    def base_location(self):
+        return settings.IMPORT_DIR
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+class UserImport(models.Model):
+    """
+    An uploaded import waiting for `manage.py process_imports`, see
+    accounts/bulk.py.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    format = models.CharField(max_length=5)
+    # Deleted once imported, rows may carry passwords
+    file = models.FileField(upload_to="%Y/%m/%d", storage=ImportStorage())
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=PENDING)
+    report = models.JSONField(default=dict)
+    created_by = models.ForeignKey(
+        CustomUser, null=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "Import %s (%s)" % (self.pk, self.status)
+
+
+class TimeIndex(models.Index):
+    """
+    Index on the timestamp of an append-only table. On PostgreSQL it is a
+    BRIN index: rows arrive in time order, so one summary per range of table
+    blocks finds any time window, and the index stays a few pages small.
+    Elsewhere it is a B-tree.
+    """
+
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        if schema_editor.connection.vendor == "postgresql":
+            using = " USING brin"
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+
+class AuditEvent(models.Model):
+    """
+    A login or account event, appended by accounts/audit.py and never
+    updated. `user_hash` identifies the account, also for failed logins
+    with an email nobody registered.
+    """
+
+    LOGIN = "login"
+    LOGIN_FAILED = "login_failed"
+    LOGIN_THROTTLED = "login_throttled"
+    LOGIN_ERROR = "login_error"
+    LOGOUT = "logout"
+    TOKEN_OBTAINED = "token_obtained"
+    REGISTERED = "registered"
+    PASSWORD_RESET_REQUESTED = "password_reset_requested"
+    PASSWORD_RESET = "password_reset"
+    PASSWORD_CHANGED = "password_changed"
+    EVENT_CHOICES = [
+        (LOGIN, "Login"),
+        (LOGIN_FAILED, "Login failed"),
+        (LOGIN_THROTTLED, "Login throttled"),
+        (LOGIN_ERROR, "Login error"),
+        (LOGOUT, "Logout"),
+        (TOKEN_OBTAINED, "Token obtained"),
+        (REGISTERED, "Registered"),
+        (PASSWORD_RESET_REQUESTED, "Password reset requested"),
+        (PASSWORD_RESET, "Password reset"),
+        (PASSWORD_CHANGED, "Password changed"),
+    ]
+
+    # When the event happened, which may be shortly before it was written
+    created_at = models.DateTimeField()
+    event = models.CharField(max_length=24, choices=EVENT_CHOICES)
+    # Kept when the user is deleted, queries go through user_hash
+    user = models.ForeignKey(
+        CustomUser,
+        null=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name="+",
+    )
+    user_hash = models.CharField(max_length=USER_HASH_LENGTH, blank=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    detail = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        indexes = [
+            # Time window scans and retention pruning
+            TimeIndex(fields=["created_at"], name="accounts_audit_time_idx"),
+            # An account's history, newest first
+            models.Index(
+                fields=["user_hash", "-created_at"], name="accounts_audit_user_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return "%s %s at %s" % (self.event, self.user_hash, self.created_at)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Audit events are append-only")
+        super().save(*args, **kwargs)
@@ -0,0 +1,90 @@
+"""
+Anonymous accounts pages served from a per-process page cache.
+
+A page is rendered once per key, with a placeholder where the CSRF token
+goes. Each later response only swaps in the request's token. The ETag is
+derived from the page and the client's CSRF secret, so a browser that still
+holds both gets a 304 without anything being rendered. A cached copy of the
+page carries a token that still matches the client's CSRF cookie.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.crypto import salted_hmac
+
+CSRF_PLACEHOLDER = "csrf-token-placeholder-7b1f0c"
+
+# (template name, key) -> (html, digest)
+_pages = {}
+
+
+def is_cacheable(request):
+    return (
+        settings.PAGE_CACHE
+        and request.method in ("GET", "HEAD")
+        and not request.user.is_authenticated
+        # Pending messages are rendered into the page, and consumed by it
+        and not len(get_messages(request))
+    )
+
+
+def render_page(request, template_name, context=None, key=()):
+    """
+    Renders `template_name` like render(), from the page cache when the
+    request is an anonymous GET. `key` must capture everything besides the
+    template that changes the page's content.
+    """
+    if not is_cacheable(request):
+        return render(request, template_name, context)
+    page = _pages.get((template_name, key))
+    if page is None:
+        html = render_to_string(
+            template_name, {**(context or {}), "csrf_token": CSRF_PLACEHOLDER}, request
+        )
+        page = _pages[(template_name, key)] = (
+            html,
+            hashlib.sha256(html.encode()).hexdigest(),
+        )
+    html, digest = page
+    token = get_token(request)
+    etag = '"%s"' % salted_hmac(
+        "accounts.pages", digest + request.META["CSRF_COOKIE"]
+    ).hexdigest()
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(html.replace(CSRF_PLACEHOLDER, token))
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ("Cookie",))
+    return response
+
+
+class CachedPageMixin:
+    """
+    Serves a TemplateResponseMixin view's anonymous GET responses through
+    render_page().
+    """
+
+    def get_page_key(self, context):
+        return ()
+
+    def render_to_response(self, context, **response_kwargs):
+        if not is_cacheable(self.request):
+            return super().render_to_response(context, **response_kwargs)
+        return render_page(
+            self.request,
+            self.get_template_names()[0],
+            context,
+            self.get_page_key(context),
+        )
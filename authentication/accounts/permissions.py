@@ -0,0 +1,31 @@
+"""
+Access to the service-to-service user APIs.
+
+Tokens obtained by a user with the `accounts.view_customuser` permission,
+i.e. a service account or an admin, carry the USERS_READ_SCOPE in their
+`scope` claim, see CustomTokenObtainPairSerializer. End users' tokens never
+do, so they can't read other users in bulk.
+"""
+
+from rest_framework.permissions import BasePermission
+
+USERS_READ_SCOPE = "users:read"
+
+
+def token_scopes(user):
+    """
+    Returns the space-separated scopes for a token issued to `user`.
+    """
+    return USERS_READ_SCOPE if user.has_perm("accounts.view_customuser") else ""
+
+
+class IsServiceClient(BasePermission):
+    """
+    Allows requests authenticated with a token that carries USERS_READ_SCOPE.
+    """
+
+    def has_permission(self, request, view):
+        token = request.auth
+        if token is None or not hasattr(token, "get"):
+            return False
+        return USERS_READ_SCOPE in str(token.get("scope", "")).split()
@@ -0,0 +1,226 @@
+"""
+Login throttling that runs before any password is hashed, and plain
+per-client rate limits for other anonymous endpoints.
+
+Attempts are counted per client IP, per email and globally with a sliding
+window: the count in the current fixed window plus the previous window's
+count weighted by how much of it still overlaps. Repeated failures for an
+email also lock it out for a period that doubles with every further failure.
+
+Counters live either in this process (RATELIMIT_BACKEND=local) or in the
+shared Django cache (RATELIMIT_BACKEND=cache), so all workers see the same
+counts.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .metrics import Counter
+from .models import make_user_hash
+
+THROTTLED = Counter(
+    "login_throttled",
+    "Login attempts rejected before authentication.",
+    ("scope",),
+)
+
+
+def parse_rate(rate):
+    """
+    Parses "<requests>/<seconds>" into a `(limit, window)` pair, or None when
+    the rate is empty.
+    """
+    if not rate:
+        return None
+    limit, window = rate.split("/")
+    return int(limit), int(window)
+
+
+class LocalBackend:
+    """
+    Counters in this process's memory, evicting the least recently used
+    entries beyond `max_entries`. Each worker process limits on its own.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _set(self, key, value, expires_at):
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._get(key, time.time())
+        return entry[0] if entry else None
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._set(key, value, time.time() + timeout)
+
+    def incr(self, key, timeout):
+        with self._lock:
+            now = time.time()
+            entry = self._get(key, now)
+            if entry is None:
+                self._set(key, 1, now + timeout)
+                return 1
+            self._set(key, entry[0] + 1, entry[1])
+            return entry[0] + 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class CacheBackend:
+    """
+    Counters in a Django cache shared by all workers.
+    """
+
+    def __init__(self, alias="default"):
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout):
+        self.cache.set(key, value, timeout)
+
+    def incr(self, key, timeout):
+        if self.cache.add(key, 1, timeout):
+            return 1
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            self.cache.set(key, 1, timeout)
+            return 1
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+
+BACKENDS = {"local": LocalBackend, "cache": CacheBackend}
+
+
+@lru_cache(maxsize=None)
+def get_backend(name):
+    return BACKENDS[name]()
+
+
+def hit(backend, key, limit, window, now):
+    """
+    Counts an attempt against `key` and returns the seconds until it would
+    be allowed again, or 0 when it is within `limit` per `window` seconds.
+    """
+    index, offset = divmod(now, window)
+    index = int(index)
+    current = backend.incr("ratelimit:%s:%d:%d" % (key, window, index), 2 * window)
+    previous = backend.get("ratelimit:%s:%d:%d" % (key, window, index - 1)) or 0
+    weight = 1 - offset / window
+    if previous * weight + current <= limit:
+        return 0
+    if current > limit or not previous:
+        return math.ceil(window - offset)
+    # When the previous window's share drops enough to let this one through
+    return max(1, math.ceil(window * (1 - (limit - current) / previous) - offset))
+
+
+def throttle(scope, key, rate):
+    """
+    Counts a request against `key` in `scope` at a "<requests>/<seconds>"
+    `rate`, and returns the seconds the client must wait, or 0 when it may
+    proceed.
+    """
+    rate = parse_rate(rate)
+    if rate is None:
+        return 0
+    backend = get_backend(settings.RATELIMIT_BACKEND)
+    return hit(backend, "%s:%s" % (scope, key), *rate, time.time())
+
+
+class LoginThrottle:
+    """
+    Decides whether a login attempt may go on to authenticate(), and tracks
+    failures for progressive lockout. Emails are hashed before being used in
+    keys.
+    """
+
+    @property
+    def backend(self):
+        return get_backend(settings.RATELIMIT_BACKEND)
+
+    def check(self, ip, email):
+        """
+        Counts the attempt and returns the seconds the client must wait, or 0
+        when it may proceed.
+        """
+        now = time.time()
+        backend = self.backend
+        email_key = make_user_hash(email) if email else None
+        if email_key:
+            locked_until = backend.get("lockout:until:%s" % email_key)
+            if locked_until and locked_until > now:
+                THROTTLED.inc("lockout")
+                return math.ceil(locked_until - now)
+        for scope, key, rate in (
+            ("ip", ip, settings.LOGIN_RATE_IP),
+            ("email", email_key, settings.LOGIN_RATE_EMAIL),
+            ("global", "", settings.LOGIN_RATE_GLOBAL),
+        ):
+            rate = parse_rate(rate)
+            if rate is None or key is None:
+                continue
+            retry_after = hit(backend, "login:%s:%s" % (scope, key), *rate, now)
+            if retry_after:
+                THROTTLED.inc(scope)
+                return retry_after
+        return 0
+
+    def failure(self, email):
+        """
+        Records a failed login. From LOGIN_LOCKOUT_THRESHOLD failures on, the
+        email is locked for LOGIN_LOCKOUT_SECONDS, doubled for each further
+        failure up to LOGIN_LOCKOUT_MAX_SECONDS.
+        """
+        email_key = make_user_hash(email)
+        backend = self.backend
+        failures = backend.incr(
+            "lockout:failures:%s" % email_key, settings.LOGIN_LOCKOUT_RESET_SECONDS
+        )
+        excess = failures - settings.LOGIN_LOCKOUT_THRESHOLD
+        if excess >= 0:
+            duration = min(
+                settings.LOGIN_LOCKOUT_SECONDS * 2 ** min(excess, 32),
+                settings.LOGIN_LOCKOUT_MAX_SECONDS,
+            )
+            backend.set(
+                "lockout:until:%s" % email_key, time.time() + duration, duration
+            )
+
+    def success(self, email):
+        self.backend.delete("lockout:failures:%s" % make_user_hash(email))
+
+
+login_throttle = LoginThrottle()
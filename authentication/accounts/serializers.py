@@ -0,0 +1,96 @@
+from rest_framework import exceptions, serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from . import audit
+from .models import AuditEvent, CustomUser
+from .permissions import token_scopes
+from .ratelimit import login_throttle
+
+
+class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        """
+        Adds the CustomUser claims other services need, so they can authorize
+        requests from the token alone without calling back into this service.
+        """
+        token = super().get_token(user)
+        token["email"] = user.email
+        token["user_hash"] = user.user_hash
+        token["is_student"] = user.is_student
+        token["is_parent"] = user.is_parent
+        token["is_staff"] = user.is_staff
+        scope = token_scopes(user)
+        if scope:
+            token["scope"] = scope
+        return token
+
+    def validate(self, attrs):
+        # Emails are stored lowercased, same as LoginView
+        email = attrs[self.username_field] = str(attrs[self.username_field]).lower()
+        request = self.context.get("request")
+        # Throttled the same way as LoginView, before any password is hashed
+        retry_after = login_throttle.check(
+            request.META.get("REMOTE_ADDR") if request else None, email
+        )
+        if retry_after:
+            audit.record(
+                AuditEvent.LOGIN_THROTTLED,
+                request,
+                email=email,
+                retry_after=retry_after,
+            )
+            raise exceptions.Throttled(retry_after)
+        try:
+            data = super().validate(attrs)
+        except exceptions.AuthenticationFailed:
+            login_throttle.failure(email)
+            raise
+        login_throttle.success(email)
+        audit.record(AuditEvent.TOKEN_OBTAINED, request, self.user)
+        return data
+
+
+class UserLookupSerializer(serializers.ModelSerializer):
+    """
+    Public user profile for other services. Pass `fields` to serialize only
+    those fields. Relations are listed by user_hash.
+    """
+
+    relations = ("parents", "children")
+
+    parents = serializers.SlugRelatedField(
+        many=True, read_only=True, slug_field="user_hash"
+    )
+    children = serializers.SlugRelatedField(
+        many=True, read_only=True, slug_field="user_hash"
+    )
+
+    class Meta:
+        model = CustomUser
+        fields = (
+            "id",
+            "user_hash",
+            "email",
+            "first_name",
+            "last_name",
+            "gender",
+            "date_of_birth",
+            "blood_group",
+            "is_active",
+            "is_student",
+            "is_parent",
+            "city",
+            "state",
+            "country",
+            "created_at",
+            "updated_at",
+            "parents",
+            "children",
+        )
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
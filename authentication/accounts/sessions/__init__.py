@@ -0,0 +1,38 @@
+"""
+Session engines that renew a session's expiry lazily.
+
+Django's SESSION_SAVE_EVERY_REQUEST rewrites the session on every request to
+slide its expiry forward. These engines only rewrite it once
+SESSION_RENEW_FRACTION of SESSION_COOKIE_AGE has passed since the last save,
+so an active session costs one write per renewal window instead of one per
+request. Use one of:
+
+    SESSION_ENGINE = "accounts.sessions.cached_db"
+    SESSION_ENGINE = "accounts.sessions.signed_cookies"
+"""
+
+import time
+
+from django.conf import settings
+
+RENEWED_AT_KEY = "_session_renewed_at"
+
+
+class LazyRenewalMixin:
+    def _renewal_due(self, data):
+        renewed_at = data.get(RENEWED_AT_KEY)
+        if renewed_at is None:
+            return True
+        renew_after = self.get_session_cookie_age() * settings.SESSION_RENEW_FRACTION
+        return time.time() - renewed_at >= renew_after
+
+    def load(self):
+        data = super().load()
+        if data and self._renewal_due(data):
+            # Saved by SessionMiddleware at the end of the request
+            self.modified = True
+        return data
+
+    def save(self, must_create=False):
+        self._get_session(no_load=must_create)[RENEWED_AT_KEY] = int(time.time())
+        super().save(must_create)
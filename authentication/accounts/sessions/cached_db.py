@@ -0,0 +1,11 @@
+"""
+Cached, database-backed sessions with lazy expiry renewal.
+"""
+
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+from . import LazyRenewalMixin
+
+
+class SessionStore(LazyRenewalMixin, CachedDBStore):
+    pass
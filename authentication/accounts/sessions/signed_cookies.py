@@ -0,0 +1,13 @@
+"""
+Signed cookie sessions with lazy expiry renewal.
+"""
+
+from django.contrib.sessions.backends.signed_cookies import (
+    SessionStore as SignedCookiesStore,
+)
+
+from . import LazyRenewalMixin
+
+
+class SessionStore(LazyRenewalMixin, SignedCookiesStore):
+    pass
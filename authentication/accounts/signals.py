@@ -0,0 +1,143 @@
+from django.contrib.auth.models import Group
+from django.contrib.auth.signals import (
+    user_logged_in,
+    user_logged_out,
+    user_login_failed,
+)
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import audit, availability, family, geo
+from .cache import invalidate_permissions, invalidate_user
+from .models import AuditEvent, CustomUser
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=CustomUser)
+def add_to_availability_filter(sender, instance, update_fields, **kwargs):
+    if update_fields is None or {"email", "phone_number"} & set(update_fields):
+        availability.registered.add(instance.email, instance.phone_number)
+
+
+@receiver(m2m_changed, sender=CustomUser.user_permissions.through)
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        invalidate_user(instance.pk)
+    elif pk_set is None:
+        # Cleared from the group or permission side
+        invalidate_permissions()
+    else:
+        for pk in pk_set:
+            invalidate_user(pk)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    if action.startswith("post_"):
+        invalidate_permissions()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group(sender, **kwargs):
+    invalidate_permissions()
+
+
+# The lookup API derives ETags from updated_at, so linking or unlinking a
+# parent counts as an update of both users
+
+
+@receiver(m2m_changed, sender=CustomUser.parents.through)
+def touch_linked_users(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        # post_clear doesn't say who was unlinked
+        related = instance.children if reverse else instance.parents
+        instance._unlinked_pks = set(related.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if action == "post_clear":
+            pk_set = instance._unlinked_pks
+        CustomUser.objects.filter(pk__in={instance.pk, *pk_set}).update(
+            updated_at=timezone.now()
+        )
+
+
+@receiver(pre_delete, sender=CustomUser)
+def touch_unlinked_users(sender, instance, **kwargs):
+    CustomUser.objects.filter(Q(parents=instance) | Q(children=instance)).update(
+        updated_at=timezone.now()
+    )
+
+
+def _edges(instance, reverse, pks):
+    # Edges are (parent, child). From the children side instance is the parent
+    return [(instance.pk, pk) if reverse else (pk, instance.pk) for pk in pks]
+
+
+@receiver(m2m_changed, sender=CustomUser.parents.through)
+def maintain_family_closure(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "post_add":
+        # pk_set only holds the links that didn't exist yet
+        family.add_edges(_edges(instance, reverse, pk_set))
+    elif action == "pre_remove":
+        # pk_set holds whatever was asked for, keep the links that exist
+        own, other = (
+            ("to_customuser", "from_customuser")
+            if reverse
+            else ("from_customuser", "to_customuser")
+        )
+        instance._removed_pks = set(
+            sender.objects.filter(
+                **{own: instance.pk, other + "__in": pk_set}
+            ).values_list(other, flat=True)
+        )
+    elif action == "post_remove":
+        family.remove_edges(
+            _edges(instance, reverse, instance.__dict__.pop("_removed_pks", ()))
+        )
+    elif action == "post_clear":
+        # Filled in by touch_linked_users on pre_clear
+        family.remove_edges(
+            _edges(instance, reverse, getattr(instance, "_unlinked_pks", ()))
+        )
+
+
+@receiver(pre_delete, sender=CustomUser)
+def remove_from_family(sender, instance, **kwargs):
+    Through = CustomUser.parents.through
+    edges = Through.objects.filter(
+        Q(from_customuser=instance) | Q(to_customuser=instance)
+    ).values_list("to_customuser_id", "from_customuser_id")
+    family.remove_edges(list(edges))
+
+
+@receiver(user_logged_in)
+def locate_user(sender, request, user, **kwargs):
+    geo.enricher.submit(user, request.META.get("REMOTE_ADDR"))
+
+
+@receiver(user_logged_in)
+def audit_login(sender, request, user, **kwargs):
+    audit.record(AuditEvent.LOGIN, request, user)
+
+
+@receiver(user_login_failed)
+def audit_login_failure(sender, credentials, request=None, **kwargs):
+    audit.record(
+        AuditEvent.LOGIN_FAILED, request, email=credentials.get("username")
+    )
+
+
+@receiver(user_logged_out)
+def audit_logout(sender, request, user, **kwargs):
+    if user is not None:
+        audit.record(AuditEvent.LOGOUT, request, user)
@@ -1,3 +1,1654 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from datetime import timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.contrib.messages import constants as message_constants
+from django.contrib.messages.storage.base import Message
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.mail import send_mail
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import (
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from rest_framework_simplejwt import state as jwt_state
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (
+    audit,
+    availability,
+    bulk,
+    cleanup,
+    family,
+    geo,
+    hashers,
+    jwks,
+    metrics,
+    pages,
+    ratelimit,
+)
+from .cache import get_user, local_users
+from .constant import ROLE_GROUPS
+from .forms import CustomUserCreationForm, sign_user_type
+from .mail import OutboxWorker
+from .models import (
+    USER_HASH_LENGTH,
+    AuditEvent,
+    CustomUser,
+    OutboxEmail,
+    UserImport,
+)
+from .serializers import CustomTokenObtainPairSerializer
+from .sessions import RENEWED_AT_KEY
+from .views import AsyncLoginView, AsyncUserRegistrationView, AsyncUserTypeView
+
+USER_TABLE = CustomUser._meta.db_table
+
+
+def issued_access_token(user):
+    """
+    Returns an access token for `user` with the claims token/ would give it.
+    """
+    return CustomTokenObtainPairSerializer.get_token(user).access_token
+
+
+class QueryPlanRecorder:
+    """
+    Records the queries run through `connection` so their plans can be
+    checked with EXPLAIN afterwards.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    def user_table_selects(self):
+        return [
+            (sql, params)
+            for sql, params in self.queries
+            if sql.lstrip().upper().startswith("SELECT") and USER_TABLE in sql
+        ]
+
+
+def explain(sql, params):
+    """
+    Returns the query plan as text, with sequential scans disabled on
+    Postgres so tiny test tables still show which index would be used.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN " + sql, params)
+        else:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return "\n".join(" ".join(map(str, row)) for row in cursor.fetchall())
+
+
+def is_table_scan(plan):
+    if connection.vendor == "postgresql":
+        return "Seq Scan on %s" % USER_TABLE in plan
+    # SQLite reports index scans as "SCAN <table> [AS alias] USING ... INDEX"
+    return any(
+        line.split("SCAN ", 1)[1].split()[0] == USER_TABLE and "INDEX" not in line
+        for line in plan.splitlines()
+        if "SCAN " in line
+    )
+
+
+class QueryAuditMixin:
+    """
+    Pins the number of queries a flow runs and fails when any of its
+    queries on the user table would need a full table scan.
+    """
+
+    @contextmanager
+    def assertIndexedQueries(self, num):
+        recorder = QueryPlanRecorder()
+        with self.assertNumQueries(num), connection.execute_wrapper(recorder):
+            yield
+        for sql, params in recorder.user_table_selects():
+            plan = explain(sql, params)
+            self.assertFalse(
+                is_table_scan(plan),
+                "Full scan of %s:\n%s\n%s" % (USER_TABLE, sql, plan),
+            )
+
+
+# Audit events are written by a background thread, tested in AuditTests
+@override_settings(PBKDF2_ITERATIONS=1000, AUDIT_SINK="")
+class QueryAuditTests(QueryAuditMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = CustomUser.objects.create_user(
+            "parent@example.com", "Pa", "Rent", "1111111", password="secret-pw-1"
+        )
+        cls.parent.is_parent = True
+        cls.parent.save()
+        cls.admin = CustomUser.objects.create_superuser(
+            "admin@example.com", "Ad", "Min", "2222222", password="secret-pw-2"
+        )
+
+    def test_registration_page(self):
+        with self.assertIndexedQueries(1):
+            response = self.client.get(registration_url("0"))
+        self.assertContains(response, "parent-options")
+
+    def test_registration(self):
+        # Email and phone number are checked in one query. Linking the
+        # parent also touches both users' updated_at and adds the link to
+        # the family closure
+        with self.assertIndexedQueries(10):
+            response = self.client.post(
+                registration_url("0"),
+                {
+                    "email": "Student@example.com",
+                    "first_name": "Stu",
+                    "last_name": "Dent",
+                    "phone_number": "3333333",
+                    "password1": "secret-pw-3",
+                    "password2": "secret-pw-3",
+                    "parent_user": self.parent.pk,
+                },
+            )
+        self.assertRedirects(response, reverse("login"), fetch_redirect_response=False)
+
+    def test_family_lookups(self):
+        grandparent = CustomUser.objects.create_user(
+            "grandparent@example.com", "Grand", "Parent", "4444444"
+        )
+        student = CustomUser.objects.create_user(
+            "student@example.com", "Stu", "Dent", "3333333"
+        )
+        self.parent.parents.add(grandparent)
+        student.parents.add(self.parent)
+        with self.assertIndexedQueries(1):
+            self.assertEqual(
+                list(family.descendants(grandparent).order_by("pk")),
+                [self.parent, student],
+            )
+        with self.assertIndexedQueries(1):
+            self.assertEqual(set(family.ancestors(student)), {grandparent, self.parent})
+        with self.assertRaises(ValueError), transaction.atomic():
+            grandparent.parents.add(student)
+        self.parent.parents.remove(grandparent)
+        self.assertEqual(list(family.descendants(grandparent)), [])
+
+    def test_parent_search(self):
+        with self.assertIndexedQueries(1):
+            response = self.client.get(reverse("parent_search"), {"q": "par"})
+        self.assertEqual(response.json()["results"][0]["email"], "parent@example.com")
+
+    @override_settings(RATELIMIT_BACKEND="local", PARENT_SEARCH_RATE_IP="2/60")
+    def test_parent_search_is_limited_per_ip(self):
+        ratelimit.get_backend.cache_clear()
+        self.addCleanup(ratelimit.get_backend.cache_clear)
+        url = reverse("parent_search")
+        for _ in range(2):
+            self.assertEqual(self.client.get(url, {"q": "par"}).status_code, 200)
+        response = self.client.get(url, {"q": "par"})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        response = self.client.get(url, {"q": "par"}, REMOTE_ADDR="203.0.113.7")
+        self.assertEqual(response.status_code, 200)
+
+    def test_login(self):
+        with self.assertIndexedQueries(9):
+            response = self.client.post(
+                reverse("login"),
+                {"email": "Parent@example.com", "password": "secret-pw-1"},
+            )
+        self.assertRedirects(
+            response, reverse("registration"), fetch_redirect_response=False
+        )
+
+    def test_resolve_user_hashes(self):
+        token = issued_access_token(self.admin)
+        with self.assertIndexedQueries(2):
+            response = self.client.post(
+                reverse("user_resolve"),
+                {"user_hashes": [self.parent.user_hash, "unknown"]},
+                content_type="application/json",
+                HTTP_AUTHORIZATION="Bearer %s" % token,
+            )
+        self.assertEqual(len(self.parent.user_hash), USER_HASH_LENGTH)
+        self.assertEqual(list(response.json()["users"]), [self.parent.user_hash])
+        self.assertEqual(response.json()["missing"], ["unknown"])
+
+    def test_resolve_needs_a_service_token(self):
+        for token in (
+            issued_access_token(self.parent),
+            AccessToken.for_user(self.admin),
+        ):
+            response = self.client.post(
+                reverse("user_resolve"),
+                {"user_hashes": [self.admin.user_hash]},
+                content_type="application/json",
+                HTTP_AUTHORIZATION="Bearer %s" % token,
+            )
+            self.assertEqual(response.status_code, 403)
+
+    def test_user_lookup(self):
+        child = CustomUser.objects.create_user(
+            "child@example.com", "Chi", "Ld", "5555555", password="secret-pw-5"
+        )
+        child.parents.add(self.parent)
+        auth = {"HTTP_AUTHORIZATION": "Bearer %s" % issued_access_token(self.admin)}
+        params = {
+            "hashes": "%s,%s" % (self.parent.user_hash, child.user_hash),
+            "fields": "first_name,parents,children",
+        }
+        with self.assertIndexedQueries(5):
+            response = self.client.get(reverse("user_lookup"), params, **auth)
+        self.assertEqual(
+            response.json()["users"],
+            [
+                {"first_name": "Pa", "parents": [], "children": [child.user_hash]},
+                {
+                    "first_name": "Chi",
+                    "parents": [self.parent.user_hash],
+                    "children": [],
+                },
+            ],
+        )
+        with self.assertIndexedQueries(2):
+            response = self.client.get(
+                reverse("user_lookup"),
+                params,
+                HTTP_IF_NONE_MATCH=response["ETag"],
+                **auth,
+            )
+        self.assertEqual(response.status_code, 304)
+        child.parents.clear()
+        response = self.client.get(
+            reverse("user_lookup"), params, HTTP_IF_NONE_MATCH=response["ETag"], **auth
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_lookup_needs_a_service_token(self):
+        response = self.client.get(
+            reverse("user_lookup"),
+            {"hashes": self.admin.user_hash},
+            HTTP_AUTHORIZATION="Bearer %s" % issued_access_token(self.parent),
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_admin_changelist(self):
+        self.client.force_login(self.admin)
+        with self.assertIndexedQueries(7):
+            response = self.client.get(
+                reverse("admin:accounts_customuser_changelist")
+            )
+        self.assertEqual(response.status_code, 200)
+
+
+def reload_urls():
+    clear_url_caches()
+    importlib.reload(importlib.import_module("accounts.urls"))
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+
+
+@override_settings(PBKDF2_ITERATIONS=1000)
+class PermissionTests(TestCase):
+    """
+    Role group permissions, and the user cache that carries them.
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_users.clear()
+        self.student = CustomUser.objects.create_user(
+            "role@example.com", "Ro", "Le", "8888888", password="secret-pw-8"
+        )
+        self.student.is_student = True
+        self.student.save()
+        self.view = Permission.objects.get(codename="view_customuser")
+        self.change = Permission.objects.get(codename="change_customuser")
+
+    def test_role_groups_exist(self):
+        self.assertEqual(
+            set(Group.objects.values_list("name", flat=True)),
+            set(ROLE_GROUPS.values()),
+        )
+
+    def test_role_group_permissions(self):
+        Group.objects.get(name="Student").permissions.add(self.view)
+        user = get_user(self.student.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm("accounts.view_customuser"))
+            self.assertFalse(user.has_perm("accounts.change_customuser"))
+            self.assertTrue(user.has_module_perms("accounts"))
+            self.assertFalse(user.has_module_perms("auth"))
+        parent = CustomUser.objects.create_user(
+            "role-parent@example.com", "Pa", "Rent", "8888889", password="secret-pw-9"
+        )
+        parent = get_user(parent.pk)
+        self.assertFalse(parent.has_perm("accounts.view_customuser"))
+
+    def test_cached_user(self):
+        get_user(self.student.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user(self.student.pk).first_name, "Ro")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.student.first_name = "Renamed"
+            self.student.save()
+        self.assertEqual(get_user(self.student.pk).first_name, "Renamed")
+        self.assertIsNone(get_user(0))
+
+    def test_invalidation_waits_for_the_commit(self):
+        get_user(self.student.pk)
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                self.student.is_active = False
+                self.student.save()
+            # What a concurrent reader would get until the commit, and
+            # nothing it caches meanwhile survives the commit
+            self.assertTrue(get_user(self.student.pk).is_active)
+        self.assertTrue(get_user(self.student.pk).is_active)
+        for callback in callbacks:
+            callback()
+        self.assertFalse(get_user(self.student.pk).is_active)
+
+    def test_permission_changes_invalidate_cached_users(self):
+        def committed(change, *args):
+            with self.captureOnCommitCallbacks(execute=True):
+                return change(*args)
+
+        self.assertFalse(get_user(self.student.pk).has_perm("accounts.view_customuser"))
+        # Through the group of the user's role
+        group = Group.objects.get(name="Student")
+        committed(group.permissions.add, self.view)
+        self.assertTrue(get_user(self.student.pk).has_perm("accounts.view_customuser"))
+        committed(group.permissions.remove, self.view)
+        self.assertFalse(get_user(self.student.pk).has_perm("accounts.view_customuser"))
+        # Through the user's own permissions and groups
+        committed(self.student.user_permissions.add, self.change)
+        self.assertTrue(
+            get_user(self.student.pk).has_perm("accounts.change_customuser")
+        )
+        other = Group.objects.create(name="Editors")
+        committed(other.permissions.add, self.view)
+        committed(other.user_set.add, self.student)
+        self.assertTrue(get_user(self.student.pk).has_perm("accounts.view_customuser"))
+        committed(other.user_set.clear)
+        self.assertFalse(get_user(self.student.pk).has_perm("accounts.view_customuser"))
+
+
+class AvailabilityTests(QueryAuditMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        CustomUser.objects.create_user(
+            "Taken@Example.com", "Ta", "Ken", "4444444", password="secret-pw-4"
+        )
+
+    def setUp(self):
+        # A filter of this test's users only, built in the test's transaction
+        registered = availability.RegisteredFilter(background=False)
+        patcher = mock.patch.object(availability, "registered", registered)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def check(self, **params):
+        response = self.client.post(
+            reverse("user_availability"), params, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_batch_is_checked_in_one_query(self):
+        with self.settings(AVAILABILITY_BLOOM_ERROR_RATE=0):
+            with self.assertIndexedQueries(1):
+                result = self.check(
+                    emails=["TAKEN@example.com", "free@example.com"],
+                    phone_numbers=["4444444", "5555555"],
+                )
+        self.assertEqual(
+            result,
+            {
+                "emails": {"TAKEN@example.com": False, "free@example.com": True},
+                "phone_numbers": {"4444444": False, "5555555": True},
+            },
+        )
+
+    def test_bloom_filter_answers_free_without_query(self):
+        # Builds the filter
+        self.check(emails=["free@example.com"])
+        with self.assertNumQueries(0):
+            result = self.check(emails=["free@example.com"])
+        self.assertEqual(result["emails"], {"free@example.com": True})
+        with self.assertNumQueries(1):
+            result = self.check(emails=["taken@example.com"])
+        self.assertEqual(result["emails"], {"taken@example.com": False})
+
+        # Saving a user adds it to the filter straight away
+        CustomUser.objects.create_user(
+            "new@example.com", "N", "Ew", "5555555", password="secret-pw-5"
+        )
+        response = self.client.get(
+            reverse("user_availability"), {"phone_numbers": "5555555"}
+        )
+        self.assertEqual(response.json()["phone_numbers"], {"5555555": False})
+
+    @override_settings(AVAILABILITY_BLOOM_REFRESH=5, AVAILABILITY_BLOOM_REBUILD=3600)
+    def test_filter_is_rebuilt_for_changed_emails(self):
+        patcher = mock.patch.object(availability, "time")
+        clock = patcher.start().monotonic
+        self.addCleanup(patcher.stop)
+        # Registered long before, out of reach of the catch-ups
+        CustomUser.objects.update(created_at=timezone.now() - timedelta(days=1))
+        clock.return_value = 1000
+        self.check(emails=["changed@example.com"])
+        # As changed by another process
+        CustomUser.objects.update(email="changed@example.com")
+        clock.return_value = 1000 + 60
+        result = self.check(emails=["changed@example.com"])
+        self.assertEqual(result["emails"], {"changed@example.com": True})
+        clock.return_value = 1000 + 3600
+        result = self.check(emails=["changed@example.com"])
+        self.assertEqual(result["emails"], {"changed@example.com": False})
+
+    @override_settings(RATELIMIT_BACKEND="local", AVAILABILITY_RATE_IP="2/60")
+    def test_requests_are_limited_per_ip(self):
+        ratelimit.get_backend.cache_clear()
+        self.addCleanup(ratelimit.get_backend.cache_clear)
+        url = reverse("user_availability")
+        params = {"emails": "free@example.com"}
+        for _ in range(2):
+            self.assertEqual(self.client.get(url, params).status_code, 200)
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        response = self.client.get(url, params, REMOTE_ADDR="203.0.113.7")
+        self.assertEqual(response.status_code, 200)
+
+    def test_batches_are_small(self):
+        response = self.client.post(
+            reverse("user_availability"),
+            {"emails": ["user%d@example.com" % i for i in range(11)]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_registration_form(self):
+        form = CustomUserCreationForm(
+            {
+                "email": "TAKEN@example.com",
+                "first_name": "Du",
+                "last_name": "Plicate",
+                "phone_number": "4444444",
+                "password1": "secret-pw-5",
+                "password2": "secret-pw-5",
+            }
+        )
+        with self.assertNumQueries(1):
+            self.assertFalse(form.is_valid())
+        self.assertEqual(
+            form.errors,
+            {
+                "email": ["Custom user with this Email address already exists."],
+                "phone_number": ["Custom user with this Phone number already exists."],
+            },
+        )
+
+
+def registration_url(user_type):
+    return "%s?%s" % (
+        reverse("registration"),
+        urlencode({"state": sign_user_type(user_type)}),
+    )
+
+
+@override_settings(PBKDF2_ITERATIONS=1000, AUDIT_SINK="")
+class RegistrationStateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = CustomUser.objects.create_user(
+            "parent@example.com", "Pa", "Rent", "1111111", password="secret-pw-1"
+        )
+        cls.parent.is_parent = True
+        cls.parent.save()
+
+    def test_registration_creates_no_session(self):
+        response = self.client.post(reverse("user_type"), {"select_type": "0"})
+        registration = response["Location"]
+        self.assertTrue(registration.startswith(reverse("registration") + "?state="))
+        self.assertContains(self.client.get(registration), "parent-options")
+        response = self.client.post(
+            registration,
+            {
+                "email": "student@example.com",
+                "first_name": "Stu",
+                "last_name": "Dent",
+                "phone_number": "3333333",
+                "password1": "secret-pw-3",
+                "password2": "secret-pw-3",
+                "parent_user": self.parent.pk,
+            },
+        )
+        self.assertRedirects(response, reverse("login"), fetch_redirect_response=False)
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+
+    def test_bad_state_goes_back_to_user_type(self):
+        url = registration_url("0")
+        user_type = reverse("user_type")
+        response = self.client.get(url[:-1])
+        self.assertRedirects(response, user_type, fetch_redirect_response=False)
+        with self.settings(REGISTRATION_STATE_MAX_AGE=-1):
+            response = self.client.post(url)
+        self.assertRedirects(response, user_type, fetch_redirect_response=False)
+
+    def test_api(self):
+        data = {
+            "user_type": "0",
+            "email": "Student@example.com",
+            "first_name": "Stu",
+            "last_name": "Dent",
+            "phone_number": "3333333",
+            "password1": "secret-pw-3",
+            "password2": "secret-pw-3",
+        }
+        response = self.client.post(
+            reverse("user_register"), data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ["parent_user"])
+        data["parent_user"] = self.parent.pk
+        response = self.client.post(
+            reverse("user_register"), data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        student = CustomUser.objects.get(pk=response.json()["id"])
+        self.assertEqual(student.email, "student@example.com")
+        self.assertEqual(list(student.parents.all()), [self.parent])
+        self.assertEqual(Session.objects.count(), 0)
+
+
+@override_settings(ASYNC_VIEWS=True, PBKDF2_ITERATIONS=1000, AUDIT_SINK="")
+class AsyncViewTests(TransactionTestCase):
+    """
+    The registration and login flow through the views the ASGI app serves.
+    A TransactionTestCase, as logins hash and query on the hashing pool.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        reload_urls()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        reload_urls()
+
+    async def test_registration_and_login(self):
+        for name, view in (
+            ("user_type", AsyncUserTypeView),
+            ("registration", AsyncUserRegistrationView),
+            ("login", AsyncLoginView),
+        ):
+            self.assertIs(resolve(reverse(name)).func.view_class, view)
+        parent = await CustomUser.objects.acreate(
+            email="parent@example.com",
+            first_name="Pa",
+            last_name="Rent",
+            phone_number="1111111",
+            is_parent=True,
+        )
+
+        response = await self.async_client.post(
+            reverse("user_type"), {"select_type": "0"}
+        )
+        registration = response["Location"]
+        response = await self.async_client.get(registration)
+        self.assertContains(response, "parent-options")
+        response = await self.async_client.post(
+            registration,
+            {
+                "email": "Student@example.com",
+                "first_name": "Stu",
+                "last_name": "Dent",
+                "phone_number": "3333333",
+                "password1": "secret-pw-3",
+                "password2": "secret-pw-3",
+                "parent_user": parent.pk,
+            },
+        )
+        self.assertRedirects(response, reverse("login"), fetch_redirect_response=False)
+        student = await CustomUser.objects.aget(email="student@example.com")
+        self.assertTrue(await family.ancestors(student).filter(pk=parent.pk).aexists())
+
+        response = await self.async_client.post(
+            reverse("login"), {"email": "student@example.com", "password": "wrong"}
+        )
+        self.assertContains(response, "Email or password is incorrect")
+        response = await self.async_client.post(
+            reverse("login"),
+            {"email": "Student@example.com", "password": "secret-pw-3"},
+        )
+        self.assertRedirects(
+            response, reverse("registration"), fetch_redirect_response=False
+        )
+        response = await self.async_client.get(reverse("login"))
+        self.assertRedirects(
+            response, reverse("registration"), fetch_redirect_response=False
+        )
+
+    async def test_hashing_pool_closes_stale_connections(self):
+        threads = []
+        with mock.patch.object(
+            hashers,
+            "close_old_connections",
+            lambda: threads.append(threading.current_thread().name),
+        ):
+            user = await hashers.aauthenticate(
+                username="nobody@example.com", password="secret-pw-3"
+            )
+        self.assertIsNone(user)
+        # Before and after the call, on the pool thread that ran it
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith("password-hash") for name in threads))
+
+
+class GeoTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "test.geoip")
+        geo.write_database(
+            path,
+            [
+                ("10.0.0.0", "10.0.0.255", "Pune", "Maharashtra", "IN"),
+                ("2001:db8::", "2001:db8::ffff", "", "", "DE"),
+                ("1.0.0.0", "1.0.0.255", "Kochi", "Kerala", "IN"),
+            ],
+        )
+        override = override_settings(GEOIP_DATABASE=path)
+        override.enable()
+        self.addCleanup(override.disable)
+        geo.get_database.cache_clear()
+        self.addCleanup(geo.get_database.cache_clear)
+
+    def test_lookup(self):
+        database = geo.get_database()
+        self.addCleanup(database.close)
+        self.assertEqual(database.lookup("1.0.0.7").city, "Kochi")
+        self.assertEqual(database.lookup("10.0.0.255").state, "Maharashtra")
+        self.assertEqual(
+            database.lookup("2001:db8::1"), geo.Location(None, None, "DE")
+        )
+        for ip in ("0.255.255.255", "10.0.1.0", "2001:db9::", "not-an-ip"):
+            self.assertIsNone(database.lookup(ip))
+
+    def test_batch_is_saved_in_one_query(self):
+        users = [
+            CustomUser.objects.create_user(
+                "geo%d@example.com" % i, "Ge", "O", "555555%d" % i
+            )
+            for i in range(2)
+        ]
+        with self.assertNumQueries(1):
+            geo.enricher.write(
+                [
+                    (users[0].pk, "10.0.0.1"),
+                    (users[1].pk, "10.0.0.2"),
+                    (users[1].pk, "192.0.2.1"),
+                ]
+            )
+        users[0].refresh_from_db()
+        self.assertEqual(
+            (users[0].ip_address, users[0].city, users[0].country),
+            ("10.0.0.1", "Pune", "IN"),
+        )
+        users[1].refresh_from_db()
+        self.assertEqual((users[1].ip_address, users[1].city), ("192.0.2.1", None))
+
+
+@override_settings(PBKDF2_ITERATIONS=1000, AUDIT_FLUSH_SECONDS=0.01)
+@skipUnless(connection.vendor == "postgresql", "SQLite only runs one writer")
+class FamilyConcurrencyTests(TransactionTestCase):
+    def test_concurrent_links_keep_the_closure_complete(self):
+        a, b, c, d = (
+            CustomUser.objects.create_user(
+                "%s@example.com" % name, name.upper(), "Family", "900000%d" % i
+            )
+            for i, name in enumerate("abcd")
+        )
+        c.parents.add(b)
+        linked = threading.Event()
+        errors = []
+
+        def link_a_to_b():
+            try:
+                with transaction.atomic():
+                    b.parents.add(a)
+                    linked.set()
+                    # Still uncommitted while c -> d is linked, which needs
+                    # this link to add a -> d
+                    time.sleep(0.5)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                linked.set()
+                connection.close()
+
+        thread = threading.Thread(target=link_a_to_b)
+        thread.start()
+        linked.wait(5)
+        d.parents.add(c)
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(set(family.ancestors(d)), {a, b, c})
+        self.assertEqual(set(family.descendants(a)), {b, c, d})
+
+
+class AvailabilityFilterTests(TransactionTestCase):
+    """
+    A TransactionTestCase, as the filter is built on another thread.
+    """
+
+    def test_filter_is_built_in_background(self):
+        CustomUser.objects.create_user("taken@example.com", "Ta", "Ken", "4444444")
+        registered = availability.RegisteredFilter()
+        building, release = threading.Event(), threading.Event()
+
+        class SlowBloomFilter(availability.BloomFilter):
+            def __init__(self, *args):
+                super().__init__(*args)
+                building.set()
+                release.wait(5)
+
+        with mock.patch.object(availability, "BloomFilter", SlowBloomFilter):
+            self.assertIsNone(registered.get())
+            self.assertTrue(building.wait(5))
+            # Neither blocks while the filter is being built
+            self.assertIsNone(registered.get())
+            registered.add("during@example.com", "5555555")
+            release.set()
+            registered._thread.join(5)
+        bloom = registered.get()
+        self.assertIn(availability.email_key("taken@example.com"), bloom)
+        self.assertIn(availability.email_key("during@example.com"), bloom)
+        self.assertNotIn(availability.email_key("free@example.com"), bloom)
+
+
+class AuditTests(TransactionTestCase):
+    """
+    A TransactionTestCase, as events are written by the audit writer thread.
+    """
+
+    def test_login_events(self):
+        user = CustomUser.objects.create_user(
+            "audit@example.com", "Au", "Dit", "6666666", password="secret-pw-6"
+        )
+        # Flushed after each request: the shared in-memory SQLite test
+        # database fails writes that overlap the writer thread's instead of
+        # waiting for them
+        self.client.post(
+            reverse("login"), {"email": "Audit@example.com", "password": "wrong"}
+        )
+        audit.writer.flush()
+        self.client.post(
+            reverse("login"), {"email": "audit@example.com", "password": "secret-pw-6"}
+        )
+        audit.writer.flush()
+        self.client.post(reverse("logout"))
+        audit.writer.flush()
+        self.assertEqual(
+            list(AuditEvent.objects.order_by("pk").values_list("event", "user_id")),
+            [
+                (AuditEvent.LOGIN_FAILED, None),
+                (AuditEvent.LOGIN, user.pk),
+                (AuditEvent.LOGOUT, user.pk),
+            ],
+        )
+        self.assertEqual(
+            set(AuditEvent.objects.values_list("user_hash", flat=True)),
+            {user.user_hash},
+        )
+
+    def test_prune(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        now = timezone.now()
+        old = now - timedelta(days=100)
+        with self.settings(AUDIT_SINK="jsonl", AUDIT_LOG_DIR=directory.name):
+            audit.record(AuditEvent.LOGIN_FAILED, email="old@example.com")
+            audit.writer.flush()
+            recent_log = audit.log_path(now.astimezone(dt_timezone.utc))
+            with open(recent_log) as f:
+                self.assertEqual(json.loads(f.read())["event"], "login_failed")
+            old_log = audit.log_path(old)
+            open(old_log, "w").close()
+            AuditEvent.objects.bulk_create(
+                AuditEvent(created_at=created_at, event=AuditEvent.LOGIN)
+                for created_at in (old, old, now)
+            )
+            call_command("prune_audit", stdout=io.StringIO())
+            self.assertEqual(AuditEvent.objects.get().created_at, now)
+            self.assertEqual(os.listdir(directory.name), [os.path.basename(recent_log)])
+
+
+class CleanupTests(TestCase):
+    def test_only_expired_rows_are_deleted_in_batches(self):
+        now = timezone.now()
+        Session.objects.bulk_create(
+            Session(
+                session_key="session%d" % i,
+                session_data="",
+                expire_date=now + timedelta(minutes=-1 if i < 5 else 1),
+            )
+            for i in range(7)
+        )
+        tokens = OutstandingToken.objects.bulk_create(
+            OutstandingToken(
+                jti="jti%d" % i,
+                token="",
+                expires_at=now + timedelta(days=-1 if i < 3 else 1),
+            )
+            for i in range(5)
+        )
+        BlacklistedToken.objects.create(token=tokens[0])
+        BlacklistedToken.objects.create(token=tokens[4])
+        progress = []
+
+        totals = cleanup.collect(
+            batch_size=2, progress=lambda *args: progress.append(args)
+        )
+        self.assertEqual(totals, {"sessions": 5, "tokens": 3, "outbox": 0})
+        self.assertEqual(
+            [args[:2] for args in progress if args[0] == "sessions"],
+            [("sessions", 2), ("sessions", 4), ("sessions", 5)],
+        )
+        self.assertEqual(Session.objects.count(), 2)
+        self.assertEqual(
+            list(OutstandingToken.objects.order_by("pk")), tokens[3:]
+        )
+        self.assertEqual(BlacklistedToken.objects.get().token, tokens[4])
+
+    def test_old_sent_and_failed_emails_are_deleted(self):
+        for i, status in enumerate(
+            [OutboxEmail.SENT, OutboxEmail.FAILED, OutboxEmail.PENDING] * 2
+        ):
+            email = OutboxEmail.objects.create(
+                subject="Hi",
+                body="Body",
+                from_email="from@example.com",
+                to=["to%d@example.com" % i],
+                status=status,
+                next_attempt_at=timezone.now(),
+            )
+            # created_at is auto_now_add, only an update can backdate it
+            OutboxEmail.objects.filter(pk=email.pk).update(
+                created_at=timezone.now() - timedelta(days=8 if i < 3 else 6)
+            )
+        totals = cleanup.collect(["outbox"], batch_size=1)
+        self.assertEqual(totals, {"outbox": 2})
+        self.assertEqual(
+            sorted(email.to[0] for email in OutboxEmail.objects.all()),
+            ["to%d@example.com" % i for i in (2, 3, 4, 5)],
+        )
+
+
+@override_settings(PBKDF2_ITERATIONS=1000, AUDIT_SINK="")
+class ImportTests(TestCase):
+    def setUp(self):
+        import_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(import_dir.cleanup)
+        self.import_dir = import_dir.name
+        overrides = override_settings(IMPORT_DIR=self.import_dir)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def import_rows(self, *rows):
+        stream = io.StringIO("".join(json.dumps(row) + "\n" for row in rows))
+        return bulk.import_users(stream, "jsonl", processes=1)
+
+    def row(self, name, phone_number, **extra):
+        return {
+            "email": "%s@example.com" % name,
+            "first_name": name.title(),
+            "last_name": "Imported",
+            "phone_number": phone_number,
+            **extra,
+        }
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        CustomUser.objects.create_user("taken@example.com", "Ta", "Ken", "1000000")
+        report = self.import_rows(
+            self.row("parent", "1000001", is_parent="yes"),
+            self.row("child", "1000002", parent_emails=["Parent@example.com"]),
+            self.row("taken", "1000003"),
+            self.row("flag", "1000004", is_student="maybe"),
+            self.row("orphan", "1000005", parent_emails=["gone@example.com"]),
+            ["not", "an", "object"],
+        )
+        self.assertEqual(report.created, 3)
+        self.assertEqual(report.linked, 1)
+        self.assertEqual(sorted(error["line"] for error in report.errors), [3, 4, 5, 6])
+        parent = CustomUser.objects.get(email="parent@example.com")
+        self.assertTrue(parent.is_parent)
+        self.assertEqual(
+            [user.email for user in family.descendants(parent)], ["child@example.com"]
+        )
+
+    def test_parent_cycles_are_reported_and_skipped(self):
+        report = self.import_rows(
+            self.row("first", "2000001", parent_emails=["second@example.com"]),
+            self.row("second", "2000002", parent_emails=["first@example.com"]),
+            self.row("self", "2000003", parent_emails=["self@example.com"]),
+        )
+        self.assertEqual(report.created, 3)
+        self.assertEqual(report.linked, 1)
+        self.assertEqual([error["line"] for error in report.errors], [2, 3])
+        second = CustomUser.objects.get(email="second@example.com")
+        self.assertEqual(
+            [user.email for user in family.descendants(second)], ["first@example.com"]
+        )
+        self.assertEqual(list(family.ancestors(second)), [])
+        links = CustomUser.parents.through.objects.values_list(
+            "from_customuser__email", "to_customuser__email"
+        )
+        self.assertEqual(list(links), [("first@example.com", "second@example.com")])
+
+    def upload(self, content):
+        admin = CustomUser.objects.create_superuser(
+            "admin@example.com", "Ad", "Min", "3000000", password="secret-pw-1"
+        )
+        self.auth = {"HTTP_AUTHORIZATION": "Bearer %s" % AccessToken.for_user(admin)}
+        upload = io.BytesIO(content)
+        upload.name = "users.csv"
+        return self.client.post(reverse("user_import"), {"file": upload}, **self.auth)
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.import_dir) for name in names]
+
+    def test_uploads_are_queued(self):
+        response = self.upload(
+            b"\xef\xbb\xbfemail,first_name,last_name,phone_number,password\n"
+            b"queued@example.com,Que,Ued,3000001,secret-pw-2\n"
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(CustomUser.objects.filter(email="queued@example.com").exists())
+        self.assertEqual(len(self.stored_files()), 1)
+
+        call_command("process_imports", processes=1, stdout=io.StringIO())
+
+        self.assertTrue(CustomUser.objects.filter(email="queued@example.com").exists())
+        status = self.client.get(response.json()["url"], **self.auth).json()
+        self.assertEqual(status["status"], UserImport.DONE)
+        self.assertEqual(status["report"], {"created": 1, "linked": 0, "errors": []})
+        self.assertFalse(UserImport.objects.get().file)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_failed_imports_are_deleted_too(self):
+        response = self.upload(b"email,first_name\n\xff\xfe\n")
+        self.assertEqual(response.status_code, 202)
+        with self.assertLogs("accounts.bulk", "ERROR"):
+            call_command("process_imports", processes=1, stdout=io.StringIO())
+        job = UserImport.objects.get()
+        self.assertEqual(job.status, UserImport.FAILED)
+        self.assertIn("UnicodeDecodeError", job.report["detail"])
+        self.assertEqual(self.stored_files(), [])
+
+    @override_settings(IMPORT_MAX_UPLOAD_SIZE=64)
+    def test_large_uploads_are_refused(self):
+        response = self.upload(b"email,first_name,last_name,phone_number\n" * 2)
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(UserImport.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+def metric_value(name, **labels):
+    """
+    Returns the value of one sample in the rendered metrics, 0 when absent.
+    """
+    wanted = ",".join('%s="%s"' % item for item in labels.items())
+    prefix = "%s{%s} " % (name, wanted) if labels else name + " "
+    for line in metrics.render_metrics().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix) :])
+    return 0
+
+
+@override_settings(METRICS_TOKEN="scrape-me", METRICS_TRACE_SAMPLE_RATE=1)
+class MetricsTests(TestCase):
+    def test_endpoint_needs_the_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong-token")
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-me")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "# TYPE http_request_duration_seconds histogram")
+        with self.settings(METRICS_TOKEN=""):
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer ")
+        self.assertEqual(response.status_code, 403)
+
+    def test_requests_are_recorded_per_view(self):
+        labels = {"view": "login", "method": "GET", "status": "200"}
+        requests = metric_value("http_request_duration_seconds_count", **labels)
+        templates = metric_value("http_request_template_seconds_count", view="login")
+        with self.settings(METRICS_SLOW_REQUEST_SECONDS=0), self.assertLogs(
+            "accounts.metrics", "WARNING"
+        ) as logs:
+            self.client.get(reverse("login"))
+        self.assertEqual(
+            metric_value("http_request_duration_seconds_count", **labels),
+            requests + 1,
+        )
+        self.assertEqual(
+            metric_value("http_request_template_seconds_count", view="login"),
+            templates + 1,
+        )
+        self.assertIn("Slow request GET %s (login)" % reverse("login"), logs.output[0])
+
+    def test_query_timer_charges_the_current_request(self):
+        stats = metrics.RequestStats(sampled=True)
+        token = metrics._request_stats.set(stats)
+        try:
+            CustomUser.objects.filter(email="nobody@example.com").exists()
+        finally:
+            metrics._request_stats.reset(token)
+        CustomUser.objects.exists()
+        self.assertEqual(stats.queries, 1)
+        self.assertGreater(stats.db_seconds, 0)
+        # Traces keep the SQL without its parameters
+        self.assertEqual(len(stats.trace), 1)
+        self.assertIn('"email" = %s', stats.trace[0][1])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram(
+            "test_seconds", "Test histogram.", ("kind",), buckets=(1, 2)
+        )
+        self.addCleanup(metrics.REGISTRY.remove, histogram)
+        for value in (0.5, 1, 3):
+            histogram.observe(value, "a")
+        histogram.observe(1.5, 'quoted "b"')
+        self.assertEqual(
+            list(histogram.collect()),
+            [
+                "# HELP test_seconds Test histogram.",
+                "# TYPE test_seconds histogram",
+                'test_seconds_bucket{kind="a",le="1"} 2',
+                'test_seconds_bucket{kind="a",le="2"} 2',
+                'test_seconds_bucket{kind="a",le="+Inf"} 3',
+                'test_seconds_sum{kind="a"} 4.5',
+                'test_seconds_count{kind="a"} 3',
+                'test_seconds_bucket{kind="quoted \\"b\\"",le="1"} 0',
+                'test_seconds_bucket{kind="quoted \\"b\\"",le="2"} 1',
+                'test_seconds_bucket{kind="quoted \\"b\\"",le="+Inf"} 1',
+                'test_seconds_sum{kind="quoted \\"b\\""} 1.5',
+                'test_seconds_count{kind="quoted \\"b\\""} 1',
+            ],
+        )
+
+
+@override_settings(
+    PBKDF2_ITERATIONS=1000,
+    AUDIT_SINK="",
+    RATELIMIT_BACKEND="local",
+    LOGIN_RATE_IP="",
+    LOGIN_RATE_EMAIL="",
+    LOGIN_RATE_GLOBAL="",
+    LOGIN_LOCKOUT_THRESHOLD=2,
+    LOGIN_LOCKOUT_SECONDS=30,
+    LOGIN_LOCKOUT_MAX_SECONDS=100,
+)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        # A fresh LocalBackend per test, on a clock the test moves
+        ratelimit.get_backend.cache_clear()
+        self.addCleanup(ratelimit.get_backend.cache_clear)
+        patcher = mock.patch.object(ratelimit, "time")
+        self.clock = patcher.start().time
+        self.addCleanup(patcher.stop)
+        self.clock.return_value = 1200.0
+
+    def test_sliding_window(self):
+        backend = ratelimit.LocalBackend()
+        self.assertEqual(ratelimit.hit(backend, "k", 2, 10, 100), 0)
+        self.assertEqual(ratelimit.hit(backend, "k", 2, 10, 100), 0)
+        self.assertEqual(ratelimit.hit(backend, "k", 2, 10, 100), 10)
+        # Half of the previous window's 3 attempts still count
+        self.assertEqual(ratelimit.hit(backend, "k", 2, 10, 115), 2)
+        self.assertEqual(ratelimit.hit(backend, "k", 2, 10, 125), 0)
+        self.assertEqual(ratelimit.parse_rate("30/60"), (30, 60))
+        self.assertIsNone(ratelimit.parse_rate(""))
+
+    def test_lockout_doubles_up_to_the_maximum(self):
+        throttle = ratelimit.login_throttle
+        throttle.failure("locked@example.com")
+        self.assertEqual(throttle.check("10.0.0.1", "locked@example.com"), 0)
+        for retry_after in (30, 60, 100, 100):
+            throttle.failure("locked@example.com")
+            self.assertEqual(
+                throttle.check("10.0.0.1", "locked@example.com"), retry_after
+            )
+        self.assertEqual(throttle.check("10.0.0.1", "other@example.com"), 0)
+
+        # A success forgets the failures, but not a lockout already running
+        throttle.success("locked@example.com")
+        self.assertEqual(throttle.check("10.0.0.1", "locked@example.com"), 100)
+        self.clock.return_value += 100
+        self.assertEqual(throttle.check("10.0.0.1", "locked@example.com"), 0)
+        throttle.failure("locked@example.com")
+        self.assertEqual(throttle.check("10.0.0.1", "locked@example.com"), 0)
+
+    @override_settings(LOGIN_RATE_EMAIL="2/60")
+    def test_email_limit_is_per_hashed_email(self):
+        throttle = ratelimit.login_throttle
+        for ip in ("10.0.0.1", "10.0.0.2"):
+            self.assertEqual(throttle.check(ip, "many@example.com"), 0)
+        self.assertEqual(throttle.check("10.0.0.3", "many@example.com"), 60)
+        self.assertEqual(throttle.check("10.0.0.3", "few@example.com"), 0)
+        keys = list(ratelimit.get_backend("local")._data)
+        self.assertTrue(keys)
+        self.assertFalse([key for key in keys if "example.com" in key])
+
+    def test_token_endpoint_is_throttled(self):
+        CustomUser.objects.create_user(
+            "api@example.com", "A", "Pi", "8888888", password="secret-pw-8"
+        )
+        url = reverse("token_obtain_pair")
+        for _ in range(2):
+            response = self.client.post(
+                url, {"email": "api@example.com", "password": "wrong"}
+            )
+            self.assertEqual(response.status_code, 401)
+        # Locked out, even with the right password
+        response = self.client.post(
+            url, {"email": "API@example.com", "password": "secret-pw-8"}
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+
+        self.clock.return_value += 30
+        response = self.client.post(
+            url, {"email": "api@example.com", "password": "secret-pw-8"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("access", response.json())
+
+
+def page_csrf_token(response):
+    html = response.content.decode()
+    start = html.index('name="csrfmiddlewaretoken" value="') + 34
+    return html[start : html.index('"', start)]
+
+
+@override_settings(PAGE_CACHE=True, PBKDF2_ITERATIONS=1000, AUDIT_SINK="")
+class PageCacheTests(TestCase):
+    def setUp(self):
+        pages._pages.clear()
+        self.addCleanup(pages._pages.clear)
+
+    def test_each_client_gets_its_own_csrf_token(self):
+        first = self.client.get(reverse("login"))
+        other = Client(enforce_csrf_checks=True)
+        second = other.get(reverse("login"))
+        self.assertEqual(len(pages._pages), 1)
+        self.assertNotContains(first, pages.CSRF_PLACEHOLDER)
+        self.assertNotEqual(page_csrf_token(first), page_csrf_token(second))
+        self.assertEqual(
+            first.content.decode().replace(page_csrf_token(first), ""),
+            second.content.decode().replace(page_csrf_token(second), ""),
+        )
+        # The token served from the cache passes the CSRF check
+        response = other.post(
+            reverse("login"),
+            {
+                "email": "nobody@example.com",
+                "password": "wrong",
+                "csrfmiddlewaretoken": page_csrf_token(second),
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_unchanged_page_is_not_modified(self):
+        response = self.client.get(reverse("login"))
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+        etag = response["ETag"]
+        response = self.client.get(reverse("login"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        # Another client's CSRF cookie makes another ETag
+        response = Client().get(reverse("login"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_pages_with_user_content_bypass_the_cache(self):
+        user = CustomUser.objects.create_user(
+            "cached@example.com", "Ca", "Ched", "6666666", password="secret-pw-6"
+        )
+        self.client.force_login(user)
+        response = self.client.get(reverse("user_type"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+        self.assertEqual(pages._pages, {})
+
+        anonymous = Client()
+        storage = CookieStorage(RequestFactory().get("/"))
+        anonymous.cookies[storage.cookie_name] = storage._encode(
+            [Message(message_constants.ERROR, "Pending for this client")]
+        )
+        response = anonymous.get(reverse("login"))
+        self.assertContains(response, "Pending for this client")
+        self.assertNotIn("ETag", response)
+        self.assertEqual(pages._pages, {})
+        response = Client().get(reverse("login"))
+        self.assertIn("ETag", response)
+        self.assertNotContains(response, "Pending for this client")
+
+
+class SessionRenewalMixin:
+    """
+    Sessions are rewritten once SESSION_RENEW_FRACTION of SESSION_COOKIE_AGE has
+    passed since the last write, and left alone before that.
+    """
+
+    def setUp(self):
+        cache.clear()
+        local_users.clear()
+        self.start = time.time()
+        clock = mock.Mock()
+        clock.time.return_value = self.start
+        self.clock = clock.time
+        for module in ("accounts.sessions.time", "django.core.signing.time"):
+            patcher = mock.patch(module, clock)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        user = CustomUser.objects.create_user(
+            "renewed@example.com", "Re", "Newed", "5555555", password="secret-pw-5"
+        )
+        self.client.force_login(user)
+
+    def visit(self, seconds):
+        """
+        Requests the login page `seconds` after the login, returning whether the
+        session was still logged in and how many times it was written.
+        """
+        self.clock.return_value = self.start + seconds
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("login"))
+        return response.status_code == 302, self.writes(response, queries)
+
+    def session_data(self):
+        store = importlib.import_module(settings.SESSION_ENGINE).SessionStore
+        return store(self.client.cookies[settings.SESSION_COOKIE_NAME].value).load()
+
+    def test_session_is_only_written_once_the_renewal_is_due(self):
+        self.assertEqual(self.visit(10), (True, 0))
+        self.assertEqual(self.visit(149), (True, 0))
+        self.assertEqual(self.visit(150), (True, 1))
+        self.assertEqual(self.session_data()[RENEWED_AT_KEY], int(self.start + 150))
+        # The window restarts from the renewal
+        self.assertEqual(self.visit(160), (True, 0))
+        self.assertEqual(self.visit(299), (True, 0))
+        self.assertEqual(self.visit(300), (True, 1))
+
+    def test_load_only_marks_the_session_modified_when_renewal_is_due(self):
+        store = importlib.import_module(settings.SESSION_ENGINE).SessionStore
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.clock.return_value = self.start + 149
+        session = store(session_key)
+        self.assertIn(RENEWED_AT_KEY, session.load())
+        self.assertFalse(session.modified)
+        self.clock.return_value = self.start + 150
+        session = store(session_key)
+        session.load()
+        self.assertTrue(session.modified)
+
+    def test_sessions_without_a_renewal_stamp_are_renewed(self):
+        store = importlib.import_module(settings.SESSION_ENGINE).SessionStore
+        session = store()
+        self.assertTrue(session._renewal_due({}))
+        session["key"] = "value"
+        session.save()
+        self.assertEqual(session[RENEWED_AT_KEY], int(self.start))
+
+
+@override_settings(
+    SESSION_ENGINE="accounts.sessions.cached_db",
+    SESSION_RENEW_FRACTION=0.5,
+    PBKDF2_ITERATIONS=1000,
+    AUDIT_SINK="",
+)
+class CachedDBSessionRenewalTests(SessionRenewalMixin, TestCase):
+    def writes(self, response, queries):
+        return sum(
+            query["sql"].startswith('UPDATE "django_session"')
+            for query in queries.captured_queries
+        )
+
+
+@override_settings(
+    SESSION_ENGINE="accounts.sessions.signed_cookies",
+    SESSION_RENEW_FRACTION=0.5,
+    PBKDF2_ITERATIONS=1000,
+    AUDIT_SINK="",
+)
+class SignedCookieSessionRenewalTests(SessionRenewalMixin, TestCase):
+    def writes(self, response, queries):
+        return int(settings.SESSION_COOKIE_NAME in response.cookies)
+
+    def test_renewal_extends_the_cookie_past_its_first_expiry(self):
+        # The cookie's signature only lasts SESSION_COOKIE_AGE from its last write
+        self.assertEqual(self.visit(299), (True, 1))
+        self.assertEqual(self.visit(440), (True, 0))
+        self.assertEqual(self.visit(600)[0], False)
+
+    def test_cookie_expires_without_a_renewal(self):
+        self.assertEqual(self.visit(100), (True, 0))
+        # Replaced by a fresh, anonymous session
+        self.assertEqual(self.visit(301), (False, 1))
+        self.assertNotIn("_auth_user_id", self.session_data())
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 stand-in")
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb == "RCPT":
+                address = command.split(":", 1)[1].strip().strip("<>")
+                if address in self.server.reject:
+                    self.reply("550 No such user")
+                    continue
+                recipients.append(address)
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b"".join(iter(self.rfile.readline, b".\r\n"))
+                self.server.messages.append((recipients, data))
+                recipients = []
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                break
+            self.reply("250 OK")
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """
+    A local SMTP server that keeps the messages it receives in memory and
+    refuses the addresses in `reject`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, reject=()):
+        super().__init__(("127.0.0.1", 0), SMTPStandInHandler)
+        self.reject = set(reject)
+        self.messages = []
+        self.connections = 0
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    def settings(self):
+        return override_settings(
+            EMAIL_DELIVERY_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=self.server_address[1],
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+        )
+
+
+@override_settings(
+    EMAIL_BACKEND="accounts.mail.OutboxEmailBackend",
+    PBKDF2_ITERATIONS=1000,
+    AUDIT_SINK="",
+)
+class OutboxTests(TestCase):
+    def test_password_reset_is_queued(self):
+        CustomUser.objects.create_user(
+            "reset@example.com", "Re", "Set", "4444444", password="secret-pw-4"
+        )
+        response = self.client.post(
+            reverse("password_reset"), {"email": "reset@example.com"}
+        )
+        self.assertRedirects(
+            response, reverse("password_reset_done"), fetch_redirect_response=False
+        )
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to, ["reset@example.com"])
+        self.assertEqual(email.status, OutboxEmail.PENDING)
+
+    def test_batch_is_sent_over_one_connection(self):
+        for i in range(3):
+            send_mail("Hi", "Body", "from@example.com", ["to%d@example.com" % i])
+        with SMTPStandIn() as server, server.settings():
+            self.assertEqual(OutboxWorker(batch_size=2).drain(), 3)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(len(server.messages), 3)
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.SENT).exists())
+        self.assertEqual(set(OutboxEmail.objects.values_list("body", flat=True)), {""})
+
+    def test_failures_are_retried_with_backoff(self):
+        send_mail("Hi", "Body", "from@example.com", ["gone@example.com"])
+        send_mail("Hi", "Body", "from@example.com", ["later@example.com"])
+        with SMTPStandIn(reject=["gone@example.com"]) as server:
+            pass
+        # The server is down now, so the second email fails temporarily
+        with server.settings():
+            OutboxWorker().drain()
+        later = OutboxEmail.objects.get(to=["later@example.com"])
+        self.assertEqual(later.status, OutboxEmail.PENDING)
+        self.assertEqual(later.attempts, 1)
+        self.assertGreater(later.next_attempt_at, timezone.now())
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        with SMTPStandIn(reject=["gone@example.com"]) as server, server.settings():
+            OutboxWorker().drain()
+        self.assertEqual(len(server.messages), 1)
+        gone = OutboxEmail.objects.get(to=["gone@example.com"])
+        self.assertEqual(gone.status, OutboxEmail.FAILED)
+        self.assertIn("550", gone.last_error)
+        later.refresh_from_db()
+        self.assertEqual(later.status, OutboxEmail.SENT)
+
+
+def new_signing_key():
+    private_key = ed25519.Ed25519PrivateKey.generate()
+    return jwks.SigningKey(private_key.public_key(), private_key)
+
+
+def retire(key):
+    return jwks.SigningKey(key.public_key)
+
+
+class TokenBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.old_key = new_signing_key()
+        self.token = jwks.KeyRotatingTokenBackend(jwks.KeySet(self.old_key)).encode(
+            {"user_id": 1}
+        )
+
+    def test_tokens_name_their_key(self):
+        self.assertEqual(jwt.get_unverified_header(self.token)["kid"], self.old_key.kid)
+        backend = jwks.KeyRotatingTokenBackend(jwks.KeySet(self.old_key))
+        self.assertEqual(backend.decode(self.token)["user_id"], 1)
+
+    def test_rotation(self):
+        new_key = new_signing_key()
+        backend = jwks.KeyRotatingTokenBackend(
+            jwks.KeySet(new_key, [retire(self.old_key)])
+        )
+        # Tokens of the retired key verify until it is dropped
+        self.assertEqual(backend.decode(self.token)["user_id"], 1)
+        token = backend.encode({"user_id": 2})
+        self.assertEqual(jwt.get_unverified_header(token)["kid"], new_key.kid)
+        self.assertEqual(backend.decode(token)["user_id"], 2)
+        self.assertEqual(
+            [key["kid"] for key in backend.key_set.as_jwks()["keys"]],
+            [new_key.kid, self.old_key.kid],
+        )
+
+        backend = jwks.KeyRotatingTokenBackend(jwks.KeySet(new_key))
+        with self.assertRaises(TokenBackendError):
+            backend.decode(self.token)
+
+    def test_forged_tokens_are_rejected(self):
+        backend = jwks.KeyRotatingTokenBackend(jwks.KeySet(self.old_key))
+        header, payload, signature = self.token.split(".")
+        forged = jwks.KeyRotatingTokenBackend(jwks.KeySet(new_signing_key())).encode(
+            {"user_id": 1}
+        )
+        for token in (
+            # Another key's signature under the kid of ours
+            "%s.%s.%s" % (header, payload, forged.split(".")[2]),
+            jwt.encode({"user_id": 1}, "secret", algorithm="HS256"),
+            jwt.encode({"user_id": 1}, None, algorithm="none"),
+        ):
+            with self.subTest(token=token), self.assertRaises(TokenBackendError):
+                backend.decode(token)
+
+
+@override_settings(PBKDF2_ITERATIONS=1000, AUDIT_SINK="")
+class TokenEndpointKeyTests(TestCase):
+    def test_obtained_tokens_are_signed_with_the_configured_key(self):
+        key = new_signing_key()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "jwt.pem")
+        with open(path, "wb") as f:
+            f.write(
+                key.private_key.private_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption(),
+                )
+            )
+        self.addCleanup(jwks.get_key_set.cache_clear)
+        patcher = mock.patch.object(jwt_state, "token_backend", jwt_state.token_backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with self.settings(JWT_PRIVATE_KEY_FILE=path):
+            jwks.get_key_set.cache_clear()
+            jwks.install_token_backend()
+
+        user = CustomUser.objects.create_user(
+            "jwt@example.com", "J", "Wt", "7777777", password="secret-pw-7"
+        )
+        response = self.client.post(
+            reverse("token_obtain_pair"),
+            {"email": "jwt@example.com", "password": "secret-pw-7"},
+        )
+        access = response.json()["access"]
+        self.assertEqual(jwt.get_unverified_header(access)["kid"], key.kid)
+        self.assertEqual(AccessToken(access)["user_id"], user.pk)
+        self.assertEqual(
+            self.client.get(reverse("jwks")).json(), {"keys": [key.jwk]}
+        )
+
+
+class FakeJWKSEndpoint:
+    """
+    Stands in for urlopen() of a JWKS URL, counting the fetches.
+    """
+
+    def __init__(self, *keys):
+        self.keys = list(keys)
+        self.fetches = 0
+        self.down = False
+
+    def __call__(self, url, timeout):
+        self.fetches += 1
+        if self.down:
+            raise OSError("Connection refused")
+        return io.BytesIO(json.dumps({"keys": [key.jwk for key in self.keys]}).encode())
+
+
+class JWKSCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(jwks.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.key = new_signing_key()
+        self.endpoint = FakeJWKSEndpoint(self.key)
+        patcher = mock.patch.object(jwks.urllib.request, "urlopen", self.endpoint)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = jwks.JWKSCache(
+            "https://issuer.example.com/jwks.json", ttl=300, min_refresh_interval=30
+        )
+
+    def test_keys_are_cached_for_the_ttl(self):
+        token = jwks.KeyRotatingTokenBackend(jwks.KeySet(self.key)).encode({"a": 1})
+        self.assertEqual(self.cache.decode(token), {"a": 1})
+        self.now += 299
+        self.assertEqual(self.cache.decode(token), {"a": 1})
+        self.assertEqual(self.endpoint.fetches, 1)
+        self.now += 1
+        self.cache.decode(token)
+        self.assertEqual(self.endpoint.fetches, 2)
+
+    def test_unknown_kids_refetch_at_most_every_min_refresh_interval(self):
+        self.assertIsNotNone(self.cache.get_key(self.key.kid))
+        new_key = new_signing_key()
+        self.endpoint.keys.append(new_key)
+        self.now += 10
+        for _ in range(5):
+            self.assertIsNone(self.cache.get_key("forged"))
+            self.assertIsNone(self.cache.get_key(new_key.kid))
+        self.assertEqual(self.endpoint.fetches, 1)
+        self.now += 20
+        self.assertIsNotNone(self.cache.get_key(new_key.kid))
+        self.assertEqual(self.endpoint.fetches, 2)
+
+    def test_expired_keys_are_served_while_the_issuer_is_down(self):
+        self.assertIsNotNone(self.cache.get_key(self.key.kid))
+        self.endpoint.down = True
+        self.now += 600
+        for _ in range(10):
+            self.assertIsNotNone(self.cache.get_key(self.key.kid))
+        self.assertEqual(self.endpoint.fetches, 2)
+        # Retried once the interval has passed
+        self.now += 30
+        self.assertIsNotNone(self.cache.get_key(self.key.kid))
+        self.assertEqual(self.endpoint.fetches, 3)
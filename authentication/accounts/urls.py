@@ -1,16 +1,70 @@
+from django.conf import settings
 from django.contrib.auth import views as auth_views
 from django.urls import path
+from rest_framework_simplejwt import views as jwt_views
 
-from .views import LoginView, UserRegistrationView, UserTypeView
+from .views import (
+    AsyncLoginView,
+    AsyncUserRegistrationView,
+    AsyncUserTypeView,
+    AvailabilityView,
+    LoginView,
+    ParentSearchView,
+    PasswordChangeView,
+    PasswordResetCompleteView,
+    PasswordResetConfirmView,
+    PasswordResetDoneView,
+    PasswordResetView,
+    RegistrationAPIView,
+    UserExportView,
+    UserImportStatusView,
+    UserImportView,
+    UserLookupView,
+    UserRegistrationView,
+    UserResolveView,
+    UserTypeView,
+    VerifyingKeyView,
+)
+
+# The ASGI app serves the async views, see server/asgi.py
+if settings.ASYNC_VIEWS:
+    login_view = AsyncLoginView
+    user_type_view = AsyncUserTypeView
+    registration_view = AsyncUserRegistrationView
+else:
+    login_view = LoginView
+    user_type_view = UserTypeView
+    registration_view = UserRegistrationView
 
 urlpatterns = [
-    path("user_type/", UserTypeView.as_view(), name="user_type"),
-    path("registration/", UserRegistrationView.as_view(), name="registration"),
-    path("login/", LoginView.as_view(), name="login"),
+    path("user_type/", user_type_view.as_view(), name="user_type"),
+    path("registration/", registration_view.as_view(), name="registration"),
+    path("register/", RegistrationAPIView.as_view(), name="user_register"),
+    path("availability/", AvailabilityView.as_view(), name="user_availability"),
+    path("parents/", ParentSearchView.as_view(), name="parent_search"),
+    path("resolve/", UserResolveView.as_view(), name="user_resolve"),
+    path("lookup/", UserLookupView.as_view(), name="user_lookup"),
+    path("login/", login_view.as_view(), name="login"),
     path("logout/", auth_views.LogoutView.as_view(), name="logout"),
+    path("token/", jwt_views.TokenObtainPairView.as_view(), name="token_obtain_pair"),
+    path("token/refresh/", jwt_views.TokenRefreshView.as_view(), name="token_refresh"),
+    path("token/verify/", jwt_views.TokenVerifyView.as_view(), name="token_verify"),
+    path(
+        "token/blacklist/",
+        jwt_views.TokenBlacklistView.as_view(),
+        name="token_blacklist",
+    ),
+    path("token/key/", VerifyingKeyView.as_view(), name="token_verifying_key"),
+    path("import/", UserImportView.as_view(), name="user_import"),
+    path(
+        "import/<int:pk>/",
+        UserImportStatusView.as_view(),
+        name="user_import_status",
+    ),
+    path("export.<str:fmt>", UserExportView.as_view(), name="user_export"),
     path(
         "password_reset/",
-        auth_views.PasswordResetView.as_view(
+        PasswordResetView.as_view(
             template_name="accounts/password_reset.html",
             email_template_name="accounts/password_reset_email.html",
             subject_template_name="accounts/password_reset_subject.txt",
@@ -19,28 +73,28 @@ urlpatterns = [
     ),
     path(
         "password_reset/<uidb64>/<token>",
-        auth_views.PasswordResetConfirmView.as_view(
+        PasswordResetConfirmView.as_view(
             template_name="accounts/password_reset_confirm.html"
         ),
         name="password_reset_confirm",
     ),
     path(
         "password_reset/done/",
-        auth_views.PasswordResetDoneView.as_view(
+        PasswordResetDoneView.as_view(
             template_name="accounts/password_reset_done.html"
         ),
         name="password_reset_done",
     ),
     path(
         "password-reset-complete/",
-        auth_views.PasswordResetCompleteView.as_view(
+        PasswordResetCompleteView.as_view(
             template_name="accounts/password_reset_complete.html"
         ),
         name="password_reset_complete",
     ),
     path(
         "password_change/",
-        auth_views.PasswordChangeView.as_view(
+        PasswordChangeView.as_view(
             template_name="accounts/password_change.html"
         ),
         name="password_change",
@@ -1,48 +1,497 @@
-from django import forms
+import hashlib
+import json
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, get_user_model, login
+from django.contrib.auth import views as auth_views
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import redirect, render
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils.crypto import constant_time_compare
+from django.db.models import Count, Max, Prefetch
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import urlencode
 from django.views import View
 from django.views.generic.edit import CreateView, FormView
+from rest_framework.exceptions import Throttled
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from server.routers import use_replica
 
-from .forms import CustomUserCreationForm, SelectUserTypeForm
-from .models import CustomUser
+from . import audit, availability
+from .bulk import FORMATS, export_users
+from .forms import (
+    CustomUserCreationForm,
+    SelectUserTypeForm,
+    read_user_type,
+    sign_user_type,
+)
+from .geo import enricher
+from .hashers import aauthenticate, amake_password
+from .jwks import get_key_set
+from .metrics import render_metrics
+from .models import AuditEvent, CustomUser, UserImport, normalize_email
+from .pages import CachedPageMixin, render_page
+from .permissions import IsServiceClient
+from .ratelimit import login_throttle, throttle
+from .serializers import UserLookupSerializer
 
 USER = get_user_model()
 
 
-class UserTypeView(FormView):
+async def aload_session(request):
+    """
+    Loads the request's session off the event loop, so that async views can
+    then use `request.session` without blocking it. Without a session cookie
+    there is nothing to load.
+    """
+    if request.session.session_key is not None:
+        await sync_to_async(request.session.keys)()
+
+
+async def aload_user(request):
+    """
+    Like aload_session(), also loading the user logged in to the session
+    for `request.user`.
+    """
+    if request.session.session_key is not None:
+        await sync_to_async(lambda: request.user.is_authenticated)()
+
+
+class UserTypeView(CachedPageMixin, FormView):
     template_name = "accounts/user_type.html"
     form_class = SelectUserTypeForm
     success_url = reverse_lazy("registration")
 
     def form_valid(self, form):
-        # Process the data in form.cleaned_data
-        # For example, you might save the user type to the session
-        self.request.session["user_type"] = form.cleaned_data["select_type"]
+        # Carried to the registration page in its URL rather than the
+        # session, so choosing a type creates no session row
+        self.state = sign_user_type(form.cleaned_data["select_type"])
         return super().form_valid(form)
 
+    def get_success_url(self):
+        return "%s?%s" % (self.success_url, urlencode({"state": self.state}))
+
+
+class UserRegistrationView(CachedPageMixin, CreateView):
+    """
+    Registration form for the user type signed into the `state` parameter
+    by UserTypeView. Without a state the form has no parent field, and a
+    state that no longer verifies is sent back to the user type page.
+    """
 
-class UserRegistrationView(CreateView):
     template_name = "accounts/registration.html"
     form_class = CustomUserCreationForm
     success_url = reverse_lazy("login")
 
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        state = request.GET.get("state")
+        self.user_type = read_user_type(state) if state else None
+        self.state_expired = bool(state) and self.user_type is None
+
+    @use_replica
+    def get(self, request, *args, **kwargs):
+        if self.state_expired:
+            return redirect("user_type")
+        return super().get(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        if self.state_expired:
+            return redirect("user_type")
+        return super().post(request, *args, **kwargs)
+
+    def parents_exist(self):
+        return CustomUser.objects.filter(is_parent=True).exists()
+
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
-        user_type = self.request.session.get("user_type")
-        if user_type == "0" and CustomUser.objects.filter(is_parent=True).exists():
-            queryset = CustomUser.objects.filter(is_parent=True)
-            choices = [("", "Select Parent")] + list(
-                queryset.values_list("id", "email")
+        if self.user_type == "0" and self.parents_exist():
+            form.require_parent()
+        return form
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        audit.record(AuditEvent.REGISTERED, self.request, self.object)
+        enricher.submit(self.object, self.request.META.get("REMOTE_ADDR"))
+        return response
+
+    def get_page_key(self, context):
+        return (self.user_type, "parent_user" in context["form"].fields)
+
+
+class AsyncUserTypeView(UserTypeView):
+    """
+    UserTypeView for the ASGI app, handled on the event loop.
+    """
+
+    http_method_names = ["get", "post", "head", "options"]
+
+    async def get(self, request, *args, **kwargs):
+        # For is_cacheable(), which checks request.user
+        await aload_user(request)
+        return super().get(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        # The choice goes into the success URL, the session isn't used
+        return super().post(request, *args, **kwargs)
+
+
+class AsyncUserRegistrationView(UserRegistrationView):
+    """
+    UserRegistrationView for the ASGI app. The password is hashed on the
+    bounded hashing pool, only validation and saving run on a thread.
+    """
+
+    http_method_names = ["get", "post", "head", "options"]
+    _parents_exist = False
+
+    async def load(self, request, load_user):
+        await (aload_user if load_user else aload_session)(request)
+        if self.user_type == "0":
+            self._parents_exist = await CustomUser.objects.filter(
+                is_parent=True
+            ).aexists()
+
+    def parents_exist(self):
+        # Looked up by load() before the form is built
+        return self._parents_exist
+
+    @use_replica
+    async def get(self, request, *args, **kwargs):
+        # For is_cacheable(), which checks request.user
+        await self.load(request, load_user=True)
+        return super().get(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        if self.state_expired:
+            return redirect("user_type")
+        await self.load(request, load_user=False)
+        self.object = None
+        form = self.get_form()
+        # The uniqueness and parent checks query the database
+        if not await sync_to_async(form.is_valid)():
+            return self.form_invalid(form)
+        password_hash = await amake_password(form.cleaned_data["password1"])
+        self.object = await sync_to_async(form.save)(password_hash=password_hash)
+        audit.record(AuditEvent.REGISTERED, request, self.object)
+        enricher.submit(self.object, request.META.get("REMOTE_ADDR"))
+        return HttpResponseRedirect(self.get_success_url())
+
+
+class PasswordResetView(CachedPageMixin, auth_views.PasswordResetView):
+    def form_valid(self, form):
+        audit.record(
+            AuditEvent.PASSWORD_RESET_REQUESTED,
+            self.request,
+            email=form.cleaned_data["email"],
+        )
+        return super().form_valid(form)
+
+
+class PasswordResetConfirmView(auth_views.PasswordResetConfirmView):
+    def form_valid(self, form):
+        audit.record(AuditEvent.PASSWORD_RESET, self.request, form.user)
+        return super().form_valid(form)
+
+
+class PasswordChangeView(auth_views.PasswordChangeView):
+    def form_valid(self, form):
+        audit.record(AuditEvent.PASSWORD_CHANGED, self.request, form.user)
+        return super().form_valid(form)
+
+
+class PasswordResetDoneView(CachedPageMixin, auth_views.PasswordResetDoneView):
+    pass
+
+
+class PasswordResetCompleteView(
+    CachedPageMixin, auth_views.PasswordResetCompleteView
+):
+    pass
+
+
+class ParentSearchView(APIView):
+    """
+    Typeahead over parent emails for the registration form.
+
+    Matches are served in email order from the (is_parent, email) index and
+    paged with a keyset cursor: `after` is the last email of the previous
+    page, so every page is a single index range scan. Open to anyone, so
+    limited per client IP to keep the parents' emails from being paged out.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    page_size = 20
+    min_query_length = 3
+
+    def check_throttles(self, request):
+        retry_after = throttle(
+            "parent_search:ip",
+            request.META.get("REMOTE_ADDR"),
+            settings.PARENT_SEARCH_RATE_IP,
+        )
+        if retry_after:
+            raise Throttled(retry_after)
+
+    @use_replica
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get("q", "").strip().lower()
+        if len(query) < self.min_query_length:
+            return Response({"results": [], "next": None})
+        queryset = CustomUser.objects.filter(is_parent=True, email__startswith=query)
+        after = request.query_params.get("after")
+        if after:
+            queryset = queryset.filter(email__gt=after.lower())
+        results = list(
+            queryset.order_by("email").values("id", "email")[: self.page_size + 1]
+        )
+        next_url = None
+        if len(results) > self.page_size:
+            results = results[: self.page_size]
+            next_url = "%s?%s" % (
+                reverse("parent_search"),
+                urlencode({"q": query, "after": results[-1]["email"]}),
+            )
+        return Response({"results": results, "next": next_url})
+
+
+class RegistrationAPIView(APIView):
+    """
+    The user type and registration pages in a single call, for clients
+    that post JSON: takes `user_type` along with the registration fields
+    and answers with the new user, or with the errors of each field.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        type_form = SelectUserTypeForm({"select_type": request.data.get("user_type")})
+        form = CustomUserCreationForm(request.data)
+        if (
+            type_form.is_valid()
+            and type_form.cleaned_data["select_type"] == "0"
+            and CustomUser.objects.filter(is_parent=True).exists()
+        ):
+            form.require_parent()
+        if not (type_form.is_valid() and form.is_valid()):
+            errors = {name: list(errors) for name, errors in form.errors.items()}
+            if type_form.errors:
+                errors["user_type"] = list(type_form.errors["select_type"])
+            return Response(errors, status=400)
+        user = form.save()
+        audit.record(AuditEvent.REGISTERED, request, user)
+        enricher.submit(user, request.META.get("REMOTE_ADDR"))
+        return Response(
+            {"id": user.pk, "user_hash": user.user_hash, "email": user.email},
+            status=201,
+        )
+
+
+class AvailabilityView(APIView):
+    """
+    Whether emails and phone numbers are still free to register, for
+    checking the registration form as the user types. Takes `emails` and
+    `phone_numbers`, as comma-separated query parameters or as JSON lists in
+    a POST body, and answers for all of them with at most one query, see
+    accounts/availability.py. Small batches and AVAILABILITY_RATE_IP keep it
+    from being used to enumerate accounts.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    max_batch = 10
+    names = ("emails", "phone_numbers")
+
+    def check_throttles(self, request):
+        retry_after = throttle(
+            "availability:ip",
+            request.META.get("REMOTE_ADDR"),
+            settings.AVAILABILITY_RATE_IP,
+        )
+        if retry_after:
+            raise Throttled(retry_after)
+
+    @use_replica
+    def get(self, request, *args, **kwargs):
+        params = {
+            name: [value for value in request.query_params[name].split(",") if value]
+            for name in self.names
+            if name in request.query_params
+        }
+        return self.check(params)
+
+    @use_replica
+    def post(self, request, *args, **kwargs):
+        return self.check(request.data)
+
+    def check(self, params):
+        for name in self.names:
+            values = params.get(name, [])
+            if not isinstance(values, list) or not all(
+                isinstance(value, str) for value in values
+            ):
+                return Response(
+                    {"detail": "%s must be a list of strings." % name}, status=400
+                )
+        emails = params.get("emails", [])
+        phone_numbers = params.get("phone_numbers", [])
+        if len(emails) + len(phone_numbers) > self.max_batch:
+            return Response(
+                {"detail": "At most %d values per request." % self.max_batch},
+                status=400,
+            )
+        taken_emails, taken_phone_numbers = availability.check(
+            map(normalize_email, emails), (value.strip() for value in phone_numbers)
+        )
+        return Response(
+            {
+                "emails": {
+                    email: normalize_email(email) not in taken_emails
+                    for email in emails
+                },
+                "phone_numbers": {
+                    phone_number: phone_number.strip() not in taken_phone_numbers
+                    for phone_number in phone_numbers
+                },
+            }
+        )
+
+
+class UserResolveView(APIView):
+    """
+    Resolves a list of `user_hashes` to public user details in one indexed
+    query, for services that only hold the `user_hash` token claim. Only
+    service clients may call it.
+    """
+
+    permission_classes = [IsServiceClient]
+    max_hashes = 1000
+    fields = (
+        "user_hash",
+        "first_name",
+        "last_name",
+        "is_student",
+        "is_parent",
+        "is_active",
+    )
+
+    @use_replica
+    def post(self, request, *args, **kwargs):
+        hashes = request.data.get("user_hashes")
+        if not isinstance(hashes, list) or not all(
+            isinstance(user_hash, str) for user_hash in hashes
+        ):
+            return Response(
+                {"detail": "user_hashes must be a list of strings."}, status=400
             )
-            form.fields["parent_user"] = forms.ChoiceField(
-                choices=choices,
-                label="Select Parent",
-                required=True,
+        if len(hashes) > self.max_hashes:
+            return Response(
+                {"detail": "At most %d user_hashes per request." % self.max_hashes},
+                status=400,
             )
-        return form
+        wanted = set(hashes)
+        users = {
+            user["user_hash"]: user
+            for user in CustomUser.objects.filter(user_hash__in=wanted).values(
+                *self.fields
+            )
+        }
+        return Response({"users": users, "missing": sorted(wanted - users.keys())})
+
+
+class UserLookupView(APIView):
+    """
+    Batched user profiles for other services.
+
+    Takes `ids` or `hashes` and optional `fields`, as comma-separated query
+    parameters or as JSON lists in a POST body. Relations are loaded with
+    one prefetch query each. The ETag is derived from the users' count and
+    latest updated_at, so a matching If-None-Match is answered with a 304
+    after a single aggregate query. Only service clients may call it.
+    """
+
+    permission_classes = [IsServiceClient]
+    max_batch = 500
+    default_fields = ("id", "user_hash", "first_name", "last_name")
+
+    @use_replica
+    def get(self, request, *args, **kwargs):
+        params = {
+            name: [value for value in request.query_params[name].split(",") if value]
+            for name in ("ids", "hashes", "fields")
+            if name in request.query_params
+        }
+        return self.lookup(request, params)
+
+    @use_replica
+    def post(self, request, *args, **kwargs):
+        return self.lookup(request, request.data)
+
+    def lookup(self, request, params):
+        fields = params.get("fields") or self.default_fields
+        unknown = set(fields) - set(UserLookupSerializer.Meta.fields)
+        if unknown:
+            return Response(
+                {"detail": "Unknown fields: %s." % ", ".join(map(str, unknown))},
+                status=400,
+            )
+        if params.get("ids"):
+            lookup, attname = "pk__in", "pk"
+            try:
+                keys = [int(key) for key in params["ids"]]
+            except (TypeError, ValueError):
+                return Response({"detail": "ids must be integers."}, status=400)
+        elif params.get("hashes"):
+            lookup, attname = "user_hash__in", "user_hash"
+            keys = [str(key) for key in params["hashes"]]
+        else:
+            return Response({"detail": "Pass ids or hashes."}, status=400)
+        keys = list(dict.fromkeys(keys))
+        if len(keys) > self.max_batch:
+            return Response(
+                {"detail": "At most %d users per request." % self.max_batch},
+                status=400,
+            )
+
+        queryset = CustomUser.objects.filter(**{lookup: keys})
+        version = queryset.aggregate(count=Count("pk"), updated=Max("updated_at"))
+        etag = '"%s"' % hashlib.sha256(
+            json.dumps([attname, keys, sorted(fields), version], default=str).encode()
+        ).hexdigest()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            relations = [
+                name for name in fields if name in UserLookupSerializer.relations
+            ]
+            scalars = [name for name in fields if name not in relations]
+            queryset = queryset.only("pk", "user_hash", *scalars).prefetch_related(
+                *(
+                    Prefetch(name, CustomUser.objects.only("pk", "user_hash"))
+                    for name in relations
+                )
+            )
+            users = {getattr(user, attname): user for user in queryset}
+            serializer = UserLookupSerializer(
+                [users[key] for key in keys if key in users], many=True, fields=fields
+            )
+            response = Response(
+                {
+                    "users": serializer.data,
+                    "missing": [key for key in keys if key not in users],
+                }
+            )
+        response["ETag"] = etag
+        return response
 
 
 class LoginView(View):
@@ -51,9 +500,31 @@ class LoginView(View):
     def get(self, request, *args, **kwargs):
         if request.user.is_authenticated:
             return redirect("registration")
-        return render(request, self.template_name)
+        return render_page(request, self.template_name)
+
+    def throttled(self, request, retry_after):
+        audit.record(
+            AuditEvent.LOGIN_THROTTLED,
+            request,
+            email=request.POST.get("email"),
+            retry_after=retry_after,
+        )
+        messages.error(
+            request,
+            "Too many login attempts, try again in %d seconds" % retry_after,
+        )
+        response = render(request, self.template_name, status=429)
+        response["Retry-After"] = str(retry_after)
+        return response
 
+    @use_replica
     def post(self, request, *args, **kwargs):
+        # Rejected before authenticate(), so throttled attempts never hash
+        retry_after = login_throttle.check(
+            request.META.get("REMOTE_ADDR"), str(request.POST.get("email", "")).lower()
+        )
+        if retry_after:
+            return self.throttled(request, retry_after)
         try:
             email = request.POST.get("email")
             password = request.POST.get("password")
@@ -62,6 +533,7 @@ class LoginView(View):
                     request=request, username=str(email).lower(), password=password
                 )
                 if user is not None:
+                    login_throttle.success(str(email).lower())
                     if user.is_active:
                         login(request, user)
                         next_url = request.GET.get("next")
@@ -75,9 +547,223 @@ class LoginView(View):
                             "Your account is currently inactive.",
                         )
                 else:
+                    login_throttle.failure(str(email).lower())
                     messages.error(request, "Email or password is incorrect")
             else:
                 messages.error(request, "Email and password are required")
         except Exception as e:
+            audit.record(
+                AuditEvent.LOGIN_ERROR,
+                request,
+                email=request.POST.get("email"),
+                error=type(e).__name__,
+            )
             messages.error(request, "An error occurred while logging in")
         return render(request, self.template_name)
+
+
+class AsyncLoginView(LoginView):
+    """
+    LoginView for the ASGI app. Password hashing runs on the bounded hashing
+    pool, so a burst of logins doesn't block other requests, and the view
+    only leaves the event loop to load the session, count the attempt and
+    log the user in.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        await aload_user(request)
+        if request.user.is_authenticated:
+            return redirect("registration")
+        return render_page(request, self.template_name)
+
+    def authenticated(self, request, user, email):
+        login_throttle.success(email)
+        if user.is_active:
+            login(request, user)
+
+    @use_replica
+    async def post(self, request, *args, **kwargs):
+        await aload_session(request)
+        retry_after = await sync_to_async(login_throttle.check)(
+            request.META.get("REMOTE_ADDR"), str(request.POST.get("email", "")).lower()
+        )
+        if retry_after:
+            return self.throttled(request, retry_after)
+        try:
+            email = request.POST.get("email")
+            password = request.POST.get("password")
+            if email and password:
+                user = await aauthenticate(
+                    request=request, username=str(email).lower(), password=password
+                )
+                if user is not None:
+                    await sync_to_async(self.authenticated)(
+                        request, user, str(email).lower()
+                    )
+                    if user.is_active:
+                        next_url = request.GET.get("next")
+                        if next_url:
+                            return redirect(next_url)
+                        else:
+                            return redirect("registration")
+                    else:
+                        messages.error(
+                            request,
+                            "Your account is currently inactive.",
+                        )
+                else:
+                    await sync_to_async(login_throttle.failure)(str(email).lower())
+                    messages.error(request, "Email or password is incorrect")
+            else:
+                messages.error(request, "Email and password are required")
+        except Exception as e:
+            audit.record(
+                AuditEvent.LOGIN_ERROR,
+                request,
+                email=request.POST.get("email"),
+                error=type(e).__name__,
+            )
+            messages.error(request, "An error occurred while logging in")
+        return render(request, self.template_name)
+
+
+class VerifyingKeyView(APIView):
+    """
+    Publishes the key other services use to verify access tokens locally.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        key_set = get_key_set()
+        if key_set is None:
+            # Symmetric keys are the signing secret and must never be published
+            return Response(
+                {"detail": "Tokens are not signed with a public key."}, status=404
+            )
+        return Response(
+            {
+                "kid": key_set.active.kid,
+                "algorithm": key_set.active.algorithm,
+                "verifying_key": key_set.active.public_pem,
+                "issuer": jwt_settings.ISSUER,
+                "audience": jwt_settings.AUDIENCE,
+            }
+        )
+
+
+class JWKSView(APIView):
+    """
+    Serves the public signing keys as a JWK set, including retired keys whose
+    tokens have not expired yet.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        key_set = get_key_set()
+        response = Response(key_set.as_jwks() if key_set else {"keys": []})
+        patch_cache_control(response, public=True, max_age=settings.JWKS_CACHE_TTL)
+        return response
+
+
+class MetricsView(View):
+    """
+    Exposes this worker process's request metrics to a Prometheus scraper,
+    only to callers with METRICS_TOKEN.
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not settings.METRICS_TOKEN:
+            return HttpResponse(status=403)
+        if not constant_time_compare(
+            request.headers.get("Authorization", ""),
+            "Bearer %s" % settings.METRICS_TOKEN,
+        ):
+            return HttpResponse(status=401)
+        return HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
+class UserImportView(APIView):
+    """
+    Queues the users in an uploaded CSV or JSON lines `file` for
+    `manage.py process_imports`, see UserImportStatusView for the report.
+    """
+
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"detail": "No file was uploaded."}, status=400)
+        fmt = request.data.get("format") or os.path.splitext(upload.name)[1][1:]
+        if fmt not in FORMATS:
+            return Response(
+                {"detail": "Format must be one of %s." % ", ".join(FORMATS)},
+                status=400,
+            )
+        if upload.size > settings.IMPORT_MAX_UPLOAD_SIZE:
+            return Response(
+                {
+                    "detail": "The file must be at most %s bytes."
+                    % settings.IMPORT_MAX_UPLOAD_SIZE
+                },
+                status=413,
+            )
+        job = UserImport.objects.create(
+            format=fmt, file=upload, created_by=request.user
+        )
+        return Response(
+            {
+                "id": job.pk,
+                "status": job.status,
+                "url": reverse("user_import_status", args=[job.pk]),
+            },
+            status=202,
+        )
+
+
+class UserImportStatusView(APIView):
+    """
+    Reports a queued import's status, and once it ran the rows that were
+    rejected.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, pk, *args, **kwargs):
+        job = UserImport.objects.filter(pk=pk).first()
+        if job is None:
+            return Response(status=404)
+        return Response(
+            {
+                "id": job.pk,
+                "status": job.status,
+                "created_at": job.created_at,
+                "finished_at": job.finished_at,
+                "report": job.report,
+            }
+        )
+
+
+class UserExportView(APIView):
+    """
+    Streams every user out as CSV or JSON lines.
+    """
+
+    permission_classes = [IsAdminUser]
+    content_types = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+    def get(self, request, fmt, *args, **kwargs):
+        if fmt not in FORMATS:
+            return Response(status=404)
+        response = StreamingHttpResponse(
+            export_users(fmt), content_type=self.content_types[fmt]
+        )
+        response["Content-Disposition"] = 'attachment; filename="users.%s"' % fmt
+        return response
@@ -0,0 +1,87 @@
+"""
+Background threads that take writes off the request path.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWorker:
+    """
+    Writes the items handed to put() on a daemon thread, in batches of up to
+    `batch_size`. Once the first item of a batch arrives the thread waits up
+    to `linger` seconds for more, trading a little delay for fewer, larger
+    writes. put() never blocks: items beyond `queue_size` are refused.
+    """
+
+    name = "batch-worker"
+    batch_size = 100
+    linger = 0
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        """
+        Queues `item`, returning False when the queue is full.
+        """
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            return False
+        self._ensure_thread()
+        return True
+
+    def flush(self):
+        """
+        Blocks until every item queued so far is written.
+        """
+        if self.queue.unfinished_tasks:
+            self._ensure_thread()
+            self.queue.join()
+
+    def _ensure_thread(self):
+        with self._lock:
+            # Also restarts the thread in a process forked after it started
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.run, name=self.name, daemon=True
+                )
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.write(batch)
+            except Exception:
+                logger.exception("%s failed to write %d items", self.name, len(batch))
+            finally:
+                close_old_connections()
+                for _ in batch:
+                    self.queue.task_done()
+
+    def write(self, batch):
+        raise NotImplementedError
@@ -0,0 +1,18 @@
+#!/bin/sh
+# Serves the ASGI app, and with it the async accounts views, under uvicorn.
+# Each worker is one process running one event loop: an idle keep-alive
+# connection costs a socket rather than a thread, so the limits below are
+# set by memory and file descriptors. Password hashing runs on each worker's
+# PASSWORD_HASH_WORKERS threads. Extra arguments are passed to uvicorn.
+set -e
+cd "$(dirname "$0")"
+exec uvicorn server.asgi:application \
+    --host "${ASGI_HOST:-0.0.0.0}" \
+    --port "${ASGI_PORT:-8000}" \
+    --workers "${ASGI_WORKERS:-4}" \
+    --limit-concurrency "${ASGI_LIMIT_CONCURRENCY:-4000}" \
+    --backlog "${ASGI_BACKLOG:-2048}" \
+    --timeout-keep-alive "${ASGI_KEEPALIVE_SECONDS:-15}" \
+    --lifespan off \
+    --no-access-log \
+    "$@"
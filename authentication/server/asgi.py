@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+# Route to the async views, which hash passwords off the event loop
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
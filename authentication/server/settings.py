@@ -53,10 +53,12 @@ INSTALLED_APPS = [
     "accounts",
     "rest_framework",
     "rest_framework_simplejwt",
+    "rest_framework_simplejwt.token_blacklist",
     "corsheaders",
 ]
 
 MIDDLEWARE = [
+    "accounts.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -71,10 +73,21 @@ ROOT_URLCONF = "server.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # DjangoTemplates, with rendering time reported to accounts.metrics
+        "BACKEND": "accounts.metrics.TimedDjangoTemplates",
         "DIRS": [os.path.join(BASE_DIR, "templates")],
-        "APP_DIRS": True,
         "OPTIONS": {
+            # Templates are compiled once per process, in DEBUG too, where the
+            # autoreloader clears the cache when a template changes
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                )
+            ],
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
@@ -87,29 +100,66 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "server.wsgi.application"
 
+# Serve anonymous GETs of the accounts pages from a per-process page cache
+# with ETags, see accounts/pages.py. Off in DEBUG, where templates change.
+PAGE_CACHE = env.bool("PAGE_CACHE", default=not DEBUG)
+
+# Request metrics, scraped from /metrics in the Prometheus text format.
+# METRICS_TOKEN must be sent as "Authorization: Bearer <token>", the
+# endpoint is closed while it is empty.
+# A METRICS_TRACE_SAMPLE_RATE share of requests slower than
+# METRICS_SLOW_REQUEST_SECONDS is logged with its queries.
+METRICS_TOKEN = env("METRICS_TOKEN", default="")
+METRICS_SLOW_REQUEST_SECONDS = env.float("METRICS_SLOW_REQUEST_SECONDS", default=1.0)
+METRICS_TRACE_SAMPLE_RATE = env.float("METRICS_TRACE_SAMPLE_RATE", default=0.1)
+
+# Serve the async views, set by server/asgi.py. serve_asgi.sh runs the ASGI
+# app under uvicorn.
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=False)
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-# For sqlite3 database
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DB_ENGINE=postgresql selects the production profile: persistent connections,
+# optionally through a transaction pooler such as PgBouncer (DB_POOLER=True),
+# and read replicas listed in DB_REPLICA_HOSTS, see server/routers.py
+DB_ENGINE = env("DB_ENGINE", default="sqlite")
+
+if DB_ENGINE == "postgresql":
+    POSTGRES_DATABASE = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": env("DB_NAME"),
+        "USER": env("DB_USER"),
+        "PASSWORD": env("DB_PASSWORD"),
+        "HOST": env("DB_HOST"),
+        "PORT": env("DB_PORT"),
+        # Under ASGI each request's sync code runs on a thread of its own, so
+        # a persistent connection would never be reused; pool with DB_POOLER
+        "CONN_MAX_AGE": env.int("DB_CONN_MAX_AGE", default=0 if ASYNC_VIEWS else 60),
+        "CONN_HEALTH_CHECKS": True,
+        # Server-side cursors don't survive transaction pooling
+        "DISABLE_SERVER_SIDE_CURSORS": env.bool("DB_POOLER", default=False),
     }
-}
+    DATABASES = {"default": POSTGRES_DATABASE}
+    for index, host in enumerate(env.list("DB_REPLICA_HOSTS", default=[])):
+        DATABASES["replica_%d" % index] = {
+            **POSTGRES_DATABASE,
+            "HOST": host,
+            "TEST": {"MIRROR": "default"},
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+        }
+    }
+
+DATABASE_ROUTERS = ["server.routers.ReplicaRouter"]
 
-# For PostgreSQL Database
-# DATABASES = {
-#     "default": {
-#         "ENGINE": "django.db.backends.postgresql_psycopg2",
-#         "NAME": env("DB_NAME"),
-#         "USER": env("DB_USER"),
-#         "PASSWORD": env("DB_PASSWORD"),
-#         "HOST": env("DB_HOST"),
-#         "PORT": env("DB_PORT"),
-#     }
-# }
+# Cache
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
 
 # JWT Configuration
 REST_FRAMEWORK = {
@@ -118,7 +168,53 @@ REST_FRAMEWORK = {
     )
 }
 
-# Password validation
+# Authentication
+# Authenticated requests load the user from accounts.cache: an in-process LRU
+# trusted for USER_CACHE_LOCAL_TTL seconds in front of the shared cache
+AUTHENTICATION_BACKENDS = ["accounts.backends.CachedModelBackend"]
+USER_CACHE_TIMEOUT = env.int("USER_CACHE_TIMEOUT", default=300)
+USER_CACHE_LOCAL_SIZE = env.int("USER_CACHE_LOCAL_SIZE", default=1024)
+USER_CACHE_LOCAL_TTL = env.float("USER_CACHE_LOCAL_TTL", default=5)
+
+# Geolocation of users' IPs on login and registration, see accounts/geo.py.
+# GEOIP_DATABASE is a file written by `manage.py build_geoip`, empty to
+# disable. GEOIP_CACHE_SIZE recent IPs are kept per process.
+GEOIP_DATABASE = env("GEOIP_DATABASE", default="")
+GEOIP_CACHE_SIZE = env.int("GEOIP_CACHE_SIZE", default=10000)
+GEOIP_BATCH_SIZE = env.int("GEOIP_BATCH_SIZE", default=100)
+GEOIP_QUEUE_SIZE = env.int("GEOIP_QUEUE_SIZE", default=10000)
+
+# Audit log of logins and account events, see accounts/audit.py. Events are
+# buffered and appended in batches every AUDIT_FLUSH_SECONDS, to the
+# AuditEvent table (AUDIT_SINK=db) or to a JSONL file per day in
+# AUDIT_LOG_DIR (AUDIT_SINK=jsonl); empty to disable. `manage.py prune_audit`
+# drops events older than AUDIT_RETENTION_DAYS.
+AUDIT_SINK = env("AUDIT_SINK", default="db")
+AUDIT_LOG_DIR = env("AUDIT_LOG_DIR", default="") or str(BASE_DIR / "audit")
+AUDIT_BATCH_SIZE = env.int("AUDIT_BATCH_SIZE", default=500)
+AUDIT_FLUSH_SECONDS = env.float("AUDIT_FLUSH_SECONDS", default=1.0)
+AUDIT_QUEUE_SIZE = env.int("AUDIT_QUEUE_SIZE", default=10000)
+AUDIT_RETENTION_DAYS = env.int("AUDIT_RETENTION_DAYS", default=90)
+
+# Bulk user imports, see accounts/bulk.py. Uploads are refused over
+# IMPORT_MAX_UPLOAD_SIZE bytes and kept in IMPORT_DIR until
+# `manage.py process_imports` has run them.
+IMPORT_DIR = env("IMPORT_DIR", default="") or str(BASE_DIR / "imports")
+IMPORT_MAX_UPLOAD_SIZE = env.int("IMPORT_MAX_UPLOAD_SIZE", default=50 * 1024 * 1024)
+
+# Login throttling, see accounts/ratelimit.py
+# Rates are "<attempts>/<seconds>", empty to disable. RATELIMIT_BACKEND is
+# "cache" to share counters between workers or "local" for per-process ones.
+RATELIMIT_BACKEND = env("RATELIMIT_BACKEND", default="cache")
+LOGIN_RATE_IP = env("LOGIN_RATE_IP", default="30/60")
+LOGIN_RATE_EMAIL = env("LOGIN_RATE_EMAIL", default="10/300")
+LOGIN_RATE_GLOBAL = env("LOGIN_RATE_GLOBAL", default="200/1")
+# Failed logins before an email is locked, for a period doubling per failure
+LOGIN_LOCKOUT_THRESHOLD = env.int("LOGIN_LOCKOUT_THRESHOLD", default=5)
+LOGIN_LOCKOUT_SECONDS = env.int("LOGIN_LOCKOUT_SECONDS", default=30)
+LOGIN_LOCKOUT_MAX_SECONDS = env.int("LOGIN_LOCKOUT_MAX_SECONDS", default=3600)
+LOGIN_LOCKOUT_RESET_SECONDS = env.int("LOGIN_LOCKOUT_RESET_SECONDS", default=86400)
+
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -137,6 +233,26 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# PASSWORD_HASHER picks the hasher for new passwords. The others are kept so
+# existing hashes still verify, and are upgraded on the user's next login,
+# as are hashes made with a lower cost than configured below.
+PASSWORD_HASHER = env("PASSWORD_HASHER", default="pbkdf2_sha256")
+PASSWORD_HASHER_CLASSES = {
+    "pbkdf2_sha256": "accounts.hashers.PBKDF2PasswordHasher",
+    "scrypt": "accounts.hashers.ScryptPasswordHasher",
+    "argon2": "accounts.hashers.Argon2PasswordHasher",
+}
+PASSWORD_HASHERS = [PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    path for name, path in PASSWORD_HASHER_CLASSES.items() if name != PASSWORD_HASHER
+]
+PBKDF2_ITERATIONS = env.int("PBKDF2_ITERATIONS", default=600000)
+SCRYPT_WORK_FACTOR = env.int("SCRYPT_WORK_FACTOR", default=2**14)
+ARGON2_TIME_COST = env.int("ARGON2_TIME_COST", default=2)
+ARGON2_MEMORY_COST = env.int("ARGON2_MEMORY_COST", default=102400)
+# Threads async views hash passwords on, see accounts.hashers.get_hash_pool
+PASSWORD_HASH_WORKERS = env.int("PASSWORD_HASH_WORKERS", default=4)
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -164,6 +280,19 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # Custom User Model
 AUTH_USER_MODEL = "accounts.CustomUser"
+# Key for the public user hash, see accounts.models.make_user_hash. Changing
+# it only affects users created afterwards.
+USER_HASH_KEY = env("USER_HASH_KEY", default=SECRET_KEY)
+
+# JWT signing keys
+# With JWT_PRIVATE_KEY_FILE set (RSA, P-256 or Ed25519 PEM), tokens are signed
+# with that key and carry its `kid`; other services verify them against
+# /.well-known/jwks.json. Public keys of rotated-out signing keys stay in the
+# JWKS until the tokens they signed have expired.
+JWT_PRIVATE_KEY_FILE = env("JWT_PRIVATE_KEY_FILE", default="")
+JWT_RETIRED_PUBLIC_KEY_FILES = env.list("JWT_RETIRED_PUBLIC_KEY_FILES", default=[])
+# Seconds a verifier keeps keys fetched from JWK_URL
+JWKS_CACHE_TTL = env.int("JWKS_CACHE_TTL", default=300)
 
 # JWT Settings
 SIMPLE_JWT = {
@@ -172,13 +301,14 @@ SIMPLE_JWT = {
     "ROTATE_REFRESH_TOKENS": False,
     "BLACKLIST_AFTER_ROTATION": False,
     "UPDATE_LAST_LOGIN": False,
-    "ALGORITHM": "SHA-256",
+    # HMAC fallback, replaced by accounts.jwks when JWT_PRIVATE_KEY_FILE is set
+    "ALGORITHM": "HS256",
     "SIGNING_KEY": SECRET_KEY,
     "VERIFYING_KEY": "",
     "AUDIENCE": None,
     "ISSUER": None,
     "JSON_ENCODER": None,
-    "JWK_URL": None,
+    "JWK_URL": env("JWT_JWK_URL", default=None),
     "LEEWAY": 0,
     "AUTH_HEADER_TYPES": ("Bearer",),
     "AUTH_HEADER_NAME": "HTTP_AUTHORIZATION",
@@ -192,7 +322,7 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_EXP_CLAIM": "refresh_exp",
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=30),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
-    "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
+    "TOKEN_OBTAIN_SERIALIZER": "accounts.serializers.CustomTokenObtainPairSerializer",
     "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
@@ -214,13 +344,62 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = (
     True  # optional, as this will log you out when browser is closed
 )
 SESSION_COOKIE_AGE = 300  # 0r 5 * 60, same thing
-SESSION_SAVE_EVERY_REQUEST = True  # Will prevent from logging you out after 300 seconds
+# Sliding expiry without a session write on every request: the session is
+# only rewritten once SESSION_RENEW_FRACTION of SESSION_COOKIE_AGE has passed
+SESSION_ENGINE = env("SESSION_ENGINE", default="accounts.sessions.cached_db")
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_RENEW_FRACTION = env.float("SESSION_RENEW_FRACTION", default=0.5)
+
+# Seconds the signed user type handed from the user type page to the
+# registration page stays valid, see accounts/forms.py
+REGISTRATION_STATE_MAX_AGE = env.int("REGISTRATION_STATE_MAX_AGE", default=3600)
+
+# The availability API rules out free emails and phone numbers with a Bloom
+# filter of this false positive rate, 0 to always query, catches the filter
+# up with new users at most every AVAILABILITY_BLOOM_REFRESH seconds and
+# rebuilds it every AVAILABILITY_BLOOM_REBUILD seconds, for changed emails
+# and phone numbers
+AVAILABILITY_BLOOM_ERROR_RATE = env.float(
+    "AVAILABILITY_BLOOM_ERROR_RATE", default=0.01
+)
+AVAILABILITY_BLOOM_REFRESH = env.float("AVAILABILITY_BLOOM_REFRESH", default=5)
+AVAILABILITY_BLOOM_REBUILD = env.float("AVAILABILITY_BLOOM_REBUILD", default=3600)
+# Requests per client IP, as a "<requests>/<seconds>" rate like LOGIN_RATE_IP
+AVAILABILITY_RATE_IP = env("AVAILABILITY_RATE_IP", default="60/60")
+# Parent email typeahead requests per client IP, see ParentSearchView
+PARENT_SEARCH_RATE_IP = env("PARENT_SEARCH_RATE_IP", default="60/60")
+
+# Expired sessions and refresh tokens are deleted by `manage.py
+# collect_expired`, see accounts/cleanup.py: GC_BATCH_SIZE rows per delete,
+# busy for at most GC_DUTY_CYCLE of the time, halving batches that take
+# longer than GC_MAX_BATCH_SECONDS
+GC_BATCH_SIZE = env.int("GC_BATCH_SIZE", default=1000)
+GC_DUTY_CYCLE = env.float("GC_DUTY_CYCLE", default=0.25)
+GC_MAX_BATCH_SECONDS = env.float("GC_MAX_BATCH_SECONDS", default=0.5)
 
 # Email Configuration
 DEFAULT_FROM_EMAIL = env("DEFAULT_FROM_EMAIL")
-EMAIL_BACKEND = env("EMAIL_BACKEND")
+# Requests only queue mail in the outbox, `manage.py send_outbox` delivers it
+# through EMAIL_BACKEND, see accounts/mail.py. EMAIL_OUTBOX=False sends
+# directly from the request instead.
+EMAIL_DELIVERY_BACKEND = env("EMAIL_BACKEND")
+EMAIL_BACKEND = (
+    "accounts.mail.OutboxEmailBackend"
+    if env.bool("EMAIL_OUTBOX", default=True)
+    else EMAIL_DELIVERY_BACKEND
+)
 EMAIL_USE_TLS = env("EMAIL_USE_TLS", cast=bool)
 EMAIL_HOST = env("EMAIL_HOST")
 EMAIL_PORT = env("EMAIL_PORT")
 EMAIL_HOST_USER = env("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = env("EMAIL_HOST_PASSWORD")
+
+# Outbox delivery, retried after OUTBOX_RETRY_SECONDS doubling per attempt
+OUTBOX_BATCH_SIZE = env.int("OUTBOX_BATCH_SIZE", default=100)
+OUTBOX_MAX_ATTEMPTS = env.int("OUTBOX_MAX_ATTEMPTS", default=8)
+OUTBOX_RETRY_SECONDS = env.int("OUTBOX_RETRY_SECONDS", default=30)
+OUTBOX_RETRY_MAX_SECONDS = env.int("OUTBOX_RETRY_MAX_SECONDS", default=3600)
+OUTBOX_LEASE_SECONDS = env.int("OUTBOX_LEASE_SECONDS", default=300)
+# Sent and failed emails are deleted this long after being queued, by
+# `manage.py collect_expired`
+OUTBOX_RETENTION_DAYS = env.int("OUTBOX_RETENTION_DAYS", default=7)
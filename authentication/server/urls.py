@@ -18,7 +18,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 
+from accounts.views import JWKSView, MetricsView
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("accounts/user/", include("accounts.urls")),
+    path(".well-known/jwks.json", JWKSView.as_view(), name="jwks"),
+    path("metrics", MetricsView.as_view(), name="metrics"),
 ]
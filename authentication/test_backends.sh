@@ -0,0 +1,9 @@
+#!/bin/sh
+# Runs the test suite against SQLite and then Postgres. The Postgres run uses
+# the DB_* settings from .env or the environment and needs a reachable server.
+set -e
+cd "$(dirname "$0")"
+for engine in ${TEST_DB_ENGINES:-sqlite postgresql}; do
+    echo "Running tests against $engine"
+    DB_ENGINE=$engine python manage.py test "$@"
+done